@@ -0,0 +1,210 @@
+"""
+This module collects the artifacts of checks (plots, html files of notebooks) from the `dummy` container into the
+artifacts folder (see script.collect_ci_result and .circleci/config.yml).
+
+Instead of one `docker cp` per entity (which copied complete `_data` folders including large tex, pdf or npz files,
+only to delete them afterwards), the artifacts of all checks of a bulk run are fetched with one transfer: a tar
+stream of the common parent directory, whose members are filtered by ARTIFACT_PATTERNS while the stream is read,
+i.e. nothing else is written to disk. (The `dummy` container does not run, i.e. the files can not be selected
+inside of it.)
+
+The files are stored content-addressed in `util.artifact_store_path` and hard-linked into the destination folders
+(and into the result cache), i.e. identical artifacts of different entities and runs are only stored once.
+Files which are not linked anymore are removed by `prune_store()`.
+"""
+
+import os
+import shutil
+import fnmatch
+import hashlib
+import logging
+import tarfile
+import tempfile
+import threading
+import posixpath
+
+from . import util
+from . import docker_backend
+from .util import DockerError
+
+logger = logging.getLogger("ackrep_logger")
+
+# file names which are collected (everything else, e.g. tex, pdf or npz files, is skipped)
+ARTIFACT_PATTERNS = ["*.png", "*.html"]
+
+# container which contains the data repo in CI (volumes can not be mounted there)
+ARTIFACT_CONTAINER = "dummy"
+
+CHUNK_SIZE = 2**16
+
+
+def link_or_copy(src, dst):
+    """create dst as hard link of src (copy if linking is not possible); usable as copy_function of shutil.copytree"""
+    if os.path.lexists(dst):
+        # never write into an existing file, it might be linked to the store
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def store_blob(fileobj, store_path=None):
+    """
+    Read the file object and store its content in the content-addressed store.
+
+    :param fileobj:     readable binary file object
+    :param store_path:  directory of the store (default: util.artifact_store_path)
+
+    :return:            path of the stored file (<store_path>/<hash[:2]>/<hash>)
+    """
+    if store_path is None:
+        store_path = util.artifact_store_path
+    os.makedirs(store_path, exist_ok=True)
+
+    hasher = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_blob_", dir=store_path)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                hasher.update(chunk)
+                f.write(chunk)
+        digest = hasher.hexdigest()
+        blob_path = os.path.join(store_path, digest[:2], digest)
+        if os.path.exists(blob_path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(tmp_path, blob_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return blob_path
+
+
+def prune_store(store_path=None):
+    """
+    Remove the stored files which are not linked anymore (neither from an artifact folder nor from the result cache).
+
+    :return:    number of removed files
+    """
+    if store_path is None:
+        store_path = util.artifact_store_path
+    if not os.path.isdir(store_path):
+        return 0
+
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(store_path):
+        for fname in filenames:
+            fpath = os.path.join(dirpath, fname)
+            if os.stat(fpath).st_nlink == 1:
+                os.remove(fpath)
+                removed += 1
+    return removed
+
+
+def matches_artifact_patterns(path, patterns=None):
+    if patterns is None:
+        patterns = ARTIFACT_PATTERNS
+    fname = posixpath.basename(path)
+    return any(fnmatch.fnmatch(fname, pattern) for pattern in patterns)
+
+
+def _is_below(path, src_path):
+    """True if the (normalized) path equals src_path or is located below it"""
+    return path == src_path or path.startswith(src_path.rstrip("/") + "/")
+
+
+class ArtifactCollector:
+    """
+    Collect the artifacts of several checks (see module docstring). Thread-safe: checks which run concurrently can
+    add their sources, the transfer takes place in `fetch()`.
+    """
+
+    def __init__(self, container=ARTIFACT_CONTAINER, patterns=None):
+        """
+        :param container:   container which contains the sources
+        :param patterns:    file name patterns of the collected files (default: ARTIFACT_PATTERNS)
+        """
+        self.container = container
+        self.patterns = ARTIFACT_PATTERNS if patterns is None else patterns
+        # list of (source path, destination folder, callback)
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def add(self, src_path, dest_folder, callback=None):
+        """
+        :param src_path:    absolute path of a file or directory inside the container, the matching files (below it)
+                            are placed in dest_folder (with their relative paths)
+        :param dest_folder: destination folder (created)
+        :param callback:    None or callable which is called after the transfer with one argument: True if the
+                            transfer succeeded
+        """
+        with self._lock:
+            self.requests.append((posixpath.normpath(src_path), dest_folder, callback))
+
+    def fetch(self):
+        """transfer the artifacts of all added sources, then call their callbacks
+
+        :return:    number of collected files
+        """
+        with self._lock:
+            requests, self.requests = self.requests, []
+        if not requests:
+            return 0
+
+        for src_path, dest_folder, callback in requests:
+            # artifacts of earlier runs must not be mixed with the new ones (see also result_cache.restore_artifacts)
+            if os.path.isdir(dest_folder):
+                shutil.rmtree(dest_folder)
+            os.makedirs(dest_folder)
+
+        # one archive for all sources
+        root = posixpath.commonpath([src_path for src_path, dest_folder, callback in requests])
+        try:
+            collected = self._fetch_archive(root, requests)
+            success = True
+        except (DockerError, tarfile.TarError) as e:
+            logger.warning(f"artifacts of {len(requests)} check(s) could not be collected from {root}: {e}")
+            collected = 0
+            success = False
+
+        logger.info(f"collected {collected} artifact(s) of {len(requests)} check(s) from {self.container}:{root}")
+        for src_path, dest_folder, callback in requests:
+            if callback is not None:
+                callback(success)
+        return collected
+
+    def _fetch_archive(self, root, requests):
+        """transfer the matching files below root to the destinations of the requests, return their number"""
+        # the archive contains the last component of root (and everything below)
+        root_parent = posixpath.dirname(root)
+        collected = 0
+        with docker_backend.get_backend().get_archive(self.container, root) as stream:
+            with tarfile.open(fileobj=stream, mode="r|") as tar:
+                for member in tar:
+                    if not member.isfile() or not matches_artifact_patterns(member.name, self.patterns):
+                        continue
+                    destinations = self._get_destinations(requests, posixpath.join(root_parent, member.name))
+                    if not destinations:
+                        continue
+                    blob_path = store_blob(tar.extractfile(member))
+                    for dest in destinations:
+                        os.makedirs(os.path.dirname(dest), exist_ok=True)
+                        link_or_copy(blob_path, dest)
+                    collected += 1
+        return collected
+
+    @staticmethod
+    def _get_destinations(requests, path):
+        path = posixpath.normpath(path)
+        destinations = []
+        for src_path, dest_folder, callback in requests:
+            if path == src_path:
+                destinations.append(os.path.join(dest_folder, posixpath.basename(path)))
+            elif _is_below(path, src_path):
+                destinations.append(os.path.join(dest_folder, *posixpath.relpath(path, src_path).split("/")))
+        return destinations
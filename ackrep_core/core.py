@@ -1,15 +1,28 @@
 import secrets
 import yaml
 import os, sys
-import pathlib
 import time
 import shutil
+import hashlib
+import importlib
+import tempfile
+import subprocess
+import shlex
 import logging
+import multiprocessing
+import threading
+import contextlib
+import concurrent.futures
+import collections
 from typing import List
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 from ipydex import Container  # for functionality
-from git import Repo
+from git import Repo, InvalidGitRepositoryError, NoSuchPathError
 import json
+import re
+import urllib.error
+import urllib.parse
+import urllib.request
 from ackrep_core_django_settings import settings
 
 # settings might be accessed from other modules which import this one (core)
@@ -27,6 +40,9 @@ from ipydex import IPS, activate_ips_on_exception  # for debugging only
 
 from . import models
 from . import model_utils
+from . import warm_workers
+from . import result_cache
+from . import docker_backend
 
 # noinspection PyUnresolvedReferences
 from .model_utils import get_entity_dict_from_db, get_entity_types, resolve_keys, get_entity
@@ -38,6 +54,7 @@ from .util import (
     root_path,
     data_path,
     ci_results_path,
+    check_log_path,
     ObjectContainer,
     ResultContainer,
     InconsistentMetaDataError,
@@ -161,6 +178,72 @@ def convert_dict_to_yaml(data, target_path=None):
     return yml_txt
 
 
+# compiled templates, keyed by (absolute template path, mtime) (see `get_template`)
+_template_cache = {}
+
+# one jinja environment per template directory (they share the on-disk bytecode cache)
+_jinja_environments = {}
+_jinja_bytecode_cache = FileSystemBytecodeCache()
+# guards _template_cache and _jinja_environments (templates are rendered by concurrent checks, see
+# script.run_ci_checks)
+_template_cache_lock = threading.Lock()
+
+
+def get_template(tmpl_path, base_path=None):
+    """
+    Return the compiled jinja2 template. Templates are compiled only once per modification of the template file
+    (in-memory cache); additionally, jinja2 stores the compiled bytecode on disk to speed up new processes.
+
+    :param tmpl_path:   template path (relative to base_path, usually starts with "templates/")
+    :param base_path:   None or string (if None then the absolute path of this module will be used)
+    :return:            jinja2.Template
+    """
+
+    path, fname = os.path.split(tmpl_path)
+    assert path != ""
+
+    if base_path is None:
+        base_path = mod_path
+
+    path = os.path.join(base_path, path)
+    full_path = os.path.join(path, fname)
+    cache_key = (full_path, os.path.getmtime(full_path))
+
+    with _template_cache_lock:
+        template = _template_cache.get(cache_key)
+        if template is None:
+            jin_env = _jinja_environments.get(path)
+            if jin_env is None:
+                jin_env = Environment(loader=FileSystemLoader(path), bytecode_cache=_jinja_bytecode_cache)
+                _jinja_environments[path] = jin_env
+            template = jin_env.get_template(fname)
+
+            # drop outdated versions of this template
+            for key in [key for key in _template_cache if key[0] == full_path]:
+                _template_cache.pop(key, None)
+            _template_cache[cache_key] = template
+
+    return template
+
+
+def render_template_to_str(tmpl_path, context, base_path=None):
+    """
+    Render a jinja2 template and return the result as string (without writing a file).
+
+    :param tmpl_path:   template path (relative to the modules path, usually starts with "templates/")
+    :param context:     dict with context data for rendering
+    :param base_path:   None or string (if None then the absolute path of this module will be used)
+    :return:            str
+    """
+
+    template = get_template(tmpl_path, base_path)
+    if "warning" not in context:
+        fname = os.path.split(tmpl_path)[1]
+        time_string = current_time_str()
+        context["warning"] = f"This file was autogenerated from the template: {fname} ({time_string})."
+    return template.render(context=context)
+
+
 def render_template(tmpl_path, context, target_path=None, base_path=None, special_str="template_"):
     """
     Render a jinja2 template and save it to target_path. If target_path ist `None` (default),
@@ -184,18 +267,12 @@ def render_template(tmpl_path, context, target_path=None, base_path=None, specia
 
     path = os.path.join(base_path, path)
 
-    jin_env = Environment(loader=FileSystemLoader(path))
-
     if target_path is None:
         assert 1 < len(special_str) < len(fname) and (fname.count(special_str) == 1)
         res_fname = fname.replace(special_str, "")
         target_path = os.path.join(path, res_fname)
 
-    template = jin_env.get_template(fname)
-    if "warning" not in context:
-        time_string = current_time_str()
-        context["warning"] = f"This file was autogenerated from the template: {fname} ({time_string})."
-    result = template.render(context=context)
+    result = render_template_to_str(tmpl_path, context, base_path)
 
     with open(target_path, "w") as resfile:
         resfile.write(result)
@@ -225,6 +302,31 @@ def clear_db():
 
 
 # noinspection PyPep8Naming
+# picklable representation of the entity properties which are represented in the ontology (used to build the ontology
+# in the sparql query worker, see SparqlQueryWorker)
+OntologyEntityRecord = collections.namedtuple(
+    "OntologyEntityRecord", ["type_name", "key", "name", "tag_list", "merge_request"]
+)
+
+
+def get_ontology_entity_record(e) -> OntologyEntityRecord:
+    """
+    :param e:   ackrep entity (or OntologyEntityRecord, which is returned unchanged)
+    """
+    if isinstance(e, OntologyEntityRecord):
+        return e
+    return OntologyEntityRecord(type(e).__name__, e.key, e.name, e.tag_list, e.merge_request)
+
+
+def get_ontology_identity(e) -> tuple:
+    """
+    :param e:   ackrep entity or OntologyEntityRecord
+    :return:    2-tuple (key, merge_request) which identifies the individual of the entity (the entities of a merge
+                request have the same keys as the corresponding entities of the main repo)
+    """
+    return e.key, e.merge_request or None
+
+
 class ACKREP_OntologyManager(object):
     """
     Manages the ontology related tasks in ackrep-core
@@ -234,6 +336,14 @@ class ACKREP_OntologyManager(object):
         # noinspection PyTypeChecker
         self.OM: ypo.OntologyManager = None
         self.ocse_entity_mapping = {}
+        self.entity_class_mapping = {}
+
+        # {(entity_key, merge_request): (individual, signature)}, used for incremental updates (see
+        # get_ontology_identity)
+        self.individuals = {}
+
+        # separate process for run_bounded_sparql_query (started on demand)
+        self.query_worker = None
 
     def load_ontology(self, startdir, entity_list: List[models.GenericEntity]) -> None:
         """
@@ -244,43 +354,32 @@ class ACKREP_OntologyManager(object):
         """
 
         if isinstance(self.OM, ypo.OntologyManager):
-            # Nothing to do
+            # Nothing to do (changes of the entities are handled by `sync_entities` etc.)
             return
 
         assert len(models.ProblemSpecification.objects.all()) > 0, "no ProblemSpecification found"
+        self.build_ontology(startdir, entity_list)
+
+    def build_ontology(self, startdir, entity_list) -> None:
+        """
+        Create the ontology without accessing the database (see load_ontology).
+
+        :param startdir:
+        :param entity_list:    list of ackrep entities or OntologyEntityRecords
+        """
+
         assert len(entity_list) > 0, "empty entity_list"
 
         path = os.path.join(startdir, "ontology", "ocse-prototype-01.owl.yml")
         self.OM = ypo.OntologyManager(path, world=ypo.owl2.World())
+        self.individuals = {}
 
-        mapping = {}
+        self.entity_class_mapping = {}
         for cls in self.OM.n.ACKREP_Entity.subclasses():
-            mapping[cls.name.replace("ACKREP_", "")] = cls
+            self.entity_class_mapping[cls.name.replace("ACKREP_", "")] = cls
 
         for e in entity_list:
-            cls = mapping.get(type(e).__name__)
-            if cls:
-                # instantiation of owlready classes has side effects -> instances are tracked
-                # noinspection PyUnusedLocal
-                instance = cls(has_entity_key=e.key, name=e.name)
-
-                tag_list = util.smart_parse(e.tag_list)
-                assert isinstance(tag_list, list), f"unexpexted type of e.tag_list: {type(tag_list)}"
-                for tag in tag_list:
-                    if tag.startswith("ocse:"):
-                        ocse_concept_name = tag.replace("ocse:", "")
-
-                        # see yamlpyowl doc (README) wrt proxy_individuals
-                        proxy_individual_name = f"i{ocse_concept_name}"
-                        res = self.OM.onto.search(iri=f"*{proxy_individual_name}")
-                        if not len(res) == 1:
-                            msg = f"Unknown tag: {tag}. Maybe a spelling error?"
-                            raise NameError(msg)
-                        proxy_individual = res[0]
-                        instance.has_ontology_based_tag.append(proxy_individual)
-                    # IPS(e.key == "M4PDA")
-            else:
-                logger.warning(f"unknown entity type: {e}")
+            self._create_individual(e)
 
         if len(list(self.OM.n.ACKREP_ProblemSolution.instances())) == 0:
             msg = "Instances of ACKREP_ProblemSolution are missing. This is unexpected."
@@ -292,6 +391,132 @@ class ACKREP_OntologyManager(object):
 
         self.generate_bottom_up_tag_relations()
 
+    def _create_individual(self, e: models.GenericEntity):
+        """
+        Create the ontology individual for the ackrep entity e (only with its direct tags).
+
+        :return:    the individual or None (for unknown entity types)
+        """
+
+        e = get_ontology_entity_record(e)
+        cls = self.entity_class_mapping.get(e.type_name)
+        if not cls:
+            logger.warning(f"unknown entity type: {e}")
+            return None
+
+        # an existing individual of the same entity (e.g. duplicate entries in entity_list) would be orphaned
+        self._remove_individuals([get_ontology_identity(e)])
+
+        # instantiation of owlready classes has side effects -> instances are tracked
+        # note: the name is the iri of the individual, i.e. it has to be unique (entity names are not)
+        key, merge_request = get_ontology_identity(e)
+        name = f"ackrep_entity_{key}" if merge_request is None else f"ackrep_entity_{key}_{merge_request}"
+        instance = cls(has_entity_key=e.key, name=name)
+
+        try:
+            tag_list = util.smart_parse(e.tag_list)
+            assert isinstance(tag_list, list), f"unexpexted type of e.tag_list: {type(tag_list)}"
+            for tag in tag_list:
+                if tag.startswith("ocse:"):
+                    ocse_concept_name = tag.replace("ocse:", "")
+
+                    # see yamlpyowl doc (README) wrt proxy_individuals
+                    proxy_individual_name = f"i{ocse_concept_name}"
+                    res = self.OM.onto.search(iri=f"*{proxy_individual_name}")
+                    if not len(res) == 1:
+                        msg = f"Unknown tag: {tag}. Maybe a spelling error?"
+                        raise NameError(msg)
+                    proxy_individual = res[0]
+                    instance.has_ontology_based_tag.append(proxy_individual)
+        except Exception:
+            ypo.owl2.destroy_entity(instance)
+            raise
+
+        self.individuals[get_ontology_identity(e)] = (instance, self._entity_signature(e))
+        return instance
+
+    @staticmethod
+    def _entity_signature(e: models.GenericEntity) -> tuple:
+        """
+        :return:    tuple of those entity properties which are represented in the ontology
+        """
+        e = get_ontology_entity_record(e)
+        return e.type_name, e.name, str(e.tag_list)
+
+    def add_entities(self, entity_list: List[models.GenericEntity]) -> None:
+        """
+        Add individuals (including their tag closure) for new entities without rebuilding the whole ontology.
+        If the ontology is not yet loaded, nothing happens (it will contain the entities once it is loaded).
+
+        :param entity_list:    list of ackrep entities
+        """
+
+        if self.OM is None:
+            return
+
+        for e in entity_list:
+            instance = self._create_individual(e)
+            if instance is None:
+                continue
+            for ocse_entity in list(instance.has_ontology_based_tag):
+                self._recursively_add_tags(instance, ocse_entity.is_a[0])
+
+    def remove_entities(self, key_list: List[str], merge_request=None) -> None:
+        """
+        Remove the individuals (and thus all their tag relations) of the given entity keys from the ontology.
+
+        :param key_list:        list of entity keys
+        :param merge_request:   None (entities of the main repo) or key of the merge request of the entities
+        """
+
+        self._remove_individuals([(key, merge_request or None) for key in key_list])
+
+    def _remove_individuals(self, identities: list) -> None:
+        """
+        :param identities:  list of 2-tuples (key, merge_request), see get_ontology_identity
+        """
+
+        if self.OM is None:
+            return
+
+        for identity in identities:
+            instance, _ = self.individuals.pop(identity, (None, None))
+            if instance is not None:
+                ypo.owl2.destroy_entity(instance)
+
+    def update_entities(self, entity_list: List[models.GenericEntity]) -> None:
+        """
+        Replace the individuals of the given entities (e.g. after their metadata has changed).
+
+        :param entity_list:    list of ackrep entities
+        """
+
+        self._remove_individuals([get_ontology_identity(e) for e in entity_list])
+        self.add_entities(entity_list)
+
+    def sync_entities(self, entity_list: List[models.GenericEntity]) -> None:
+        """
+        Bring the (already loaded) ontology in line with entity_list: individuals of vanished entities are
+        removed, new and changed entities are (re-)added and unchanged individuals are kept.
+
+        :param entity_list:    complete list of ackrep entities
+        """
+
+        if self.OM is None:
+            return
+
+        new_identities = set(get_ontology_identity(e) for e in entity_list)
+        self._remove_individuals([identity for identity in self.individuals if identity not in new_identities])
+
+        changed_entities = []
+        for e in entity_list:
+            _, signature = self.individuals.get(get_ontology_identity(e), (None, None))
+            if signature != self._entity_signature(e):
+                changed_entities.append(e)
+        self.update_entities(changed_entities)
+
+        logger.debug(f"ontology synced: {len(changed_entities)} individuals updated")
+
     def generate_bottom_up_tag_relations(self) -> None:
         """
         Tags should be as specific as possible, e.g. if applicable `Linear_State_Space_System` is prefererred over
@@ -366,6 +591,51 @@ class ACKREP_OntologyManager(object):
                 onto_entites.append(oe)
         return ackrep_entities, onto_entites
 
+    def run_bounded_sparql_query(self, qsrc, limit=None, offset=0, timeout=None) -> ResultContainer:
+        """
+        Run a (potentially user-provided) sparql query in a separate worker process (see SparqlQueryWorker) and
+        translate one page of the result. The calling (request) thread is never blocked longer than `timeout`:
+        a query which exceeds it is killed (QueryTimeoutError), if the worker is busy or still starting in the
+        background, QueryBusyError is raised.
+
+        :param qsrc:    sparql source of the query
+        :param limit:   maximum number of results to translate (default: settings.SPARQL_RESULTS_PER_PAGE)
+        :param offset:  number of results to skip (for pagination)
+        :param timeout: time limit in seconds (default: settings.SPARQL_QUERY_TIMEOUT)
+
+        :return:        ResultContainer with attributes:
+                        ackrep_entities, onto_entities (page of the result), total, limit, offset
+        """
+
+        if limit is None:
+            limit = settings.SPARQL_RESULTS_PER_PAGE
+        if timeout is None:
+            timeout = settings.SPARQL_QUERY_TIMEOUT
+        offset = max(int(offset), 0)
+
+        if self.query_worker is None:
+            self.query_worker = SparqlQueryWorker()
+        records = [get_ontology_entity_record(e) for e in model_utils.all_entities()]
+        total, items = self.query_worker.query(data_path, records, qsrc, limit, offset, timeout)
+
+        rc = ResultContainer(ackrep_entities=[], onto_entities=[], total=total, limit=limit, offset=offset)
+        for kind, value in items:
+            if kind == "key":
+                rc.ackrep_entities.append(get_entity(value))
+            else:
+                rc.onto_entities.append(value)
+        return rc
+
+    def serialize_onto_entity(self, onto_nty):
+        """
+        :param onto_nty:    class or instance from the ontology
+        :return:            picklable 2-tuple: ("key", <entity key>) for ACKREP entities, ("onto", <str>) otherwise
+        """
+
+        if isinstance(onto_nty, self.OM.n.ACKREP_Entity):
+            return "key", onto_nty.has_entity_key
+        return "onto", str(onto_nty)
+
     def wrap_onto_entity(self, onto_nty):
         """
 
@@ -383,6 +653,137 @@ class ACKREP_OntologyManager(object):
         return ae, oe
 
 
+class SparqlQueryWorker:
+    """
+    Dedicated process which runs the sparql queries of ACKREP_OntologyManager.run_bounded_sparql_query.
+
+    The process is started with the `spawn` method and builds its own ontology, i.e. it neither inherits the sqlite
+    quadstore of owlready2 nor locks which are held by other threads of the (threaded) web process. Before each query
+    it syncs its ontology with the current entities. Queries are processed one after another.
+
+    Starting the process (including building the ontology) happens in the background: a query waits for it at most
+    until its own deadline. If a query exceeds its time limit, the process is killed and restarted immediately.
+    """
+
+    # a process which did not become ready within this time is considered to hang (and restarted)
+    START_TIMEOUT = 300  # s
+
+    def __init__(self):
+        self.startdir = None
+        self.proc = None
+        self.conn = None
+        self.ready = False
+        self.start_time = None
+        self._lock = threading.Lock()
+
+    def query(self, startdir, records, qsrc, limit, offset, timeout):
+        """
+        :param startdir:    data repo (contains the ontology)
+        :param records:     list of OntologyEntityRecords of all entities
+        :param qsrc:        sparql source of the query
+        :param limit:       maximum number of returned results
+        :param offset:      number of results to skip
+        :param timeout:     time limit in seconds (for waiting for the worker and for the query together)
+
+        :return:            2-tuple: total number of results, page of the sorted results (see
+                            ACKREP_OntologyManager.serialize_onto_entity)
+
+        :raises QueryTimeoutError:  if the query did not finish within `timeout` seconds
+        :raises QueryBusyError:     if the worker was busy with another query or not ready within `timeout` seconds
+        :raises QueryError:         if the query failed inside the worker
+        """
+
+        deadline = time.monotonic() + timeout
+        if not self._lock.acquire(timeout=timeout):
+            raise util.QueryBusyError("Another query is running. Please try again later.")
+        try:
+            if self.proc is None or not self.proc.is_alive() or self.startdir != startdir:
+                self.start(startdir, records)
+            self._wait_until_ready(startdir, records, deadline)
+            self.conn.send((records, qsrc, limit, offset))
+            if not self.conn.poll(max(deadline - time.monotonic(), 0)):
+                # restart in the background, the next query should not wait for the whole start
+                self.start(startdir, records)
+                raise util.QueryTimeoutError(f"Query reached time limit ({timeout}s) and was canceled.")
+            return self._receive()
+        finally:
+            self._lock.release()
+
+    def start(self, startdir, records):
+        """(re)start the process without waiting for it (see _wait_until_ready)"""
+        self.stop()
+        ctx = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        self.proc = ctx.Process(target=_sparql_query_worker, args=(startdir, records, child_conn), daemon=True)
+        self.proc.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.startdir = startdir
+        self.ready = False
+        self.start_time = time.monotonic()
+
+    def stop(self):
+        if self.proc is None:
+            return
+        if self.proc.is_alive():
+            self.proc.kill()
+        self.proc.join()
+        self.conn.close()
+        self.proc = self.conn = None
+        self.ready = False
+
+    def _wait_until_ready(self, startdir, records, deadline):
+        if self.ready:
+            return
+        if not self.conn.poll(max(deadline - time.monotonic(), 0)):
+            if time.monotonic() - self.start_time > self.START_TIMEOUT:
+                self.start(startdir, records)
+            raise util.QueryBusyError("The query service is starting. Please try again in a moment.")
+        # the first message reports whether the ontology was built
+        self._receive()
+        self.ready = True
+
+    def _receive(self):
+        try:
+            success, payload = self.conn.recv()
+        except EOFError:
+            self.stop()
+            raise util.QueryError("Query worker terminated unexpectedly.")
+        if not success:
+            if not self.ready:
+                # the ontology could not be built, the next query tries again
+                self.stop()
+            raise util.QueryError(payload)
+        return payload
+
+
+def _sparql_query_worker(startdir: str, records: list, conn) -> None:
+    """
+    Main function of the SparqlQueryWorker process: build the ontology, then answer the queries
+    (records, qsrc, limit, offset) with (success_flag, payload) until the pipe is closed.
+    """
+    aom = ACKREP_OntologyManager()
+    try:
+        aom.build_ontology(startdir, records)
+    except Exception as e:
+        conn.send((False, f"Could not load the ontology: {type(e).__name__}: {e}"))
+        return
+    conn.send((True, None))
+
+    while True:
+        try:
+            records, qsrc, limit, offset = conn.recv()
+        except EOFError:
+            break
+        try:
+            aom.sync_entities(records)
+            # the raw result is a set -> ensure stable order for pagination
+            items = sorted(aom.serialize_onto_entity(onto_nty) for onto_nty in aom.OM.make_query(qsrc))
+            conn.send((True, (len(items), items[offset : offset + limit])))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
 def load_repo_to_db(startdir, check_consistency=True):
     logger.info("Completely rebuilding DB from file system")
 
@@ -402,7 +803,13 @@ def load_repo_to_db(startdir, check_consistency=True):
     global last_loaded_entities
     last_loaded_entities = entity_list
 
-    AOM.load_ontology(startdir, entity_list)
+    # the cached list would be stale otherwise
+    model_utils.list_of_all_entities.clear()
+
+    if AOM.OM is None:
+        AOM.load_ontology(startdir, entity_list)
+    else:
+        AOM.sync_entities(entity_list)
 
     return entity_list
 
@@ -501,56 +908,167 @@ def get_data_files(base_path, endswith_str=None, create_media_links=False):
         return files
 
 
-def make_method_build(method_package, accept_existing=True):
+# number of builds per method package which are kept (the most recently used ones): concurrent checks might still
+# import from the previous build (see make_method_build)
+METHOD_BUILD_GENERATIONS = 3
+
+
+def make_method_build(method_package, accept_existing=True, build_func=None):
     """
     Assumption: the method is inside the repo only with its source code. In general there is a build step necessary
     (e.g. compiling source files), which is triggered by this function.
 
-    Currently the build-step consist only of copying the source to _build/
+    Builds are stored content-addressed in `_build/<hash>/` where the hash is computed from the source tree and the
+    build function. Thus, a build is only created if the source has changed (outdated builds are removed, except for
+    the METHOD_BUILD_GENERATIONS most recently used ones).
+    Every build is created in a temporary directory and moved to its final location by an atomic rename, i.e.
+    concurrent checks never see incomplete builds.
+
+    Currently the build-step consist only of hardlinking the source files to the build directory (see
+    link_source_tree). A build script can be passed as `build_func` and then uses the same cache. Note that it must
+    replace files instead of modifying them (they are hardlinks to the source files).
 
     :param method_package:
-    :param accept_existing:
+    :param accept_existing:     if False, raise ValueError if a build of the current source does already exist
+    :param build_func:          None or callable(source_path, target_path) which creates the build in target_path
+                                (default: link_source_tree)
 
     :return: full_build_path
     """
 
+    if build_func is None:
+        build_func = link_source_tree
+
     full_base_path = os.path.join(root_path, method_package.base_path)
-    full_build_path = os.path.join(full_base_path, "_build")
+    full_build_root = os.path.join(full_base_path, "_build")
     full_source_path = os.path.join(full_base_path, "src")
 
+    hasher = hashlib.sha256(f"{build_func.__module__}.{build_func.__qualname__}\0".encode("utf8"))
+    source_hash = result_cache.hash_tree(full_source_path, hasher)[:16]
+    full_build_path = os.path.join(full_build_root, source_hash)
+
     if os.path.isdir(full_build_path):
         if not accept_existing:
             msg = f"The path {full_build_path} does already exist, which is not expected!"
             raise ValueError(msg)
         else:
+            _touch_build(full_build_path)
             return full_build_path
 
-    # TODO: test for and run makescript here
-
-    # For now just copy the source:
+    logger.info(f"  ... building method package {method_package.key} ({source_hash}) ... ")
+    _prepare_build_root(full_build_root)
 
-    shutil.copytree(full_source_path, full_build_path)
+    tmp_path = tempfile.mkdtemp(prefix=".tmp_", dir=full_build_root)
+    try:
+        build_func(full_source_path, os.path.join(tmp_path, "build"))
+        try:
+            os.rename(os.path.join(tmp_path, "build"), full_build_path)
+        except OSError:
+            # the same build was created concurrently by another process
+            if not os.path.isdir(full_build_path):
+                raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    _touch_build(full_build_path)
+    _prune_builds(full_build_root, source_hash)
 
     return full_build_path
 
 
-def check_generic(key: str):
+def _touch_build(full_build_path):
+    """mark the build as used (the modification time of the directory, see _prune_builds)"""
+    try:
+        os.utime(full_build_path)
+    except OSError:
+        # removed concurrently
+        pass
+
+
+def _prune_builds(full_build_root, current_hash):
+    """remove the outdated builds except for the METHOD_BUILD_GENERATIONS most recently used ones"""
+    builds = []
+    for name in os.listdir(full_build_root):
+        path = os.path.join(full_build_root, name)
+        if name != current_hash and not name.startswith(".") and os.path.isdir(path):
+            try:
+                builds.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+    builds.sort(reverse=True)
+    for _, path in builds[METHOD_BUILD_GENERATIONS - 1 :]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _prepare_build_root(full_build_root):
+    """create the directory for the builds of a method package (and remove builds of the old flat layout)"""
+    marker_path = os.path.join(full_build_root, ".ackrep_build_cache")
+    if os.path.isdir(full_build_root) and not os.path.isfile(marker_path):
+        # legacy: `_build` was a plain (possibly stale) copy of `src`
+        shutil.rmtree(full_build_root)
+    os.makedirs(full_build_root, exist_ok=True)
+    with open(marker_path, "w") as f:
+        f.write("builds of this method package (see ackrep_core.core.make_method_build)\n")
+
+
+def link_source_tree(source_path, target_path):
+    """default build step: recreate the source tree in target_path using hardlinks (copies as fallback)"""
+    shutil.copytree(source_path, target_path, copy_function=_link_or_copy, ignore=shutil.ignore_patterns("__pycache__"))
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g. different file systems or no hardlink support
+        shutil.copy2(src, dst)
+
+
+def check_generic(key: str, timeout=None, inprocess=False):
     """create entity and context, create execscript, run execscript.
     This is the successor of check_solution and check_system_model
 
     Args:
         key (str): entity key
+        timeout (float or None, optional): time limit in seconds (see util.run_command). Defaults to None.
+        inprocess (bool, optional): skip the execscript and import the entity modules in a forked child of this
+        process (see run_check_inprocess). Defaults to False.
 
     Returns:
         CompletedProcess: result of execscript
     """
     entity, c = get_entity_context(key)
-    scriptpath = create_execscript_from_template(entity, c)
-    res = run_execscript(scriptpath)
+    if inprocess and "fork" in multiprocessing.get_all_start_methods():
+        workdir = tempfile.mkdtemp(prefix=f"ackrep_check_{entity.key}_")
+        res = run_check_inprocess(entity, c, workdir, log_file_path=get_check_log_file_path(key), timeout=timeout)
+    else:
+        if inprocess:
+            logger.warning("In-process checks require the 'fork' start method. Running the execscript instead.")
+        scriptpath = create_execscript_from_template(entity, c)
+        res = run_execscript(scriptpath, log_file_path=get_check_log_file_path(key), timeout=timeout)
+        workdir = os.path.dirname(scriptpath)
+
+    # every check has its own working directory (allows concurrent checks); keep it for inspection on failure
+    if res.returncode == 0:
+        shutil.rmtree(workdir, ignore_errors=True)
+    else:
+        logger.info(f"keeping working directory of failed check: {workdir}")
 
     return res
 
 
+def get_check_log_file_path(key: str):
+    """return the path of the file which receives the complete output of the (most recent) check of an entity
+
+    Args:
+        key (str): entity key
+
+    Returns:
+        str: path to log file (see also util.check_log_path)
+    """
+    return os.path.join(check_log_path, f"{key}.log")
+
+
 def get_entity_context(key: str):
     """get entity and build context based on key
 
@@ -625,14 +1143,14 @@ def get_entity_context(key: str):
 
 
 def create_execscript_from_template(entity: models.GenericEntity, c: Container, scriptpath=None):
-    """create execscript from template. if scriptpath is None, the default script path
-    in the respective data repo is used.
+    """create execscript from template. if scriptpath is None, a new temporary working directory
+    is created for the script (such that concurrent checks do not interfere).
     return scriptpath
 
     Args:
         entity (models.GenericEntity): entity
         c (Container): context dict
-        scriptpath (str or None, optional): specify where to store the script. Only usefull for
+        scriptpath (str or None, optional): specify the directory where to store the script. Only usefull for
         ackrep --prepare-script. Defaults to None.
 
     Raises:
@@ -652,12 +1170,9 @@ def create_execscript_from_template(entity: models.GenericEntity, c: Container,
 
     assert not entity.base_path.startswith(os.path.sep)
 
-    # determine whether the entity comes from ackrep_data or ackrep_data_for_unittests or ackrep_data_import
-    data_repo_path = pathlib.Path(entity.base_path).parts[0]
     if scriptpath is None:
-        scriptpath = os.path.join(root_path, data_repo_path, scriptname)
-    else:
-        scriptpath = os.path.join(scriptpath, scriptname)
+        scriptpath = tempfile.mkdtemp(prefix=f"ackrep_check_{entity.key}_")
+    scriptpath = os.path.join(scriptpath, scriptname)
 
     logger.info(f"execscript-path: {scriptpath}")
 
@@ -671,18 +1186,37 @@ def create_execscript_from_template(entity: models.GenericEntity, c: Container,
     return scriptpath
 
 
-def run_execscript(scriptpath):
+def run_execscript(scriptpath, use_warm_worker=None, log_file_path=None, timeout=None):
     """run the execscript at a given location in subprocess. logs errors, returns result
 
     Args:
         scriptpath (path_like): path to execscript
+        use_warm_worker (bool or None, optional): run the script in a child of the warm forkserver (see module
+        warm_workers) instead of a new interpreter. Defaults to None (-> settings.EXECSCRIPT_WARM_WORKERS).
+        log_file_path (path_like or None, optional): file which receives the complete output. Defaults to None.
+        timeout (float or None, optional): time limit in seconds, the script and its subprocesses are killed if it is
+        exceeded (result: `res.timed_out == True`). Defaults to None.
 
     Returns:
         CompletedProcess: result of execscript
     """
     logger.info(f"  ... running exec-script {scriptpath} ... ")
 
-    res = run_command(["python", scriptpath], logger=logger, capture_output=True)
+    if use_warm_worker is None:
+        use_warm_worker = settings.EXECSCRIPT_WARM_WORKERS
+
+    if use_warm_worker and warm_workers.is_available():
+        res = warm_workers.run_script(scriptpath, logger=logger, timeout=timeout, log_file_path=log_file_path)
+    else:
+        # run inside the directory of the script (instead of relying on the working directory of this process)
+        res = run_command(
+            ["python", scriptpath],
+            logger=logger,
+            capture_output=True,
+            log_file_path=log_file_path,
+            timeout=timeout,
+            cwd=os.path.dirname(scriptpath),
+        )
     if res.returncode == 0:
         # propagate output of execscript through multiple subprocesses
         print((res.stdout), file=sys.stdout)
@@ -690,6 +1224,89 @@ def run_execscript(scriptpath):
     return res
 
 
+# modules of the entities (see templates/execscript*.py.template), they must not leak from one check into another
+ENTITY_MODULE_NAMES = ("problem", "solution", "system_model", "simulation")
+
+
+def run_check_inprocess(entity: models.GenericEntity, c: Container, workdir, log_file_path=None, timeout=None):
+    """run the check of an entity in a child which is forked from the current process, i.e. without rendering the
+    execscript and without starting a new interpreter. The returncodes are the same as those of the execscript.
+
+    Args:
+        entity (models.GenericEntity): entity (solution or system model)
+        c (Container): context dict (see get_entity_context)
+        workdir (path_like): working directory of the check
+        log_file_path (path_like or None, optional): file which receives the complete output. Defaults to None.
+        timeout (float or None, optional): time limit in seconds (see run_execscript). Defaults to None.
+
+    Returns:
+        CompletedProcess: result of the check
+    """
+    logger.info(f"  ... running check of {entity.key} in-process ... ")
+
+    assert isinstance(entity, (models.SystemModel, models.ProblemSolution))
+
+    # same order as created by the templates (the first entry has the highest priority)
+    if isinstance(entity, models.ProblemSolution):
+        entity_paths = [c.solution_path, c.problem_spec_path] + list(reversed(c.method_package_list))
+    else:
+        entity_paths = [c.system_model_path]
+    entity_paths.append(c.ackrep_core_path)
+
+    arglist = ["ackrep", "-c", entity.key, "--inprocess"]
+    ctx = multiprocessing.get_context("fork")
+    res = warm_workers.run_in_child(
+        _check_in_child,
+        (type(entity).__name__, entity_paths, workdir),
+        arglist,
+        ctx,
+        logger=logger,
+        timeout=timeout,
+        log_file_path=log_file_path,
+    )
+    if res.returncode == 0:
+        print((res.stdout), file=sys.stdout)
+
+    return res
+
+
+def _check_in_child(entity_type: str, entity_paths: list, workdir):
+    """executed in the forked child: equivalent of the execscript (see templates/execscript*.py.template)"""
+
+    # prevent debugging scripts from unwanted interference
+    os.environ["NO_IPS_EXCEPTHOOK"] = "True"
+    os.chdir(workdir)
+
+    # the child inherits the interpreter state of the parent: remove everything which might shadow the entity
+    for name in list(sys.modules):
+        module_file = getattr(sys.modules[name], "__file__", None) or ""
+        if name.split(".")[0] in ENTITY_MODULE_NAMES or module_file.startswith(data_path):
+            del sys.modules[name]
+    sys.path[:] = entity_paths + [p for p in sys.path if p and not p.startswith(data_path)]
+    sys.argv = ["ackrep"]
+
+    if entity_type == "ProblemSolution":
+        ps = importlib.import_module("problem")
+        solution = importlib.import_module("solution")
+        solution_data = solution.solve(ps.ProblemSpecification)
+        rc = ps.evaluate_solution(solution_data)
+        if not rc.success:
+            print(rc.success)
+    else:
+        importlib.import_module("system_model")
+        simulation = importlib.import_module("simulation")
+        simulation_data = simulation.simulate()
+        rc = simulation.evaluate_simulation(simulation_data)
+
+    if rc.success:
+        return 0
+
+    print("\nNumerical calculation finished with unexpected result!\n")
+    if entity_type != "ProblemSolution":
+        print("Discrepancy between calculated and expected state values at end of simualtion:", rc.final_state_errors)
+    return 2
+
+
 def clone_external_data_repo(url, mr_key):
     """Clone git repository from url into external_repos/[MERGE_REQUEST_KEY], return path"""
 
@@ -716,7 +1333,9 @@ def create_merge_request(repo_url, title, description):
     key = gen_random_entity_key()
     mr_dir = clone_external_data_repo(repo_url, key)
 
-    crawl_files_and_load_to_db(mr_dir, merge_request=key)
+    entity_list = crawl_files_and_load_to_db(mr_dir, merge_request=key)
+    model_utils.list_of_all_entities.clear()
+    AOM.add_entities(entity_list)
 
     last_update = current_time_str()
 
@@ -755,9 +1374,13 @@ def delete_merge_request(mr):
 
 
 def delete_merge_request_entities(mr):
-    for e in mr.entity_list():
+    entity_list = mr.entity_list()
+    for e in entity_list:
         e.delete()
 
+    model_utils.list_of_all_entities.clear()
+    AOM.remove_entities([e.key for e in entity_list], merge_request=mr.key)
+
 
 def get_merge_request(key):
     mrs_with_key = list(models.MergeRequest.objects.filter(key=key))
@@ -810,6 +1433,73 @@ def print_entity_info(key: str) -> None:
 AOM = ACKREP_OntologyManager()
 
 
+def get_changed_file_paths(base_ref, repo_path=None):
+    """return the absolute paths of all files which changed between the merge base of base_ref and HEAD
+
+    Args:
+        base_ref (str): git reference (e.g. origin/master or a commit sha)
+        repo_path (str or None, optional): path of the repository. Defaults to None (-> data_path).
+
+    Returns:
+        list: absolute paths (including deleted files)
+    """
+    if repo_path is None:
+        repo_path = data_path
+    repo = Repo(repo_path)
+    # three dots: changes on HEAD since it branched from base_ref (i.e. the changes of a pull request)
+    diff = repo.git.diff("--name-only", f"{base_ref}...HEAD")
+    repo.close()
+    return [os.path.join(repo_path, path) for path in diff.splitlines() if path]
+
+
+def get_affected_entities(changed_file_paths):
+    """return the checkable entities whose results might be influenced by the changed files
+
+    An entity is affected if a file inside its directory changed, or if it depends on an entity with changed files:
+    solutions of a changed problem, solutions using a changed method package and entities using a changed
+    environment.
+
+    Args:
+        changed_file_paths (list): absolute paths of changed files (see get_changed_file_paths)
+
+    Returns:
+        list: entities (ProblemSolution, SystemModel, Notebook) in the order of the database
+    """
+    entity_list = model_utils.all_entities()
+
+    # longest paths first (the innermost entity directory determines the entity of a file)
+    entity_dirs = sorted(
+        [(os.path.join(root_path, e.base_path).rstrip(os.path.sep) + os.path.sep, e.key) for e in entity_list],
+        key=lambda item: -len(item[0]),
+    )
+
+    changed_keys = set()
+    for path in changed_file_paths:
+        path = os.path.abspath(path)
+        for entity_dir, key in entity_dirs:
+            if path.startswith(entity_dir):
+                changed_keys.add(key)
+                break
+        else:
+            logger.info(f"changed file does not belong to any entity: {path}")
+
+    checkable_types = (models.ProblemSolution, models.SystemModel, models.Notebook)
+    affected_entities = []
+    for entity in entity_list:
+        if not isinstance(entity, checkable_types):
+            continue
+
+        dependency_keys = {entity.compatible_environment or settings.DEFAULT_ENVIRONMENT_KEY}
+        if isinstance(entity, models.ProblemSolution):
+            dependency_keys.update(util.smart_parse(entity.solved_problem_list) or [])
+            dependency_keys.update(util.smart_parse(entity.method_package_list) or [])
+
+        if entity.key in changed_keys or dependency_keys & changed_keys:
+            affected_entities.append(entity)
+
+    return affected_entities
+
+
 def check(key, try_to_use_local_image=True):
     """General function to check system model or solution, calculated inside docker image.
     The image is chosen from the compatible environment of the given entity
@@ -842,180 +1532,1022 @@ def check(key, try_to_use_local_image=True):
         CompletedProcess: result of check
     """
     entity = get_entity(key)
-    assert isinstance(
-        entity, (models.ProblemSolution, models.SystemModel, models.Notebook)
-    ), f"key {key} is of neither solution, system model nor notebook. Unsure what to do."
+    # concurrent checks of the same environment are distributed over its replicas
+    with replica_scheduler.replica(get_environment_name_of_entity(entity)) as replica:
+        container_id = get_environment_container(entity, try_to_use_local_image, replica)
+
+        # run ackrep command in already running container
+        logger.info(f"Ackrep command running in Container: {container_id}")
+        host_uid = get_host_uid()
+        cmd = ["docker", "exec", "--user", host_uid, container_id, "ackrep", "-c", key]
+        with container_in_use(container_id):
+            res = run_command(cmd, logger=logger, capture_output=True, log_file_path=get_check_log_file_path(key))
+    # resources of the check itself are measured inside the container (see script.check), here we add the current
+    # state of the (long-living) container
+    res.container_stats = get_container_stats(container_id)
+    return res
 
-    # get environment name
+
+def get_environment_key_of_entity(entity: models.GenericEntity):
+    """return the key of the compatible environment of the entity (or the default environment)"""
     env_key = entity.compatible_environment
     if env_key == "" or env_key is None:
         logger.info("No environment specification found. Using default env.")
         env_key = settings.DEFAULT_ENVIRONMENT_KEY
-    env_name = get_entity(env_key).name
-    logger.info(f"running with environment spec: {env_name}")
-
-    # check if environment container is already running
-    container_id = look_for_running_container(env_name)
-
-    # Container not yet running, start container, load db, wait
-    # container is running detached, so the script can continue
-    if container_id is None:
-        logger.info(f"no container for {env_name} found, starting new one.")
-        container_id = start_idle_container(env_name, try_to_use_local_image)
-
-    # run ackrep command in already running container
-    logger.info(f"Ackrep command running in Container: {container_id}")
-    host_uid = get_host_uid()
-    cmd = ["docker", "exec", "--user", host_uid, container_id, "ackrep", "-c", key]
-    res = run_command(cmd, logger=logger, capture_output=True)
+    return env_key
+
+
+def get_environment_name_of_entity(entity: models.GenericEntity):
+    """return the name of the compatible environment of the entity (e.g. default_environment)"""
+    return get_entity(get_environment_key_of_entity(entity)).name
+
+
+def get_environment_container(entity: models.GenericEntity, try_to_use_local_image=True, replica=0):
+    """return the id of a running container of the compatible environment of the entity (start one if necessary)
+
+    Args:
+        entity (models.GenericEntity): entity which is to be checked
+        try_to_use_local_image (bool, optional): prefer locally build images. Only relevant for devs. Defaults to True.
+        replica (int, optional): index of the container replica (see ReplicaScheduler). Defaults to 0.
+
+    Returns:
+        str: container_id
+    """
+    assert isinstance(
+        entity, (models.ProblemSolution, models.SystemModel, models.Notebook)
+    ), f"key {entity.key} is of neither solution, system model nor notebook. Unsure what to do."
+
+    # get environment name
+    env_name = get_environment_name_of_entity(entity)
+    logger.info(f"running with environment spec: {env_name} (replica {replica})")
+
+    # concurrent checks (see script.check_all_entities) must not start or stop the same container replica at the
+    # same time
+    with get_environment_lock(get_replica_name(env_name, replica)):
+        # check if environment container is already running
+        container_id = look_for_running_container(env_name, replica)
+
+        # Container not yet running, start container, load db, wait
+        # container is running detached, so the script can continue
+        if container_id is None:
+            logger.info(f"no container for {env_name} (replica {replica}) found, starting new one.")
+            container_id = start_idle_container(env_name, try_to_use_local_image, replica=replica)
+
+    return container_id
+
+
+def get_replica_name(env_name, replica):
+    """return the container name of the replica (e.g. default_environment_0)"""
+    return f"{env_name}_{replica}"
+
+
+class ReplicaScheduler:
+    """
+    Dispatch checks across the container replicas of each environment (at most settings.CONTAINER_REPLICAS).
+    Every check gets the replica with the fewest running checks (lowest index first), i.e. further replicas are only
+    started if the others are busy.
+    """
+
+    def __init__(self, replicas=None):
+        """
+        Args:
+            replicas (int or None, optional): number of replicas. Defaults to None (-> settings.CONTAINER_REPLICAS).
+        """
+        self.replicas = replicas
+        # {env_name: {replica: number of running checks}}
+        self.running = {}
+        self._lock = threading.Lock()
+
+    def get_replica_count(self):
+        return max(int(settings.CONTAINER_REPLICAS if self.replicas is None else self.replicas), 1)
+
+    def acquire(self, env_name):
+        """return the index of the least busy replica of the environment (has to be released)"""
+        with self._lock:
+            running = self.running.setdefault(env_name, {})
+            replica = min(range(self.get_replica_count()), key=lambda i: (running.get(i, 0), i))
+            running[replica] = running.get(replica, 0) + 1
+            return replica
+
+    def release(self, env_name, replica):
+        with self._lock:
+            self.running[env_name][replica] -= 1
+
+    @contextlib.contextmanager
+    def replica(self, env_name):
+        replica = self.acquire(env_name)
+        try:
+            yield replica
+        finally:
+            self.release(env_name, replica)
+
+
+replica_scheduler = ReplicaScheduler()
+
+
+def check_batch(keys, try_to_use_local_image=True):
+    """check several entities with one `ackrep --check-batch` process per environment container (instead of one
+    `ackrep -c` process per entity). The results are yielded as soon as they are reported by the container.
+    Entities without result (e.g. because the batch process crashed) are checked separately afterwards.
+
+    Args:
+        keys (list): entity keys
+        try_to_use_local_image (bool, optional): prefer locally build images. Only relevant for devs. Defaults to True.
+
+    Yields:
+        tuple: (key, CompletedProcess-like result (like the result of check))
+    """
+    keys_by_env = {}
+    for key in keys:
+        keys_by_env.setdefault(get_environment_name_of_entity(get_entity(key)), []).append(key)
+
+    for env_name, env_keys in keys_by_env.items():
+        with replica_scheduler.replica(env_name) as replica:
+            missing_keys = yield from _check_batch_in_replica(env_name, env_keys, try_to_use_local_image, replica)
+
+        # checked separately (after the replica was released)
+        for key in missing_keys:
+            yield key, check(key, try_to_use_local_image)
+
+
+def _check_batch_in_replica(env_name, env_keys, try_to_use_local_image, replica):
+    """run `ackrep --check-batch` for keys of the same environment, yield the results and return the missing keys"""
+    container_id = get_environment_container(get_entity(env_keys[0]), try_to_use_local_image, replica)
+    if not environment_supports_check_batch(env_name, container_id, try_to_use_local_image):
+        logger.info(f"The image of {env_name} does not support --check-batch. Checking the entities separately.")
+        return list(env_keys)
+    logger.info(f"Ackrep batch of {len(env_keys)} checks running in Container: {container_id}")
+
+    # the shell records its pid, such that the batch can be killed inside the container (see _kill_batch_process)
+    pid_file = f"/tmp/ackrep_batch_{secrets.token_hex(8)}.pid"
+    batch_script = 'echo $$ > "$0"; ackrep --check-batch "$@"; rc=$?; rm -f "$0"; exit $rc'
+    cmd = ["docker", "exec", "--user", get_host_uid(), container_id, "sh", "-c", batch_script, pid_file, *env_keys]
+    # every check enforces ENTITY_TIMEOUT itself, this is only the limit for a hanging batch process
+    timeout = len(env_keys) * (settings.ENTITY_TIMEOUT + 60)
+    # result lines are collected completely (the bounded output buffers might cut them)
+    proc = util.StreamingProcess(
+        cmd,
+        logger=logger,
+        timeout=timeout,
+        line_prefix=util.BATCH_RESULT_PREFIX,
+        # the local process group is terminated on timeout (see util.run_command)
+        start_new_session=os.name != "nt",
+    )
+
+    missing_keys = list(env_keys)
+    with container_in_use(container_id):
+        while True:
+            exited = proc.poll() is not None or time.monotonic() - proc.start_time > timeout
+            if exited:
+                # kills the process group on timeout and waits for the pipes to be read completely
+                batch_res = proc.wait()
+                if batch_res.timed_out:
+                    # only the local `docker exec` client was killed, the remaining keys are checked in the same
+                    # container afterwards
+                    _kill_batch_process(container_id, pid_file)
+            for line in proc.read_lines():
+                result = util.parse_batch_result(line)
+                if result is None or result["key"] not in missing_keys:
+                    continue
+                missing_keys.remove(result["key"])
+                yield result["key"], _batch_result_to_completed_process(result, cmd, container_id)
+            if exited:
+                break
+            time.sleep(0.1)
+
+    if missing_keys:
+        logger.warning(
+            f"batch process exited with returncode {batch_res.returncode} without results for {missing_keys}. "
+            "Checking them separately."
+        )
+    return missing_keys
+
+
+# kills the process recorded in the pid file and all its descendants (checks run in their own sessions, i.e. killing
+# the process group would not be sufficient)
+_KILL_PROCESS_TREE_TEMPLATE = """
+import os, signal
+try:
+    with open({pid_file!r}) as f:
+        root = int(f.read())
+except (OSError, ValueError):
+    root = None
+children = {{}}
+for name in filter(str.isdigit, os.listdir("/proc")):
+    try:
+        with open("/proc/" + name + "/stat") as f:
+            ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+    except (OSError, ValueError, IndexError):
+        continue
+    children.setdefault(ppid, []).append(int(name))
+stack = [] if root is None else [root]
+while stack:
+    pid = stack.pop()
+    stack.extend(children.get(pid, []))
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except OSError:
+        pass
+try:
+    os.remove({pid_file!r})
+except OSError:
+    pass
+"""
+
+
+def _kill_batch_process(container_id, pid_file):
+    """kill the `ackrep --check-batch` process (started by _check_batch_in_replica) and its subprocesses inside the
+    container"""
+    logger.warning(f"killing the batch process in container {container_id}")
+    script = _KILL_PROCESS_TREE_TEMPLATE.format(pid_file=pid_file)
+    cmd = ["sh", "-c", 'exec "$(command -v python3 || command -v python)" -c "$0"', script]
+    try:
+        res = docker_backend.get_backend().exec_run(container_id, cmd, user=get_host_uid(), timeout=60)
+    except DockerError as e:
+        logger.error(f"could not kill the batch process in container {container_id}: {e}")
+        return
+    if res.returncode != 0:
+        logger.error(f"could not kill the batch process in container {container_id}: {res.stderr}")
+
+
+# {(env_name, image digest): bool}
+_check_batch_support_cache = {}
+
+
+def environment_supports_check_batch(env_name, container_id, try_to_use_local_image=True):
+    """determine (once per image) whether the ackrep installation of an environment image knows `--check-batch`
+    (images built before this option was introduced would fail to parse the arguments)
+
+    Args:
+        env_name (str): name of the environment
+        container_id (str): id of a running container of this environment
+        try_to_use_local_image (bool, optional): prefer locally build images. Only relevant for devs. Defaults to True.
+
+    Returns:
+        bool: True if the option is supported
+    """
+    image_digest = get_environment_image_digest(env_name, try_to_use_local_image)
+    cache_key = (env_name, image_digest)
+    if image_digest is not None and cache_key in _check_batch_support_cache:
+        return _check_batch_support_cache[cache_key]
+
+    try:
+        res = docker_backend.get_backend().exec_run(
+            container_id, ["ackrep", "--help"], user=get_host_uid(), timeout=settings.CONTAINER_READY_TIMEOUT
+        )
+    except docker_backend.DockerError as e:
+        logger.warning(f"could not determine whether {env_name} supports --check-batch: {e}")
+        return False
+
+    supported = res.returncode == 0 and "--check-batch" in res.stdout
+    if image_digest is not None:
+        _check_batch_support_cache[cache_key] = supported
+    return supported
+
+
+def _batch_result_to_completed_process(result, cmd, container_id):
+    res = subprocess.CompletedProcess(cmd, returncode=result["returncode"], stdout=result["stdout"], stderr="")
+    res.exited = res.returncode
+    res.timed_out = result.get("timed_out", False)
+    res.resources = result.get("resources")
+    res.runtime = result.get("runtime")
+    res.container_stats = get_container_stats(container_id)
+
+    log_file_path = get_check_log_file_path(result["key"])
+    os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
+    with open(log_file_path, "w", encoding="utf8") as f:
+        f.write(res.stdout)
+
     return res
 
 
-def look_for_running_container(env_name):
-    """check if a container with the image in question if already running.
-    If so, check if the correct db is loaded inside (this is done implicitly by comparing env vars).
+def get_container_stats(container_id):
+    """return a snapshot of the resource usage of a running container
+
+    Args:
+        container_id (str): id of the container
+
+    Returns:
+        dict or None: cpu_percent, memory_usage, memory_percent, pids (formatted like `docker stats`)
+    """
+    return docker_backend.get_backend().container_stats(container_id)
+
+
+_environment_locks = {}
+_environment_locks_guard = threading.Lock()
+
+
+def get_environment_lock(env_name):
+    """return the (process wide) lock which serializes container management for the given environment"""
+    with _environment_locks_guard:
+        return _environment_locks.setdefault(env_name, threading.Lock())
+
+
+def get_remote_image_name(env_name):
+    return f"ghcr.io/ackrep-org/{env_name}:latest"
+
+
+def _load_json_state(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_json_state(path, state):
+    # write to a temporary file first, such that concurrent readers never see an incomplete file
+    dirname = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_state_", dir=dirname)
+    with os.fdopen(fd, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+# serializes the read-modify-write cycles of the state files (within this process)
+_docker_state_lock = threading.Lock()
+
+
+def _load_image_freshness():
+    return _load_json_state(util.image_freshness_path)
+
+
+def _save_image_freshness(state):
+    _save_json_state(util.image_freshness_path, state)
+
+
+def invalidate_image_freshness(image_name=None):
+    """forget that images were verified, i.e. the next refresh_image compares them with the registry again
+
+    Args:
+        image_name (str or None, optional): only forget this image. Defaults to None (all images).
+    """
+    with _docker_state_lock:
+        state = _load_image_freshness()
+        if image_name is None:
+            state = {}
+        else:
+            state.pop(image_name, None)
+        _save_image_freshness(state)
+
+
+def get_local_image_digests(image_name):
+    """return the list of repo digests (e.g. ["sha256:..."]) of the local image (empty if the image does not exist)"""
+    image = docker_backend.get_backend().image_inspect(image_name)
+    return [] if image is None else image["repo_digests"]
+
+
+# accepted manifest types: the digest of the (multi-arch) index is what `docker pull` stores in RepoDigests
+_manifest_media_types = ", ".join(
+    [
+        "application/vnd.oci.image.index.v1+json",
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+        "application/vnd.docker.distribution.manifest.v2+json",
+        "application/vnd.oci.image.manifest.v1+json",
+    ]
+)
+
+
+def get_remote_image_digest(image_name, timeout=10):
+    """ask the registry for the current digest of the image (a single HEAD request instead of `docker pull`)
+
+    Args:
+        image_name (str): e.g. ghcr.io/ackrep-org/default_environment:latest
+        timeout (float, optional): time limit of each request in seconds. Defaults to 10.
+
+    Returns:
+        str or None: digest (e.g. "sha256:...") or None if the registry could not be queried
+    """
+    registry, _, repository = image_name.partition("/")
+    repository, _, tag = repository.partition(":")
+    url = f"https://{registry}/v2/{repository}/manifests/{tag or 'latest'}"
+    headers = {"Accept": _manifest_media_types}
+
+    try:
+        try:
+            return _head_manifest(url, headers, timeout)
+        except urllib.error.HTTPError as e:
+            if e.code != 401:
+                raise
+            # anonymous token (public images), see https://docs.docker.com/registry/spec/auth/token/
+            challenge = dict(re.findall(r'(\w+)="([^"]*)"', e.headers.get("WWW-Authenticate", "")))
+            query = urllib.parse.urlencode({k: v for k, v in challenge.items() if k in ("service", "scope")})
+            with urllib.request.urlopen(f"{challenge['realm']}?{query}", timeout=timeout) as response:
+                token = json.load(response)["token"]
+            headers["Authorization"] = f"Bearer {token}"
+            return _head_manifest(url, headers, timeout)
+    except (OSError, ValueError, KeyError) as e:
+        logger.info(f"could not query registry for {image_name}: {e}")
+        return None
+
+
+def _head_manifest(url, headers, timeout):
+    request = urllib.request.Request(url, headers=headers, method="HEAD")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.headers["Docker-Content-Digest"]
+
+
+def refresh_image(image_name, force=False):
+    """make sure the local image is the current version of the registry.
+    The registry is only queried if the image was not verified within the last settings.IMAGE_FRESHNESS_TTL seconds
+    (see also `ackrep --refresh-images`). The image is only pulled if the digests differ (or the registry could not
+    be queried).
+
+    Args:
+        image_name (str): e.g. ghcr.io/ackrep-org/default_environment:latest
+        force (bool, optional): ignore the ttl. Defaults to False.
+
+    Returns:
+        bool: True if a new version of the image was pulled
+    """
+    state = _load_image_freshness()
+    entry = state.get(image_name)
+    if not force and entry is not None and time.time() - entry["verified"] < settings.IMAGE_FRESHNESS_TTL:
+        logger.info(f"image {image_name} was verified {round(time.time() - entry['verified'])}s ago")
+        return False
+
+    remote_digest = get_remote_image_digest(image_name)
+    local_digests = get_local_image_digests(image_name)
+    if remote_digest is not None and remote_digest in local_digests:
+        logger.info(f"image {image_name} is up to date ({remote_digest})")
+        changed = False
+    else:
+        logger.info(f"pulling docker image {image_name}")
+        changed = docker_backend.get_backend().pull_image(image_name)
+        local_digests = get_local_image_digests(image_name)
+
+    # reload to keep concurrent updates of other images
+    with _docker_state_lock:
+        state = _load_image_freshness()
+        state[image_name] = {"verified": time.time(), "digest": remote_digest or (local_digests or [None])[0]}
+        _save_image_freshness(state)
+
+    return changed
+
+
+def prefetch_environment_images(env_names, try_to_use_local_image=True, jobs=None, force=False):
+    """make sure the images of the environments are up to date before checks start (see refresh_image). The images
+    are refreshed concurrently, i.e. a bulk check does not wait for one pull after another when it switches to the
+    next environment.
+
+    Args:
+        env_names (iterable): environment names (e.g. default_environment), duplicates are ignored
+        try_to_use_local_image (bool, optional): skip environments with a locally build image (see
+        start_idle_container). Defaults to True.
+        jobs (int or None, optional): maximum number of concurrent pulls. Defaults to None (settings.IMAGE_PULL_JOBS).
+        force (bool, optional): ignore settings.IMAGE_FRESHNESS_TTL (see refresh_image). Defaults to False.
+
+    Returns:
+        dict: {image_name: True if a new version was pulled, False if it was up to date, None if the refresh failed}
+    """
+    backend = docker_backend.get_backend()
+    image_names = []
+    for env_name in sorted(set(env_names)):
+        if try_to_use_local_image and backend.image_inspect("ackrep_deployment_" + env_name) is not None:
+            continue
+        image_names.append(get_remote_image_name(env_name))
+    if not image_names:
+        return {}
+
+    def refresh(image_name):
+        try:
+            return refresh_image(image_name, force)
+        except DockerError as e:
+            # not fatal here: the check of the environment tries again (and reports the error)
+            logger.warning(f"could not refresh image {image_name}: {e}")
+            return None
+
+    jobs = settings.IMAGE_PULL_JOBS if jobs is None else jobs
+    logger.info(f"refreshing {len(image_names)} environment image(s)")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(min(int(jobs), len(image_names)), 1)) as executor:
+        return dict(zip(image_names, executor.map(refresh, image_names)))
+
+
+def get_environment_image_digest(env_name, try_to_use_local_image=True):
+    """return the digest of the image which runs the checks of the environment (see start_idle_container): the id of
+    the local image (if any) or the digest of the remote image which was recorded by refresh_image
+
+    Args:
+        env_name (str): name of environment (e.g. default_environment)
+        try_to_use_local_image (bool, optional): prefer locally build images. Only relevant for devs. Defaults to True.
+
+    Returns:
+        str or None: digest or None if the image does not exist (or docker is not available)
+    """
+    backend = docker_backend.get_backend()
+    try:
+        if try_to_use_local_image:
+            local_image = backend.image_inspect("ackrep_deployment_" + env_name)
+            if local_image is not None:
+                return local_image["id"]
+
+        image_name = get_remote_image_name(env_name)
+        digest = (_load_image_freshness().get(image_name) or {}).get("digest")
+        if digest is None:
+            image = backend.image_inspect(image_name)
+            if image is not None:
+                digest = (image["repo_digests"] or [image["id"]])[0]
+        return digest
+    except (DockerError, OSError) as e:
+        logger.info(f"could not determine the image of {env_name}: {e}")
+        return None
+
+
+# label of the environment images with the version information (last line of the dockerfiles), e.g.
+# "<version>. | <further information> | ..."
+IMAGE_DESCRIPTION_LABEL = "org.opencontainers.image.description"
+
+# {digest: labels} (the labels are part of the image, i.e. they never change for a given digest)
+_image_labels_cache = {}
+
+
+def get_image_labels(image_name, digest=None):
+    """return the labels of the local image. They are cached per image digest (in memory and in
+    util.image_info_path), i.e. docker is only asked for images which were not seen before.
+
+    Args:
+        image_name (str): e.g. ghcr.io/ackrep-org/default_environment:latest
+        digest (str or None, optional): digest of the local image. Defaults to None (the digest which was recorded by
+        refresh_image; docker is asked if there is none).
+
+    Returns:
+        dict or None: {label: value} or None if the image does not exist
+    """
+    if digest is None:
+        digest = (_load_image_freshness().get(image_name) or {}).get("digest")
+    if digest is not None:
+        with _docker_state_lock:
+            if digest not in _image_labels_cache:
+                entry = _load_json_state(util.image_info_path).get(digest)
+                if entry is not None:
+                    _image_labels_cache[digest] = entry["labels"]
+            labels = _image_labels_cache.get(digest)
+        if labels is not None:
+            return labels
+
+    image = docker_backend.get_backend().image_inspect(image_name)
+    if image is None:
+        return None
+    labels = image["labels"]
+    with _docker_state_lock:
+        # only keep the entries of the current version of the image
+        state = {
+            d: entry for d, entry in _load_json_state(util.image_info_path).items() if entry["image"] != image_name
+        }
+        for d in image["repo_digests"] + [image["id"]]:
+            _image_labels_cache[d] = labels
+            state[d] = {"image": image_name, "labels": labels}
+        _save_json_state(util.image_info_path, state)
+    return labels
+
+
+def get_environment_description(env_name):
+    """return the description of the (remote) image of the environment (see IMAGE_DESCRIPTION_LABEL) or None if the
+    image is not available"""
+    labels = get_image_labels(get_remote_image_name(env_name))
+    return (labels or {}).get(IMAGE_DESCRIPTION_LABEL)
+
+
+# labels of the containers which are managed by ackrep (see start_idle_container and look_for_running_container)
+CONTAINER_LABEL_PREFIX = "org.ackrep."
+POOL_LABEL = CONTAINER_LABEL_PREFIX + "pool"
+# labels which have to match for a container to be reused
+CONTAINER_IDENTITY_LABELS = [
+    "env",
+    "env_key",
+    "image",
+    "image_id",
+    "database_path",
+    "data_path",
+    "data_commit",
+    "db_hash",
+]
+
+# created inside the container after the database was loaded (see signal_container_ready)
+CONTAINER_READY_FILE = "/tmp/ackrep_container_ready"
+CONTAINER_READY_POLL_INTERVAL = 0.05  # s
+# images built before the ready file was introduced never create it, their database is probed directly instead
+# (see get_database_probe_script)
+CONTAINER_READY_PROBE_INTERVAL = 0.5  # s
+
+# exits with 0 if every metadata file of the data repo has its row in the (sqlite) database of the container
+_DATABASE_PROBE_TEMPLATE = """
+import os, sqlite3, sys
+try:
+    connection = sqlite3.connect("file:" + {database_path!r} + "?mode=ro", uri=True, timeout=0.1)
+    loaded = sum(connection.execute("SELECT COUNT(*) FROM " + table).fetchone()[0] for table in {tables!r})
+except sqlite3.Error:
+    sys.exit(1)
+expected = sum("metadata.yml" in filenames for dirpath, dirnames, filenames in os.walk({data_path!r}))
+sys.exit(0 if 0 < expected <= loaded else 1)
+"""
+
+_data_snapshot_cache = {}
+
+
+def get_data_snapshot():
+    """return the commit and a hash of all metadata files of the data repo (i.e. of the content of the database
+    which is loaded when a container starts). The result is computed once per process.
+
+    Returns:
+        tuple: (commit hexsha or "unknown", hex digest)
+    """
+    if data_path not in _data_snapshot_cache:
+        try:
+            repo = Repo(data_path)
+            commit = repo.head.commit.hexsha
+            repo.close()
+        except (InvalidGitRepositoryError, NoSuchPathError, ValueError):
+            commit = "unknown"
+
+        hasher = hashlib.sha256()
+        for dirpath, dirnames, filenames in os.walk(data_path):
+            dirnames[:] = sorted(d for d in dirnames if d not in result_cache.IGNORED_NAMES and d != ".git")
+            if "metadata.yml" in filenames:
+                fpath = os.path.join(dirpath, "metadata.yml")
+                hasher.update(f"{os.path.relpath(fpath, data_path)}\0".encode("utf8"))
+                with open(fpath, "rb") as f:
+                    hasher.update(f.read())
+        _data_snapshot_cache[data_path] = (commit, hasher.hexdigest())
+
+    return _data_snapshot_cache[data_path]
+
+
+def get_image_id(image_name):
+    """return the id of the local image or None"""
+    image = docker_backend.get_backend().image_inspect(image_name)
+    return None if image is None else image["id"]
+
+
+def get_environment_key(env_name):
+    entity = models.EnvironmentSpecification.objects.filter(name=env_name).first()
+    return entity.key if entity is not None else ""
+
+
+def get_container_labels(env_name, image_name):
+    """return the labels which identify a pool container (see look_for_running_container)
+
+    Args:
+        env_name (str): name of environment (e.g. default_environment)
+        image_name (str): name of the image the container is started from
+
+    Returns:
+        dict: {label: value}
+    """
+    database_path, ackrep_data_path = get_container_paths()
+    data_commit, db_hash = get_data_snapshot()
+    labels = {
+        "env": env_name,
+        "env_key": get_environment_key(env_name),
+        "image": image_name,
+        "image_id": get_image_id(image_name) or "",
+        "database_path": database_path,
+        "data_path": ackrep_data_path,
+        "data_commit": data_commit,
+        "db_hash": db_hash,
+    }
+    return {CONTAINER_LABEL_PREFIX + name: value for name, value in labels.items()}
+
+
+def list_pool_containers():
+    """return the running pool containers (one request to the docker backend)
+
+    Returns:
+        list: dicts with the keys id, state, health, started, replica and the identity labels (without prefix)
+    """
+    containers = []
+    for container in docker_backend.get_backend().list_containers(labels={POOL_LABEL: "true"}):
+        entry = {"id": container["id"], "state": container["state"], "health": container["health"]}
+        for name in ["started", "replica"] + CONTAINER_IDENTITY_LABELS:
+            entry[name] = container["labels"].get(CONTAINER_LABEL_PREFIX + name, "")
+        containers.append(entry)
+    return containers
+
+
+def mark_containers_used(*container_ids):
+    """record the time of use (the idle time of pool containers is measured from it, see retire_idle_containers)"""
+    with _docker_state_lock:
+        state = _load_json_state(util.container_pool_path)
+        for container_id in container_ids:
+            state[container_id] = time.time()
+        _save_json_state(util.container_pool_path, state)
+
+
+@contextlib.contextmanager
+def container_in_use(container_id):
+    """mark the pool container as used while a command runs in it: the time of use is refreshed periodically
+    (a quarter of settings.CONTAINER_IDLE_TIMEOUT) and after the command, i.e. long checks or batches are not
+    considered idle (see retire_idle_containers), also by other processes.
+
+    Args:
+        container_id (str): id of the container
+    """
+    finished = threading.Event()
+
+    def refresh():
+        while not finished.wait(settings.CONTAINER_IDLE_TIMEOUT / 4):
+            mark_containers_used(container_id)
+
+    mark_containers_used(container_id)
+    thread = threading.Thread(target=refresh, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        finished.set()
+        thread.join()
+        mark_containers_used(container_id)
+
+
+def retire_idle_containers(containers=None, env_name=None):
+    """stop pool containers which have not been used for settings.CONTAINER_IDLE_TIMEOUT seconds
+    (containers in which commands run are refreshed, see container_in_use)
+
+    Args:
+        containers (list or None, optional): result of list_pool_containers. Defaults to None (-> query docker).
+        env_name (str or None, optional): only retire containers of this environment. Defaults to None (-> all).
+
+    Returns:
+        list: running containers (without the retired ones)
+    """
+    if containers is None:
+        containers = list_pool_containers()
+
+    with _docker_state_lock:
+        state = _load_json_state(util.container_pool_path)
+        running = []
+        for container in containers:
+            if env_name is not None and container["env"] != env_name:
+                running.append(container)
+                continue
+            try:
+                last_used = float(state.get(container["id"], container["started"]))
+            except ValueError:
+                last_used = 0
+            if time.time() - last_used > settings.CONTAINER_IDLE_TIMEOUT:
+                logger.info(f"retiring idle container {container['id']} ({container['env']})")
+                stop_container(container["id"])
+            else:
+                running.append(container)
+        # forget containers which do not exist anymore
+        state = {container["id"]: state[container["id"]] for container in running if container["id"] in state}
+        _save_json_state(util.container_pool_path, state)
+
+    return running
+
+
+def stop_container(container_id, timeout=1):
+    # the default is short because `docker stop` would wait for bash (pid 1) which ignores SIGTERM,
+    # containers running other processes (e.g. jupyter) should get the docker default of 10s to shut down
+    return docker_backend.get_backend().stop_container(container_id, timeout=timeout)
+
+
+def is_container_healthy(container):
+    """cheap health check based on the state reported by the docker backend (running and not unhealthy)"""
+    return container["state"] == "running" and container["health"] != "unhealthy"
+
+
+def look_for_running_container(env_name, replica=0):
+    """check if a pool container for the environment replica is already running (see start_idle_container).
+    Its labels have to match the current image and database (data commit and hash of the metadata files),
+    which replaces inspecting the container. Mismatching, unhealthy and idle containers are stopped
+    (also replicas beyond settings.CONTAINER_REPLICAS).
     If a valid container is found, return this containers id.
-    Otherwise shut down invalid containers and return None.
 
     Args:
         env_name (str): name of environment (e.g. default_environment)
+        replica (int, optional): index of the replica (see ReplicaScheduler). Defaults to 0.
 
     Returns:
         str or None: container_id
     """
-    container_id = None
+    # check if image is up to date with remote (at most once per settings.IMAGE_FRESHNESS_TTL),
+    # containers of an outdated image do not match the image_id label anymore
+    refresh_image(get_remote_image_name(env_name))
+
+    valid_replicas = [str(i) for i in range(replica_scheduler.get_replica_count())]
+    containers = [
+        c
+        for c in retire_idle_containers(env_name=env_name)
+        if c["env"] == env_name and (c["replica"] == str(replica) or c["replica"] not in valid_replicas)
+    ]
 
-    # check if image is up to date with remote
-    image_name = f"ghcr.io/ackrep-org/{env_name}:latest"
-    cmd = ["docker", "pull", image_name]
-    pull = run_command(cmd, logger=logger, capture_output=True)
-    assert pull.returncode == 0, f"Unable to pull image from remote. Does '{image_name}' exist?"
-
-    up_to_date = "Image is up to date" in pull.stdout
-
-    if up_to_date:
-        logger.info("image was up to date")
-        cmd = ["docker", "ps", "--filter", f"name={env_name}", "--format", "{{.ID}}::{{.Names}}"]
-        active_containers = run_command(cmd, logger=logger, capture_output=True)
-        for container in active_containers.stdout.split("\n"):
-            # disregard last split item
-            if container != "":
-                container_id = container.split("::")[0]
-                logger.info(f"Running Container found: {container}")
-
-                # check if environment container has the correct db loaded by comparing env vars
-                cmd = ["docker", "exec", container_id, "printenv", "ACKREP_DATA_PATH"]
-                res = run_command(cmd, capture_output=True)
-                data_path_container = res.stdout.replace("\n", "").split("/")[-1]
-                logger.info(f"data_path inside container: {data_path_container}")
-
-                # no db or wrong db in container:
-                if data_path_container != data_path.split("/")[-1]:
-                    logger.info("Running container has wrong db loaded. Shutting down.")
-                    cmd = ["docker", "stop", container_id]
-                    res = run_command(cmd, logger=logger, capture_output=True)
-                    assert res.returncode == 0
-                    container_id = None
-                break
-    else:
-        logger.info("image was NOT up to date")
+    # the image of a container might be the remote or the local (development) image
+    expected_labels = {}
+    container_id = None
+    for container in containers:
+        image_name = container["image"]
+        if image_name not in expected_labels:
+            expected_labels[image_name] = get_container_labels(env_name, image_name)
+        expected = expected_labels[image_name]
+        matches = all(container[name] == expected[CONTAINER_LABEL_PREFIX + name] for name in CONTAINER_IDENTITY_LABELS)
+
+        if (
+            container_id is None
+            and matches
+            and container["replica"] == str(replica)
+            and is_container_healthy(container)
+        ):
+            container_id = container["id"]
+            logger.info(f"Running Container found: {container_id}")
+        else:
+            state = (
+                container["state"] if container["health"] is None else f"{container['state']}, {container['health']}"
+            )
+            logger.info(f"Container {container['id']} is outdated or unhealthy ({state}). Shutting down.")
+            stop_container(container["id"])
+
+    if container_id is not None:
+        mark_containers_used(container_id)
     return container_id
 
 
-def start_idle_container(env_name, try_to_use_local_image=True, port_dict=None):
+def start_idle_container(env_name, try_to_use_local_image=True, port_dict=None, pooled=True, replica=0):
     """start container for given environment in background (detached). Use local image or pull image from remote.
-    set all necessary env vars. Then wait for db to be loaded inside container.
+    set all necessary env vars and resource limits (settings.CONTAINER_CPU_LIMIT, settings.CONTAINER_MEMORY_LIMIT).
+    Then wait for db to be loaded inside container.
     Note: this command does not execute ackrep commands, that is done by 'exec-ing' into the idle container.
 
     Args:
         env_name (str): name of environment (e.g. default_environment)
         try_to_use_local_image (bool, optional): prefer locally build images. Only relevant for devs. Defaults to True.
         port_dict (dict, optional): port dictionary {container_port:host_port} to publish data from inside container.
+        pooled (bool, optional): label the container such that it is reused by later checks (and retired when idle,
+        see look_for_running_container). Defaults to True.
+        replica (int, optional): index of the replica, the container is named <env_name>_<replica>. Defaults to 0.
 
     Returns:
         str: container_id
     """
+    backend = docker_backend.get_backend()
+    container_name = get_replica_name(env_name, replica)
+
+    labels = {}
+    if pooled:
+        labels[POOL_LABEL] = "true"
+        labels[CONTAINER_LABEL_PREFIX + "started"] = str(time.time())
+        labels[CONTAINER_LABEL_PREFIX + "replica"] = str(replica)
+
     # try to use local docker image (for development)
     image_name = "ackrep_deployment_" + env_name
-    cmd = ["docker", "images", "-q", image_name]
-    res = run_command(cmd, logger=logger, capture_output=True)
-    local_image_id = res.stdout.replace("\n", "")
-    logger.info(f"local image id: {local_image_id}")
-    if len(local_image_id) == 12 and try_to_use_local_image:  # 12 characters image id + \n
+    local_image = backend.image_inspect(image_name)
+    logger.info(f"local image id: {local_image['id'] if local_image is not None else ''}")
+    if local_image is not None and try_to_use_local_image:
         logger.info("running local image")
-        image_name = env_name  # since docker-compose doesnt use prefix
+        if pooled:
+            labels.update(get_container_labels(env_name, image_name))
 
+        # docker-compose has no counterpart in the docker backend (and `docker-compose run` has no resource limits)
         assert os.path.isdir(f"{root_path}/ackrep_deployment"), "docker-compose file not found"
         cmd = ["docker-compose", "--file", f"{root_path}/ackrep_deployment/docker-compose.yml", "run", "-d", "--rm"]
+        if port_dict is not None:
+            cmd.extend(get_port_mapping(port_dict))
+        cmd.extend(get_docker_env_vars())
+        cmd.extend(get_volume_mapping())
+        for label, value in labels.items():
+            cmd.extend(["--label", f"{label}={value}"])
+        # since docker-compose doesnt use prefix
+        cmd.extend([env_name, "bash"])
+
+        logger.info(f"docker command: {cmd}")
+        res = run_command(cmd, logger=logger, capture_output=True)
+        if res.returncode != 0:
+            raise DockerError("container was not started correctly")
+        else:
+            # running a container detached returns its id
+            container_id = res.stdout.replace("\n", "")
 
     # no local image -> use image from github
     # this is the default for everyone who doesnt build images locally
     else:
         logger.info("running remote image")
-        image_name = "ghcr.io/ackrep-org/" + env_name + ":latest"
+        image_name = get_remote_image_name(env_name)
 
-        # ! pull image first to ensure latest version is available
-        logger.info("pulling docker image")
-        pull_cmd = ["docker", "pull", image_name]
-        res = run_command(pull_cmd, logger=logger, capture_output=True)
-        assert res.returncode == 0, f"Unable to pull image from remote. Does '{image_name}' exist?"
+        # ! ensure latest version is available (no registry request if the image was verified recently)
+        refresh_image(image_name)
+        if get_image_id(image_name) is None:
+            # the image was removed after it was verified (the labels require the id of the image)
+            refresh_image(image_name, force=True)
+        if pooled:
+            labels.update(get_container_labels(env_name, image_name))
 
         logger.info("stopping old containers")
-        # stop all running containers with env_name to ensure name uniqueness
-        find_cmd = ["docker", "ps", "--filter", f"name={env_name}", "-q"]
-        res = run_command(find_cmd, logger=logger, capture_output=True)
-        if len(res.stdout) > 0:
-            ids = res.stdout.split("\n")[:-1]
-            for i in ids:
-                stop_cmd = ["docker", "stop", i]
-                run_command(stop_cmd, logger=logger, capture_output=True)
+        # stop the running container of this replica to ensure name uniqueness (other replicas keep running)
+        for container in backend.list_containers(name=container_name):
+            if container["name"] == container_name:
+                stop_container(container["id"])
+
+        volume_config = get_volume_config()
+        container_id = backend.run_container(
+            image_name,
+            ["bash"],
+            name=container_name,
+            environment=get_docker_environment(),
+            labels=labels,
+            binds=volume_config["binds"],
+            volumes_from=volume_config["volumes_from"],
+            ports=port_dict,
+            cpus=settings.CONTAINER_CPU_LIMIT or None,
+            memory=int(settings.CONTAINER_MEMORY_LIMIT * 2**20) or None,
+        )
 
-        cmd = ["docker", "run", "-d", "-ti", "--rm", "--name", env_name]
-        # * Note: even though we are running the container in the background (detached -d), we still have to
-        # * specify -ti (terminal, interactive) to keep the container running in idle (waiting for bash input).
-        # * Otherwise, the container would stop after running the entrypoint script (load db). This is noteworthy,
-        # * since -d and -ti seem to be contradictory.
+    # wait for db to be loaded, since the container is running detached
+    start = time.time()
+    try:
+        wait_for_container_ready(container_id)
+    except (TimeoutError, DockerError):
+        stop_container(container_id)
+        raise
+    logger.info(f"New env container started after {round(time.time() - start, 1)} seconds.")
+    if pooled:
+        mark_containers_used(container_id)
+    return container_id
 
-    # building the docker command
-    if port_dict is not None:
-        cmd.extend(get_port_mapping(port_dict))
 
-    cmd.extend(get_docker_env_vars())
+def signal_container_ready():
+    """create the file which signals that the database of the container is loaded (see wait_for_container_ready).
+    This is done by `ackrep -l` (i.e. by the entrypoint of the environment images), the path is passed via the env
+    var ACKREP_READY_FILE (see get_docker_environment). Outside of containers, nothing happens.
+    """
+    ready_file_path = os.environ.get("ACKREP_READY_FILE")
+    if ready_file_path:
+        with open(ready_file_path, "w") as f:
+            f.write(f"{time.time()}\n")
 
-    cmd.extend(get_volume_mapping())
 
-    cmd.extend([image_name, "bash"])
+def wait_for_container_ready(container_id, timeout=None):
+    """wait until the database of the container is loaded, i.e. until the entrypoint created CONTAINER_READY_FILE.
+    Instead of repeatedly starting ackrep inside the container, a single exec waits for the file (a stat every
+    CONTAINER_READY_POLL_INTERVAL seconds inside the container).
+    For compatibility with older images (which do not create the file), the database is additionally probed every
+    CONTAINER_READY_PROBE_INTERVAL seconds by a short python script which does not depend on a specific entity
+    (see get_database_probe_script).
 
-    logger.info(f"docker command: {cmd}")
-    res = run_command(cmd, logger=logger, capture_output=True)
-    if res.returncode != 0:
-        raise DockerError("container was not started correctly")
-    else:
-        # running a container detached returns its id
-        container_id = res.stdout.replace("\n", "")
+    Args:
+        container_id (str): id of the container
+        timeout (float or None, optional): time limit in seconds. Defaults to None (settings.CONTAINER_READY_TIMEOUT).
 
-    # wait for db to be loaded, since the container is running detached
-    start = time.time()
-    while True:
-        logger.info("waiting for db to be loaded...")
-        # Test with "definately existing" key UXMFA and not {key} to avoid potential issues with new keys
-        cmd = ["docker", "exec", container_id, "ackrep", "--show-entity-info", "UXMFA"]
-        res = run_command(cmd, capture_output=True)
-        if res.returncode == 0:
-            break
-        else:
-            time.sleep(1)
-            if time.time() - start > 60:
-                logger.error(
-                    f"Timeout: Cant find key UXMFA in database, \
-                    which probably did not load correctly. Aborting."
-                )
-                raise TimeoutError(
-                    f"Timeout: Cant find key UXMFA in database, \
-                    which probably did not load correctly. Aborting."
-                )
-    logger.info(f"New env container started after {round(time.time() - start, 1)} seconds.")
-    return container_id
+    Raises:
+        TimeoutError: if the database was not loaded in time
+        DockerError: if the container stopped (e.g. because the entrypoint failed)
+    """
+    if timeout is None:
+        timeout = settings.CONTAINER_READY_TIMEOUT
+    max_polls = int(timeout / CONTAINER_READY_POLL_INTERVAL)
+    probe_polls = max(int(CONTAINER_READY_PROBE_INTERVAL / CONTAINER_READY_POLL_INTERVAL), 1)
+    probe_script = shlex.quote(get_database_probe_script())
+    script = (
+        "py=$(command -v python3 || command -v python); "
+        f"i=0; while [ ! -e {CONTAINER_READY_FILE} ]; do i=$((i+1)); "
+        f"if [ $i -gt {max_polls} ]; then exit {util.TIMEOUT_RETURNCODE}; fi; "
+        f'if [ $((i % {probe_polls})) -eq 0 ] && [ -n "$py" ] && "$py" -c {probe_script} >/dev/null 2>&1; '
+        "then exit 0; fi; "
+        f"sleep {CONTAINER_READY_POLL_INTERVAL}; done"
+    )
+
+    logger.info("waiting for db to be loaded...")
+    # the time limit of the exec itself only matters if the container hangs
+    res = docker_backend.get_backend().exec_run(container_id, ["sh", "-c", script], timeout=timeout + 30)
+    if res.returncode == util.TIMEOUT_RETURNCODE:
+        msg = f"Timeout: database of container {container_id} was not loaded within {timeout}s. Aborting."
+        logger.error(msg)
+        raise TimeoutError(msg)
+    elif res.returncode != 0:
+        msg = f"container {container_id} stopped before its database was loaded: {res.stderr}"
+        logger.error(msg)
+        raise DockerError(msg)
+
+
+def get_database_probe_script():
+    """return the source of a python script which checks inside the container whether its database is loaded,
+    i.e. whether the entity tables contain (at least) as many rows as there are metadata files in the data repo.
+    It only uses the standard library (sqlite3), i.e. it is much cheaper than starting ackrep.
+
+    Returns:
+        str: python source
+    """
+    database_path, ackrep_data_path = get_container_paths()
+    tables = [entity_type._meta.db_table for entity_type in model_utils.get_entity_types()]
+    return _DATABASE_PROBE_TEMPLATE.format(database_path=database_path, data_path=ackrep_data_path, tables=tables)
+
+
+def get_container_paths():
+    """return the paths of the database and of the data repo inside the container
+    (env vars are set by unittest)
+
+    Returns:
+        tuple: (database_path, ackrep_data_path)
+    """
+    # ut case
+    if os.environ.get("ACKREP_DATABASE_PATH") is not None and os.environ.get("ACKREP_DATA_PATH") is not None:
+        database_path = os.path.join("/code/ackrep_core", os.path.split(os.environ.get("ACKREP_DATABASE_PATH"))[-1])
+        ackrep_data_path = os.path.join("/code", os.path.split(os.environ.get("ACKREP_DATA_PATH"))[-1])
+    # nominal case
+    else:
+        database_path = os.path.join("/code/ackrep_core", "db.sqlite3")
+        ackrep_data_path = os.path.join("/code", data_path)
+    return database_path, ackrep_data_path
 
 
 def get_docker_env_vars():
@@ -1023,6 +2555,14 @@ def get_docker_env_vars():
     env var is set by unittest
     return array with flags and paths to extend docker cmd
     """
+    cmd_extension = []
+    for key, value in get_docker_environment().items():
+        cmd_extension.extend(["-e", f"{key}={value}"])
+    return cmd_extension
+
+
+def get_docker_environment():
+    """return the environment variables of the container as dict {variable: value} (see get_docker_env_vars)"""
     # ut case
     if os.environ.get("ACKREP_DATABASE_PATH") is not None and os.environ.get("ACKREP_DATA_PATH") is not None:
         msg = (
@@ -1030,25 +2570,23 @@ def get_docker_env_vars():
             + 'ACKREP_DATA_PATH=os.environ.get("ACKREP_DATA_PATH")'
         )
         logger.info(msg)
-        database_path = os.path.join("/code/ackrep_core", os.path.split(os.environ.get("ACKREP_DATABASE_PATH"))[-1])
-        ackrep_data_path = os.path.join("/code", os.path.split(os.environ.get("ACKREP_DATA_PATH"))[-1])
-        cmd_extension = ["-e", f"ACKREP_DATABASE_PATH={database_path}", "-e", f"ACKREP_DATA_PATH={ackrep_data_path}"]
     # nominal case
     else:
         logger.info(
             f"env var ACKREP_DATABASE_PATH, ACKREP_DATA_PATH no set, using defaults: db.sqlite3 and {data_path}"
         )
-        database_path = os.path.join("/code/ackrep_core", "db.sqlite3")
-        ackrep_data_path = os.path.join("/code", data_path)
-        cmd_extension = ["-e", f"ACKREP_DATABASE_PATH={database_path}", "-e", f"ACKREP_DATA_PATH={ackrep_data_path}"]
+    database_path, ackrep_data_path = get_container_paths()
+    environment = {"ACKREP_DATABASE_PATH": database_path, "ACKREP_DATA_PATH": ackrep_data_path}
     logger.info(f"ACKREP_DATABASE_PATH {database_path}")
     logger.info(f"ACKREP_DATA_PATH {ackrep_data_path}")
 
     # user id of host
-    host_uid = get_host_uid()
-    cmd_extension.extend(["-e", f"HOST_UID={host_uid}"])
+    environment["HOST_UID"] = get_host_uid()
 
-    return cmd_extension
+    # see signal_container_ready
+    environment["ACKREP_READY_FILE"] = CONTAINER_READY_FILE
+
+    return environment
 
 
 def get_host_uid():
@@ -1065,20 +2603,29 @@ def get_host_uid():
 
 def get_volume_mapping():
     """mount the appropriate data repo"""
+    volume_config = get_volume_config()
+    cmd_extension = []
+    for bind in volume_config["binds"]:
+        cmd_extension.extend(["-v", bind])
+    for container_name in volume_config["volumes_from"]:
+        cmd_extension.extend(["--volumes-from", container_name])
+    return cmd_extension
+
+
+def get_volume_config():
+    """return the volumes of the container as dict {"binds": [...], "volumes_from": [...]} (see get_volume_mapping)"""
 
     # nominal case
     if os.environ.get("CI") != "true":
         logger.info(f"data path: {data_path}")
         target = os.path.split(data_path)[1]
-        cmd_extension = ["-v", f"{data_path}:/code/{target}"]
+        return {"binds": [f"{data_path}:/code/{target}"], "volumes_from": []}
     # circleci unittest case
     else:
         # volumes cant be mounted in cirlceci, this is the workaround,
         # see https://circleci.com/docs/2.0/building-docker-images/#mounting-folders
         # dummy is created in .circleci/config.yaml
-        cmd_extension = ["--volumes-from", "dummy"]
-
-    return cmd_extension
+        return {"binds": [], "volumes_from": ["dummy"]}
 
 
 def get_port_mapping(port_dict):
@@ -1092,8 +2639,6 @@ def get_port_mapping(port_dict):
 
 def download_and_store_artifacts(branch_name):
     """download artifacts using the directory structure established in CI"""
-    save_cwd = os.getcwd()
-    os.chdir(root_path)
 
     circle_token = settings.SECRET_CIRCLECI_API_KEY
     cmd = [
@@ -1108,7 +2653,7 @@ def download_and_store_artifacts(branch_name):
     # --no-host-directories     omits directory with host url
     # --cut-dirs=6              omits next 6 directories --> artifact dir
 
-    res = run_command(cmd, logger=logger, capture_output=True, shell=True)
+    res = run_command(cmd, logger=logger, capture_output=True, shell=True, cwd=root_path)
     assert res.returncode == 0, "Unable to collect results from circleci."
 
     # it is assumed, that the last CI reports on github and the manually downloaded one (artifact) are identical
@@ -1121,8 +2666,6 @@ def download_and_store_artifacts(branch_name):
     repo.remotes.origin.pull()
     # run_command(["git", "-C", "./ackrep_ci_results", "status"], capture_output=False)
 
-    os.chdir(save_cwd)
-
 
 """ 
 Debug Commands:
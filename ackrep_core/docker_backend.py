@@ -0,0 +1,828 @@
+"""
+This module manages images and containers of the environments (see core.look_for_running_container and
+core.start_idle_container) via one of several interchangeable backends:
+
+- EngineAPIBackend: talks to the docker engine api over the unix socket. Every thread keeps one connection open
+  (keep-alive), i.e. listing, inspecting or stopping containers does not spawn a `docker` process and no text output
+  has to be parsed.
+- CLIBackend: uses the `docker` command (fallback, e.g. if the socket is not accessible or DOCKER_HOST is not a unix
+  socket).
+- FakeBackend: in-memory images and containers for unittests.
+
+The backend is selected by settings.DOCKER_BACKEND ("auto", "api", "cli") and can be replaced with `set_backend`.
+All backends return the same data structures (e.g. containers are dicts with the keys id, name, state, health,
+labels) and raise util.DockerError on failures.
+
+Note: `docker-compose` (local development images) and the exec of the checks themselves (streamed output, log
+files, time limits, see util.run_command) still use the command line.
+"""
+
+import os
+import io
+import re
+import json
+import tarfile
+import contextlib
+import socket
+import struct
+import logging
+import secrets
+import threading
+import subprocess
+import http.client
+import urllib.parse
+
+from django.conf import settings
+
+from .util import run_command, DockerError, TIMEOUT_RETURNCODE
+
+logger = logging.getLogger("ackrep_logger")
+
+DEFAULT_SOCKET_PATH = "/var/run/docker.sock"
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_socket_path():
+    """return the path of the docker socket or None if DOCKER_HOST is not a unix socket (e.g. tcp://...)"""
+    docker_host = os.environ.get("DOCKER_HOST", "")
+    if docker_host.startswith("unix://"):
+        return docker_host[len("unix://") :]
+    if docker_host:
+        return None
+    return DEFAULT_SOCKET_PATH
+
+
+def create_backend(kind="auto"):
+    """
+    :param kind:    "api", "cli", "fake" or "auto" (api if the socket is accessible and the engine responds, else cli)
+
+    :return:        backend instance
+    """
+    if kind == "cli":
+        return CLIBackend()
+    if kind == "fake":
+        return FakeBackend()
+
+    socket_path = get_socket_path()
+    if kind == "api":
+        return EngineAPIBackend(socket_path or DEFAULT_SOCKET_PATH)
+
+    assert kind == "auto", f"unknown docker backend: {kind}"
+    if socket_path is not None and os.access(socket_path, os.R_OK | os.W_OK):
+        backend = EngineAPIBackend(socket_path)
+        if backend.ping():
+            return backend
+    logger.info("docker engine api not available, using the docker command")
+    return CLIBackend()
+
+
+def get_backend():
+    """return the backend of this process (created on first use, see settings.DOCKER_BACKEND)"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend(settings.DOCKER_BACKEND)
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Replace the backend of this process (e.g. with a FakeBackend in unittests).
+
+    :param backend:     backend instance or None (-> create a new one on next use)
+
+    :return:            the previous backend (or None)
+    """
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
+
+
+class DockerBackend:
+    """
+    Interface of the backends. Containers are represented as dicts with the keys id, name, state (e.g. "running",
+    "paused", "exited"), health (None, "starting", "healthy", "unhealthy") and labels.
+    """
+
+    def image_inspect(self, image_name):
+        """return dict with the keys id, repo_digests (["sha256:...", ...]) and labels ({label: value}) or None if the
+        image does not exist"""
+        raise NotImplementedError
+
+    def pull_image(self, image_name):
+        """pull the image from the registry and return True if a new version was downloaded"""
+        raise NotImplementedError
+
+    def list_containers(self, name=None, labels=None):
+        """
+        :param name:    None or name filter (substring of the container name, like `docker ps --filter name=...`)
+        :param labels:  None or dict {label: value} which all have to match
+
+        :return:        list of running containers
+        """
+        raise NotImplementedError
+
+    def run_container(
+        self,
+        image_name,
+        command,
+        name=None,
+        environment=None,
+        labels=None,
+        binds=None,
+        volumes_from=None,
+        ports=None,
+        cpus=None,
+        memory=None,
+    ):
+        """
+        Start a detached container which is removed when it stops (like `docker run -d -ti --rm`).
+
+        :param image_name:      image
+        :param command:         list of arguments
+        :param name:            None or name of the container
+        :param environment:     None or dict {variable: value}
+        :param labels:          None or dict {label: value}
+        :param binds:           None or list of volume bindings ("host_path:container_path")
+        :param volumes_from:    None or list of container names
+        :param ports:           None or dict {host_port: container_port} (see core.get_port_mapping)
+        :param cpus:            None or cpu limit (number of cpus, e.g. 1.5)
+        :param memory:          None or memory limit in bytes
+
+        :return:                container id
+        """
+        raise NotImplementedError
+
+    def exec_run(self, container_id, cmd, user=None, timeout=None):
+        """
+        Run a (short) command in the container and wait for it.
+
+        :param timeout: None or time limit (s); exceeding it results in util.TIMEOUT_RETURNCODE
+
+        :return:        CompletedProcess-like object (args, returncode, stdout, stderr)
+        """
+        raise NotImplementedError
+
+    def stop_container(self, container_id, timeout=1):
+        """stop the container (SIGKILL after `timeout` seconds), return True on success"""
+        raise NotImplementedError
+
+    def container_stats(self, container_id):
+        """return dict (cpu_percent, memory_usage, memory_percent, pids; formatted like `docker stats`) or None"""
+        raise NotImplementedError
+
+    def get_archive(self, container_id, path):
+        """
+        Context manager which yields a binary stream of a tar archive of the file or directory inside the container
+        (like `docker cp <container>:<path> -`; the container does not have to run).
+        """
+        raise NotImplementedError
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+# errors of a keep-alive connection which was closed by the server in the meantime
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+_health_pattern = re.compile(r"\((healthy|unhealthy|health: starting)\)")
+
+
+class EngineAPIBackend(DockerBackend):
+    """
+    Backend which sends http requests to the docker engine over the unix socket, see
+    https://docs.docker.com/engine/api/. Requests without api version use the newest version of the engine.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, timeout=60):
+        """
+        :param socket_path:     path of the unix socket of the docker engine
+        :param timeout:         time limit (s) for requests (except pulls and execs which take as long as they take)
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        # one connection per thread (http.client connections are not thread-safe)
+        self._local = threading.local()
+
+    def _get_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = _UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        return connection
+
+    def _drop_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+        self._local.connection = None
+
+    def request(self, method, path, params=None, body=None, pooled=True, expected=(200, 201, 204), timeout=None):
+        """
+        :param method:      http method
+        :param path:        e.g. /containers/json
+        :param params:      None or dict of query parameters
+        :param body:        None or json serializable object
+        :param pooled:      use the (kept-alive) connection of this thread. Long running requests (pull, exec) use a
+                            separate connection without time limit.
+        :param expected:    status codes which are no errors
+        :param timeout:     None or time limit of the separate connection (only for pooled=False)
+
+        :return:            (status, body as bytes)
+        """
+        if params:
+            path = f"{path}?{urllib.parse.urlencode(params)}"
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode("utf8")
+            headers["Content-Type"] = "application/json"
+
+        for attempt in range(2):
+            if pooled:
+                reused = getattr(self._local, "connection", None) is not None
+                connection = self._get_connection()
+            else:
+                reused = False
+                connection = _UnixHTTPConnection(self.socket_path, timeout=timeout)
+            try:
+                connection.request(method, path, body=data, headers=headers)
+                response = connection.getresponse()
+                content = response.read()
+            except _STALE_CONNECTION_ERRORS as e:
+                if pooled:
+                    self._drop_connection()
+                else:
+                    connection.close()
+                # the engine closes idle connections -> retry once with a new connection
+                if reused and attempt == 0:
+                    continue
+                raise DockerError(f"docker engine api request {method} {path} failed: {e}") from e
+            except OSError as e:
+                if pooled:
+                    self._drop_connection()
+                else:
+                    connection.close()
+                raise DockerError(f"docker engine api request {method} {path} failed: {e}") from e
+            break
+
+        if not pooled:
+            connection.close()
+        elif response.will_close:
+            self._drop_connection()
+
+        if response.status not in expected:
+            try:
+                message = json.loads(content)["message"]
+            except (ValueError, KeyError, TypeError):
+                message = content.decode("utf8", errors="replace")
+            raise DockerError(f"docker engine api request {method} {path} failed ({response.status}): {message}")
+        return response.status, content
+
+    def ping(self):
+        try:
+            self.request("GET", "/_ping")
+        except DockerError as e:
+            logger.info(str(e))
+            return False
+        return True
+
+    def image_inspect(self, image_name):
+        status, content = self.request("GET", f"/images/{image_name}/json", expected=(200, 404))
+        if status == 404:
+            return None
+        image = json.loads(content)
+        return {
+            "id": image["Id"],
+            "repo_digests": [repo_digest.split("@")[-1] for repo_digest in image.get("RepoDigests") or []],
+            "labels": (image.get("Config") or {}).get("Labels") or {},
+        }
+
+    def pull_image(self, image_name):
+        repository, tag = _split_image_name(image_name)
+        _, content = self.request("POST", "/images/create", params={"fromImage": repository, "tag": tag}, pooled=False)
+        changed = True
+        # the response is a stream of json messages (progress)
+        for line in content.decode("utf8", errors="replace").splitlines():
+            if not line.strip():
+                continue
+            message = json.loads(line)
+            if "error" in message:
+                raise DockerError(f"Unable to pull image from remote. Does '{image_name}' exist? {message['error']}")
+            if "Image is up to date" in message.get("status", ""):
+                changed = False
+        return changed
+
+    def list_containers(self, name=None, labels=None):
+        filters = {}
+        if name is not None:
+            filters["name"] = [name]
+        if labels:
+            filters["label"] = [f"{label}={value}" for label, value in labels.items()]
+        params = {"filters": json.dumps(filters)} if filters else None
+        _, content = self.request("GET", "/containers/json", params=params)
+
+        containers = []
+        for container in json.loads(content):
+            match = _health_pattern.search(container.get("Status", ""))
+            containers.append(
+                {
+                    "id": container["Id"],
+                    "name": (container.get("Names") or ["/"])[0].lstrip("/"),
+                    "state": container.get("State", ""),
+                    "health": match.group(1).replace("health: ", "") if match else None,
+                    "labels": container.get("Labels") or {},
+                }
+            )
+        return containers
+
+    def run_container(
+        self,
+        image_name,
+        command,
+        name=None,
+        environment=None,
+        labels=None,
+        binds=None,
+        volumes_from=None,
+        ports=None,
+        cpus=None,
+        memory=None,
+    ):
+        host_config = {"AutoRemove": True}
+        if cpus:
+            host_config["NanoCpus"] = int(cpus * 1e9)
+        if memory:
+            host_config["Memory"] = int(memory)
+        if binds:
+            host_config["Binds"] = list(binds)
+        if volumes_from:
+            host_config["VolumesFrom"] = list(volumes_from)
+        exposed_ports = {}
+        if ports:
+            host_config["PortBindings"] = {}
+            for host_port, container_port in ports.items():
+                exposed_ports[f"{container_port}/tcp"] = {}
+                host_config["PortBindings"][f"{container_port}/tcp"] = [{"HostPort": str(host_port)}]
+        body = {
+            "Image": image_name,
+            "Cmd": list(command),
+            # like `docker run -ti`: keeps bash (waiting for input) running
+            "Tty": True,
+            "OpenStdin": True,
+            "Env": [f"{key}={value}" for key, value in (environment or {}).items()],
+            "Labels": labels or {},
+            "ExposedPorts": exposed_ports,
+            "HostConfig": host_config,
+        }
+        params = {"name": name} if name is not None else None
+
+        status, content = self.request("POST", "/containers/create", params=params, body=body, expected=(201, 404))
+        if status == 404:
+            # like `docker run`: pull missing images
+            self.pull_image(image_name)
+            status, content = self.request("POST", "/containers/create", params=params, body=body)
+        container_id = json.loads(content)["Id"]
+        self.request("POST", f"/containers/{container_id}/start")
+        return container_id
+
+    def exec_run(self, container_id, cmd, user=None, timeout=None):
+        body = {"AttachStdout": True, "AttachStderr": True, "Cmd": list(cmd)}
+        if user is not None:
+            body["User"] = str(user)
+        _, content = self.request("POST", f"/containers/{container_id}/exec", body=body)
+        exec_id = json.loads(content)["Id"]
+
+        # the engine hijacks the connection and sends the multiplexed output until the command exits
+        body = {"Detach": False, "Tty": False}
+        try:
+            _, content = self.request("POST", f"/exec/{exec_id}/start", body=body, pooled=False, timeout=timeout)
+        except DockerError as e:
+            if not isinstance(e.__cause__, socket.timeout):
+                raise
+            content = b""
+            returncode = TIMEOUT_RETURNCODE
+        else:
+            _, info = self.request("GET", f"/exec/{exec_id}/json")
+            returncode = json.loads(info)["ExitCode"]
+        stdout, stderr = _demultiplex(content)
+
+        arglist = ["docker", "exec", container_id, *cmd]
+        res = subprocess.CompletedProcess(arglist, returncode, stdout.decode("utf8", errors="replace"))
+        res.stderr = stderr.decode("utf8", errors="replace")
+        return res
+
+    def stop_container(self, container_id, timeout=1):
+        # 304: already stopped, 404: already removed (--rm)
+        status, _ = self.request(
+            "POST", f"/containers/{container_id}/stop", params={"t": int(timeout)}, expected=(204, 304, 404)
+        )
+        return status != 404
+
+    def container_stats(self, container_id):
+        try:
+            _, content = self.request("GET", f"/containers/{container_id}/stats", params={"stream": "false"})
+        except DockerError as e:
+            logger.info(str(e))
+            return None
+        return _format_stats(json.loads(content))
+
+    @contextlib.contextmanager
+    def get_archive(self, container_id, path):
+        # the response is read while it is received (separate connection)
+        connection = _UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        try:
+            query = urllib.parse.urlencode({"path": path})
+            try:
+                connection.request("GET", f"/containers/{container_id}/archive?{query}")
+                response = connection.getresponse()
+            except OSError as e:
+                raise DockerError(f"docker engine api request GET /containers/{container_id}/archive failed: {e}")
+            if response.status != 200:
+                raise DockerError(f"could not get archive of {container_id}:{path} ({response.status})")
+            yield response
+        finally:
+            connection.close()
+
+
+def _split_image_name(image_name):
+    """e.g. ghcr.io/ackrep-org/env:latest -> (ghcr.io/ackrep-org/env, latest); the registry might contain a port.
+    For references with digest (repo@sha256:...) the digest is returned instead of the tag (accepted by the api)."""
+    repository, sep, digest = image_name.partition("@")
+    if sep:
+        # a tag in front of the digest is ignored by docker as well
+        return _split_image_name(repository)[0], digest
+    repository, sep, tag = image_name.rpartition(":")
+    if not sep or "/" in tag:
+        return image_name, "latest"
+    return repository, tag
+
+
+def _demultiplex(content):
+    """split the multiplexed output stream of the engine api into (stdout, stderr)"""
+    chunks = {1: [], 2: []}
+    position = 0
+    while position + 8 <= len(content):
+        stream_type = content[position]
+        (size,) = struct.unpack(">I", content[position + 4 : position + 8])
+        chunks.get(stream_type, chunks[1]).append(content[position + 8 : position + 8 + size])
+        position += 8 + size
+    return b"".join(chunks[1]), b"".join(chunks[2])
+
+
+def _format_bytes(size):
+    """format like `docker stats` (binary units, 4 significant digits)"""
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            return f"{size:.4g}{unit}"
+        size /= 1024
+    return f"{size:.4g}TiB"
+
+
+def _format_stats(stats):
+    """compute cpu and memory usage like `docker stats` from the raw statistics of the engine api"""
+    cpu_stats = stats.get("cpu_stats") or {}
+    precpu_stats = stats.get("precpu_stats") or {}
+    cpu_delta = cpu_stats.get("cpu_usage", {}).get("total_usage", 0) - precpu_stats.get("cpu_usage", {}).get(
+        "total_usage", 0
+    )
+    system_delta = cpu_stats.get("system_cpu_usage", 0) - precpu_stats.get("system_cpu_usage", 0)
+    online_cpus = cpu_stats.get("online_cpus") or len(cpu_stats.get("cpu_usage", {}).get("percpu_usage") or [1])
+    cpu_percent = cpu_delta / system_delta * online_cpus * 100 if cpu_delta > 0 and system_delta > 0 else 0.0
+
+    memory_stats = stats.get("memory_stats") or {}
+    usage = memory_stats.get("usage", 0)
+    # the page cache is not counted (cgroup v1: total_inactive_file, cgroup v2: inactive_file)
+    for key in ("total_inactive_file", "inactive_file"):
+        inactive = (memory_stats.get("stats") or {}).get(key)
+        if inactive is not None and inactive < usage:
+            usage -= inactive
+            break
+    limit = memory_stats.get("limit", 0)
+    memory_percent = usage / limit * 100 if limit else 0.0
+
+    return {
+        "cpu_percent": f"{cpu_percent:.2f}%",
+        "memory_usage": f"{_format_bytes(usage)} / {_format_bytes(limit)}",
+        "memory_percent": f"{memory_percent:.2f}%",
+        "pids": str((stats.get("pids_stats") or {}).get("current", 0)),
+    }
+
+
+class CLIBackend(DockerBackend):
+    """
+    Backend which runs the `docker` command (one process per call).
+    """
+
+    def image_inspect(self, image_name):
+        res = run_command(["docker", "image", "inspect", "--format", "{{json .}}", image_name], capture_output=True)
+        if res.returncode != 0:
+            return None
+        try:
+            image = json.loads(res.stdout.strip())
+        except ValueError:
+            return None
+        return {
+            "id": image["Id"],
+            "repo_digests": [repo_digest.split("@")[-1] for repo_digest in image.get("RepoDigests") or []],
+            "labels": (image.get("Config") or {}).get("Labels") or {},
+        }
+
+    def pull_image(self, image_name):
+        res = run_command(["docker", "pull", image_name], logger=logger, capture_output=True)
+        if res.returncode != 0:
+            raise DockerError(f"Unable to pull image from remote. Does '{image_name}' exist?")
+        return "Image is up to date" not in res.stdout
+
+    def list_containers(self, name=None, labels=None):
+        cmd = ["docker", "ps", "-q", "--no-trunc"]
+        if name is not None:
+            cmd.extend(["--filter", f"name={name}"])
+        for label, value in (labels or {}).items():
+            cmd.extend(["--filter", f"label={label}={value}"])
+        res = run_command(cmd, logger=logger, capture_output=True)
+        ids = res.stdout.split()
+        if res.returncode != 0 or not ids:
+            return []
+
+        res = run_command(["docker", "inspect", *ids], logger=logger, capture_output=True)
+        try:
+            details = json.loads(res.stdout)
+        except ValueError:
+            # containers might stop between both commands
+            return []
+        containers = []
+        for container in details:
+            state = container.get("State") or {}
+            containers.append(
+                {
+                    "id": container["Id"],
+                    "name": container.get("Name", "").lstrip("/"),
+                    "state": state.get("Status", ""),
+                    "health": (state.get("Health") or {}).get("Status"),
+                    "labels": (container.get("Config") or {}).get("Labels") or {},
+                }
+            )
+        return containers
+
+    def run_container(
+        self,
+        image_name,
+        command,
+        name=None,
+        environment=None,
+        labels=None,
+        binds=None,
+        volumes_from=None,
+        ports=None,
+        cpus=None,
+        memory=None,
+    ):
+        # * Note: even though we are running the container in the background (detached -d), we still have to
+        # * specify -ti (terminal, interactive) to keep the container running in idle (waiting for bash input).
+        cmd = ["docker", "run", "-d", "-ti", "--rm"]
+        if name is not None:
+            cmd.extend(["--name", name])
+        if cpus:
+            cmd.extend(["--cpus", str(cpus)])
+        if memory:
+            cmd.extend(["--memory", f"{int(memory)}b"])
+        for host_port, container_port in (ports or {}).items():
+            cmd.extend(["-p", f"{host_port}:{container_port}"])
+        for key, value in (environment or {}).items():
+            cmd.extend(["-e", f"{key}={value}"])
+        for bind in binds or []:
+            cmd.extend(["-v", bind])
+        for container_name in volumes_from or []:
+            cmd.extend(["--volumes-from", container_name])
+        for label, value in (labels or {}).items():
+            cmd.extend(["--label", f"{label}={value}"])
+        cmd.extend([image_name, *command])
+
+        logger.info(f"docker command: {cmd}")
+        res = run_command(cmd, logger=logger, capture_output=True)
+        if res.returncode != 0:
+            raise DockerError("container was not started correctly")
+        # running a container detached returns its id
+        return res.stdout.strip()
+
+    def exec_run(self, container_id, cmd, user=None, timeout=None):
+        arglist = ["docker", "exec"]
+        if user is not None:
+            arglist.extend(["--user", str(user)])
+        return run_command([*arglist, container_id, *cmd], capture_output=True, timeout=timeout)
+
+    def stop_container(self, container_id, timeout=1):
+        cmd = ["docker", "stop", "--time", str(int(timeout)), container_id]
+        res = run_command(cmd, logger=logger, capture_output=True)
+        return res.returncode == 0
+
+    def container_stats(self, container_id):
+        cmd = ["docker", "stats", "--no-stream", "--format", "{{json .}}", container_id]
+        res = run_command(cmd, logger=logger, capture_output=True)
+        if res.returncode != 0:
+            return None
+        try:
+            stats = json.loads(res.stdout.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            return None
+
+        return {
+            "cpu_percent": stats.get("CPUPerc"),
+            "memory_usage": stats.get("MemUsage"),
+            "memory_percent": stats.get("MemPerc"),
+            "pids": stats.get("PIDs"),
+        }
+
+    @contextlib.contextmanager
+    def get_archive(self, container_id, path):
+        cmd = ["docker", "cp", f"{container_id}:{path}", "-"]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            yield proc.stdout
+            # read the remainder (e.g. the padding of the archive), otherwise docker cp fails with a broken pipe
+            while proc.stdout.read(2**16):
+                pass
+        except BaseException as e:
+            proc.stdout.close()
+            try:
+                proc.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+            # e.g. an empty stream (tarfile.ReadError) because docker cp failed
+            if proc.returncode > 0:
+                raise DockerError(f"could not get archive of {container_id}:{path}: {_read_stderr(proc)}") from e
+            raise
+        finally:
+            proc.stdout.close()
+            proc.wait()
+        if proc.returncode != 0:
+            raise DockerError(f"could not get archive of {container_id}:{path}: {_read_stderr(proc)}")
+
+
+def _read_stderr(proc):
+    with proc.stderr:
+        return proc.stderr.read().decode("utf8", errors="replace").strip()
+
+
+class FakeBackend(DockerBackend):
+    """
+    In-memory backend for unittests. Images have to be added (`add_image`, `add_remote_image`) before containers can
+    be started. Commands which are executed in containers are answered by `exec_handler` (default: returncode 0).
+    All calls are recorded in `calls` as (method name, first argument).
+    """
+
+    def __init__(self):
+        # {image name: {"id": ..., "repo_digests": [...]}}
+        self.images = {}
+        self.remote_images = {}
+        # {container id: container dict (see DockerBackend) with the additional keys image, command, run_kwargs}
+        self.containers = {}
+        self.calls = []
+        # callable(container, cmd, user) -> (returncode, stdout, stderr)
+        self.exec_handler = None
+        # files which are returned by get_archive (for all containers): {absolute path: bytes}
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def add_image(self, image_name, image_id=None, digest=None, labels=None):
+        self.images[image_name] = _fake_image(image_id, digest, labels)
+
+    def add_remote_image(self, image_name, image_id=None, digest=None, labels=None):
+        self.remote_images[image_name] = _fake_image(image_id, digest, labels)
+
+    def _record(self, method, arg):
+        with self._lock:
+            self.calls.append((method, arg))
+
+    def image_inspect(self, image_name):
+        self._record("image_inspect", image_name)
+        image = self.images.get(image_name)
+        if image is None:
+            return None
+        return {"id": image["id"], "repo_digests": list(image["repo_digests"]), "labels": dict(image["labels"])}
+
+    def pull_image(self, image_name):
+        self._record("pull_image", image_name)
+        if image_name not in self.remote_images:
+            raise DockerError(f"Unable to pull image from remote. Does '{image_name}' exist?")
+        changed = self.images.get(image_name) != self.remote_images[image_name]
+        self.images[image_name] = dict(self.remote_images[image_name])
+        return changed
+
+    def list_containers(self, name=None, labels=None):
+        self._record("list_containers", name)
+        result = []
+        for container in list(self.containers.values()):
+            if name is not None and name not in container["name"]:
+                continue
+            if any(container["labels"].get(label) != value for label, value in (labels or {}).items()):
+                continue
+            result.append({key: container[key] for key in ("id", "name", "state", "health", "labels")})
+        return result
+
+    def run_container(
+        self,
+        image_name,
+        command,
+        name=None,
+        environment=None,
+        labels=None,
+        binds=None,
+        volumes_from=None,
+        ports=None,
+        cpus=None,
+        memory=None,
+    ):
+        self._record("run_container", image_name)
+        if image_name not in self.images:
+            self.pull_image(image_name)
+        container_id = _random_id()
+        if name is None:
+            name = f"fake_{container_id[:12]}"
+        if any(container["name"] == name for container in self.containers.values()):
+            raise DockerError(f"container name {name} is already in use")
+        self.containers[container_id] = {
+            "id": container_id,
+            "name": name,
+            "state": "running",
+            "health": None,
+            "labels": dict(labels or {}),
+            "image": image_name,
+            "command": list(command),
+            "run_kwargs": {
+                "environment": environment,
+                "binds": binds,
+                "volumes_from": volumes_from,
+                "ports": ports,
+                "cpus": cpus,
+                "memory": memory,
+            },
+        }
+        return container_id
+
+    def exec_run(self, container_id, cmd, user=None, timeout=None):
+        self._record("exec_run", container_id)
+        container = self.containers.get(container_id)
+        if container is None or container["state"] != "running":
+            returncode, stdout, stderr = 1, "", f"Error: container {container_id} is not running"
+        elif self.exec_handler is None:
+            returncode, stdout, stderr = 0, "", ""
+        else:
+            returncode, stdout, stderr = self.exec_handler(container, cmd, user)
+        res = subprocess.CompletedProcess(["docker", "exec", container_id, *cmd], returncode, stdout)
+        res.stderr = stderr
+        return res
+
+    def stop_container(self, container_id, timeout=1):
+        self._record("stop_container", container_id)
+        # containers are started with --rm
+        return self.containers.pop(container_id, None) is not None
+
+    def container_stats(self, container_id):
+        self._record("container_stats", container_id)
+        if container_id not in self.containers:
+            return None
+        return {"cpu_percent": "0.00%", "memory_usage": "0B / 0B", "memory_percent": "0.00%", "pids": "1"}
+
+    @contextlib.contextmanager
+    def get_archive(self, container_id, path):
+        self._record("get_archive", container_id)
+        path = path.rstrip("/")
+        members = {p: c for p, c in self.files.items() if p == path or p.startswith(path + "/")}
+        if not members:
+            raise DockerError(f"could not get archive of {container_id}:{path}: no such file or directory")
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for member_path, content in sorted(members.items()):
+                info = tarfile.TarInfo(os.path.relpath(member_path, os.path.dirname(path)))
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        buffer.seek(0)
+        yield buffer
+
+
+def _random_id():
+    return secrets.token_hex(32)
+
+
+def _fake_image(image_id=None, digest=None, labels=None):
+    return {"id": image_id or _random_id(), "repo_digests": [digest] if digest else [], "labels": dict(labels or {})}
@@ -0,0 +1,264 @@
+"""
+This module executes notebooks with a pool of pre-started jupyter kernels.
+
+`jupyter nbconvert --execute --to html` starts a new jupyter application and a new kernel for every notebook. If
+several notebooks are checked from the same process (e.g. `ackrep --check-batch`), most of that time is spent on
+starting kernels and importing the same modules again. Instead, the kernels of the pool are started once and reused:
+
+- before each notebook, the kernel is reset (user namespace, modules of the previous notebook directory, sys.path,
+  open figures, working directory, execution count), such that notebooks do not interfere with each other
+- every cell has its own time limit (additionally, the whole notebook might have a time limit)
+- a kernel which timed out or died is restarted before it is used again
+- the html file is rendered in-process (same location and content as with nbconvert)
+
+The result mimics `util.run_command(["jupyter", "nbconvert", ...])` (returncode 0 on success, 1 on errors,
+util.TIMEOUT_RETURNCODE on timeouts).
+
+The jupyter packages (nbformat, nbclient, nbconvert, jupyter_client) are optional, see `is_available()`.
+"""
+
+import os
+import time
+import queue
+import atexit
+import threading
+import subprocess
+
+from django.conf import settings
+
+from .util import log_command_error, get_resource_dict, strip_decode, TIMEOUT_RETURNCODE
+
+try:
+    import nbformat
+    from nbclient import NotebookClient
+    from nbclient.exceptions import CellExecutionError, CellTimeoutError, DeadKernelError
+    from nbclient.util import run_sync
+    from nbconvert import HTMLExporter
+
+    # note: with the (blocking) KernelManager, nbclient does not enforce the cell timeout
+    from jupyter_client.manager import AsyncKernelManager
+except ImportError:
+    nbformat = None
+
+
+KERNEL_NAME = "python3"
+
+# imported by every kernel before the first notebook (import errors are ignored)
+PRELOAD_MODULES = ["numpy", "scipy", "sympy", "matplotlib", "matplotlib.pyplot"]
+
+# executed in the kernel before each notebook (the cell is removed from the result)
+_RESET_CODE = """
+import os as _os, sys as _sys
+_baseline = getattr(_sys, "_ackrep_kernel_baseline", None)
+if _baseline is None:
+    for _name in {preload_modules!r}:
+        try:
+            __import__(_name)
+        except ImportError:
+            pass
+    _baseline = _sys._ackrep_kernel_baseline = (list(_sys.path), _os.getcwd())
+# modules of the previous notebook directory might shadow equally named modules of the next one
+_previous_dir = getattr(_sys, "_ackrep_kernel_notebook_dir", None)
+if _previous_dir is not None:
+    for _name, _module in list(_sys.modules.items()):
+        if (getattr(_module, "__file__", None) or "").startswith(_previous_dir + _os.sep):
+            del _sys.modules[_name]
+if "matplotlib.pyplot" in _sys.modules:
+    _sys.modules["matplotlib.pyplot"].close("all")
+_sys.path[:] = _baseline[0]
+_sys._ackrep_kernel_notebook_dir = {notebook_dir!r}
+_os.chdir({notebook_dir!r})
+get_ipython().run_line_magic("reset", "-f")
+# the execution count is incremented after this cell (see also _remove_reset_cell)
+get_ipython().execution_count = 1
+"""
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def is_available() -> bool:
+    return nbformat is not None
+
+
+class KernelPool:
+    """
+    Pool of running kernels. Kernels are started lazily (at most `size`) and shut down at exit.
+    """
+
+    def __init__(self, size=None, kernel_name=KERNEL_NAME):
+        """
+        :param size:            maximum number of kernels (default: settings.NOTEBOOK_KERNEL_POOL_SIZE)
+        :param kernel_name:     name of the jupyter kernel spec
+        """
+        if size is None:
+            size = settings.NOTEBOOK_KERNEL_POOL_SIZE
+        self.size = max(int(size), 1)
+        self.kernel_name = kernel_name
+        self.kernel_managers = []
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _start_kernel(self):
+        km = AsyncKernelManager(kernel_name=self.kernel_name)
+        # the history of a reused kernel is irrelevant (and should not be written to the users history database)
+        run_sync(km.start_kernel)(extra_arguments=["--HistoryManager.hist_file=:memory:"])
+        self.kernel_managers.append(km)
+        return km
+
+    def acquire(self):
+        """
+        Return an idle kernel manager (start a new kernel if the pool is not yet full, otherwise wait).
+        """
+        with self._lock:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                if len(self.kernel_managers) < self.size:
+                    return self._start_kernel()
+        return self._idle.get()
+
+    def release(self, km, restart=False):
+        """
+        Return the kernel manager to the pool.
+
+        :param km:          kernel manager (see acquire)
+        :param restart:     restart the kernel before it is reused (e.g. after a timeout, the kernel might still be
+                            busy)
+        """
+        if restart or not run_sync(km.is_alive)():
+            run_sync(km.restart_kernel)(now=True)
+        self._idle.put(km)
+
+    def shutdown(self):
+        with self._lock:
+            for km in self.kernel_managers:
+                try:
+                    run_sync(km.shutdown_kernel)(now=True)
+                except RuntimeError:
+                    # kernel is not running anymore
+                    pass
+            self.kernel_managers.clear()
+            self._idle = queue.Queue()
+
+
+def get_kernel_pool() -> KernelPool:
+    """
+    Return the kernel pool of this process (created on first use).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = KernelPool()
+            atexit.register(_pool.shutdown)
+    return _pool
+
+
+def run_notebook(notebook_path, pool=None, timeout=None, cell_timeout=None, logger=None, log_file_path=None):
+    """
+    Execute the notebook with a kernel of the pool and save `<notebook_name>.html` next to it.
+
+    :param notebook_path:   path of the .ipynb file
+    :param pool:            None or KernelPool (default: get_kernel_pool())
+    :param timeout:         None or time limit for the whole notebook in seconds
+    :param cell_timeout:    time limit for every cell in seconds (default: settings.NOTEBOOK_CELL_TIMEOUT)
+    :param logger:          logger for error messages (see util.run_command)
+    :param log_file_path:   None or path of a file which receives the output of all cells
+
+    :return:                CompletedProcess-like object (attributes: args, returncode, exited, stdout, stderr,
+                            resources, timed_out)
+    """
+    if pool is None:
+        pool = get_kernel_pool()
+    if cell_timeout is None:
+        cell_timeout = settings.NOTEBOOK_CELL_TIMEOUT
+
+    notebook_path = os.path.abspath(notebook_path)
+    notebook_dir = os.path.dirname(notebook_path)
+    nb = nbformat.read(notebook_path, as_version=4)
+    reset_code = _RESET_CODE.format(preload_modules=PRELOAD_MODULES, notebook_dir=notebook_dir)
+    nb.cells.insert(0, nbformat.v4.new_code_cell(reset_code))
+
+    start_time = time.monotonic()
+    deadline = None if timeout is None else start_time + timeout
+
+    def get_cell_timeout(cell):
+        if deadline is None:
+            return cell_timeout
+        # at least one second (a timeout of 0 would disable the limit)
+        return max(min(cell_timeout, deadline - time.monotonic()), 1)
+
+    km = pool.acquire()
+    client = NotebookClient(nb, km=km, timeout_func=get_cell_timeout, kernel_name=pool.kernel_name)
+
+    returncode = 0
+    restart = False
+    timed_out = False
+    stderr = ""
+    try:
+        client.execute()
+    except CellTimeoutError as ex:
+        returncode = TIMEOUT_RETURNCODE
+        timed_out = restart = True
+        stderr = str(ex)
+    except DeadKernelError as ex:
+        returncode = 1
+        restart = True
+        stderr = str(ex)
+    except CellExecutionError as ex:
+        returncode = 1
+        stderr = str(ex)
+    finally:
+        if client.kc is not None:
+            client.kc.stop_channels()
+        pool.release(km, restart=restart)
+
+    _remove_reset_cell(nb)
+    wall_time = time.monotonic() - start_time
+
+    if returncode == 0:
+        # like nbconvert: the html file is only created if the notebook was executed successfully
+        html_path = os.path.splitext(notebook_path)[0] + ".html"
+        name = os.path.splitext(os.path.basename(notebook_path))[0]
+        body, _ = HTMLExporter().from_notebook_node(nb, resources={"metadata": {"name": name}})
+        with open(html_path, "w", encoding="utf8") as html_file:
+            html_file.write(body)
+
+    stdout = _get_stream_output(nb)
+    if log_file_path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(log_file_path)), exist_ok=True)
+        with open(log_file_path, "w", encoding="utf8") as log_file:
+            log_file.write(stdout)
+            log_file.write(stderr)
+
+    arglist = ["jupyter", "nbconvert", "--execute", "--to", "html", notebook_path]
+    res = subprocess.CompletedProcess(arglist, returncode=returncode, stdout=strip_decode(stdout))
+    res.stderr = strip_decode(stderr)
+    res.exited = res.returncode
+    # the kernel is not a child which this process waits for, i.e. only the wall time is known
+    res.resources = get_resource_dict(wall_time)
+    res.timed_out = timed_out
+    log_command_error(arglist, res, logger)
+
+    return res
+
+
+def _remove_reset_cell(nb):
+    """remove the cell which was inserted by run_notebook and renumber the cells (as if it never existed)"""
+    nb.cells.pop(0)
+    for cell in nb.cells:
+        if cell.get("execution_count"):
+            cell["execution_count"] -= 1
+        for output in cell.get("outputs", []):
+            if output.get("execution_count"):
+                output["execution_count"] -= 1
+
+
+def _get_stream_output(nb):
+    """return the concatenated stream outputs (stdout and stderr) of all cells"""
+    chunks = []
+    for cell in nb.cells:
+        for output in cell.get("outputs", []):
+            if output.get("output_type") == "stream":
+                chunks.append(output.get("text", ""))
+    return "".join(chunks)
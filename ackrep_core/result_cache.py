@@ -0,0 +1,267 @@
+"""
+This module implements a content-addressed cache for the results of entity checks.
+
+The key of a cache entry (the "fingerprint") is a hash over everything which determines the outcome of a check:
+the content of the entity directory, the content of the directories of all referenced entities (problem
+specification, method packages), the environment (key and version) and the version of ackrep_core.
+If none of these changed since the last check, the stored result (returncode, stdout, stderr, runtime and the
+collected `_data` artifacts) is reused instead of rerunning the check.
+
+Cache entries are directories `<util.check_cache_path>/<fingerprint>/` containing `result.yml` and `artifacts/`.
+The size of the cache is limited by `settings.CHECK_RESULT_CACHE_MAX_ENTRIES` and
+`settings.CHECK_RESULT_CACHE_MAX_SIZE` (MB), see `prune()`.
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import subprocess
+import yaml
+from django.conf import settings
+
+from . import models
+from . import release
+from . import artifacts
+from .model_utils import resolve_keys
+from . import util
+from .util import root_path, ResultContainer
+
+# generated content, which must not influence the fingerprint
+IGNORED_NAMES = {"_data", "_build", "__pycache__", ".ipynb_checkpoints"}
+
+RESULT_FILE_NAME = "result.yml"
+ARTIFACT_DIR_NAME = "artifacts"
+
+# only deterministic outcomes are cached; failures might also be caused by infrastructure problems or timeouts
+CACHEABLE_RETURNCODES = (0, 2)
+
+
+def hash_tree(path, hasher=None, exclude_files=()):
+    """
+    Update `hasher` with the relative paths and contents of all files below `path` (in a deterministic order).
+
+    :param path:            directory (or single file)
+    :param hasher:          hashlib object (if None, a new sha256 object is created)
+    :param exclude_files:   sequence of file names which are skipped (e.g. generated notebook html files)
+
+    :return:                hex digest
+    """
+    if hasher is None:
+        hasher = hashlib.sha256()
+
+    if os.path.isfile(path):
+        file_list = [("", os.path.basename(path), path)]
+    else:
+        file_list = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            # modify in place to prevent os.walk from entering the ignored directories
+            dirnames[:] = sorted(d for d in dirnames if d not in IGNORED_NAMES)
+            for fname in sorted(filenames):
+                if fname in IGNORED_NAMES or fname in exclude_files or fname.endswith(".pyc"):
+                    continue
+                file_list.append((os.path.relpath(dirpath, path), fname, os.path.join(dirpath, fname)))
+
+    for reldir, fname, fpath in file_list:
+        hasher.update(f"{reldir}/{fname}\0".encode("utf8"))
+        with open(fpath, "rb") as f:
+            for chunk in iter(lambda: f.read(2**16), b""):
+                hasher.update(chunk)
+        hasher.update(b"\0")
+
+    return hasher.hexdigest()
+
+
+def get_referenced_entities(entity: models.GenericEntity) -> list:
+    """
+    Return the list of entities whose content influences the result of checking `entity`.
+    """
+    if not isinstance(entity, models.ProblemSolution):
+        return []
+
+    resolve_keys(entity)
+    return list(entity.oc.solved_problem_list) + list(entity.oc.method_package_list)
+
+
+def compute_fingerprint(entity: models.GenericEntity, env_version: str, image_digest: str = None) -> str:
+    """
+    Compute the cache key of the check result of `entity`.
+
+    :param entity:          entity which is to be checked
+    :param env_version:     version string of the environment (see script.get_environment_version)
+    :param image_digest:    digest of the environment image (see core.get_environment_image_digest); images can be
+                            rebuilt without changing their version string
+
+    :return:                hex digest
+    """
+    hasher = hashlib.sha256()
+
+    env_key = entity.compatible_environment or settings.DEFAULT_ENVIRONMENT_KEY
+    hasher.update(f"ackrep_core {release.__version__}\0env {env_key} {env_version} {image_digest}\0".encode("utf8"))
+
+    exclude_files = ()
+    if isinstance(entity, models.Notebook):
+        # created during the check (see script.check)
+        exclude_files = (entity.notebook_file.replace(".ipynb", ".html"),)
+
+    for e in [entity] + get_referenced_entities(entity):
+        hasher.update(f"entity {e.key}\0".encode("utf8"))
+        hash_tree(os.path.join(root_path, e.base_path), hasher, exclude_files=exclude_files)
+
+    return hasher.hexdigest()
+
+
+def get_entry_path(fingerprint: str) -> str:
+    return os.path.join(util.check_cache_path, fingerprint)
+
+
+def lookup(fingerprint: str):
+    """
+    Return the cached result for `fingerprint` or None.
+
+    :return:    None or ResultContainer with attributes `res` (CompletedProcess-like), `runtime` and
+                `artifact_path` (directory with the stored artifacts)
+    """
+    entry_path = get_entry_path(fingerprint)
+    result_file_path = os.path.join(entry_path, RESULT_FILE_NAME)
+    try:
+        with open(result_file_path, "r") as f:
+            data = yaml.load(f, Loader=yaml.FullLoader)
+    except (FileNotFoundError, yaml.YAMLError):
+        return None
+
+    # mark the entry as recently used (relevant for pruning)
+    os.utime(result_file_path)
+
+    res = subprocess.CompletedProcess(data["args"], returncode=data["returncode"])
+    res.stdout = data["stdout"]
+    res.stderr = data["stderr"]
+    res.exited = res.returncode
+
+    return ResultContainer(
+        res=res,
+        key=data["key"],
+        runtime=data["runtime"],
+        artifact_path=os.path.join(entry_path, ARTIFACT_DIR_NAME),
+    )
+
+
+def store(fingerprint: str, key: str, res, runtime: float, artifact_path: str = None):
+    """
+    Store the result of a check (if its returncode is cacheable).
+
+    :param fingerprint:     see compute_fingerprint
+    :param key:             entity key (informative only)
+    :param res:             CompletedProcess-like result of the check
+    :param runtime:         runtime of the check (s)
+    :param artifact_path:   None or directory whose files are stored as artifacts
+
+    :return:                True if the result was stored
+    """
+    if res.returncode not in CACHEABLE_RETURNCODES:
+        return False
+
+    os.makedirs(util.check_cache_path, exist_ok=True)
+
+    # write to a temporary directory first and rename it afterwards, such that concurrent lookups
+    # never see incomplete entries
+    tmp_path = tempfile.mkdtemp(prefix=f".tmp_{fingerprint}_", dir=util.check_cache_path)
+    try:
+        data = {
+            "key": key,
+            "args": [str(arg) for arg in res.args] if isinstance(res.args, (list, tuple)) else str(res.args),
+            "returncode": res.returncode,
+            "stdout": res.stdout or "",
+            "stderr": res.stderr or "",
+            "runtime": runtime,
+            "ackrep_core_version": release.__version__,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with open(os.path.join(tmp_path, RESULT_FILE_NAME), "w") as f:
+            yaml.dump(data, f)
+
+        artifact_dest = os.path.join(tmp_path, ARTIFACT_DIR_NAME)
+        if artifact_path is not None and os.path.isdir(artifact_path):
+            # the artifacts are hard links into the artifact store (see artifacts.py), linking them avoids copies
+            shutil.copytree(artifact_path, artifact_dest, copy_function=artifacts.link_or_copy)
+        else:
+            os.makedirs(artifact_dest)
+
+        entry_path = get_entry_path(fingerprint)
+        if os.path.exists(entry_path):
+            shutil.rmtree(entry_path, ignore_errors=True)
+        os.rename(tmp_path, entry_path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    return True
+
+
+def restore_artifacts(cached, dest_folder: str):
+    """
+    Link (or copy) the stored artifacts of a cached result to `dest_folder` (previous content is removed).
+    """
+    shutil.rmtree(dest_folder, ignore_errors=True)
+    os.makedirs(dest_folder)
+    for fname in os.listdir(cached.artifact_path):
+        src = os.path.join(cached.artifact_path, fname)
+        if os.path.isdir(src):
+            shutil.copytree(
+                src, os.path.join(dest_folder, fname), dirs_exist_ok=True, copy_function=artifacts.link_or_copy
+            )
+        else:
+            artifacts.link_or_copy(src, os.path.join(dest_folder, fname))
+
+
+def _get_dir_size(path):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for fname in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, fname))
+            except OSError:
+                pass
+    return size
+
+
+def prune(max_entries: int = None, max_size: float = None):
+    """
+    Evict the least recently used entries until the cache satisfies both limits.
+
+    :param max_entries:     maximum number of entries (default: settings.CHECK_RESULT_CACHE_MAX_ENTRIES)
+    :param max_size:        maximum total size in MB (default: settings.CHECK_RESULT_CACHE_MAX_SIZE)
+
+    :return:                list of the removed fingerprints
+    """
+    if max_entries is None:
+        max_entries = settings.CHECK_RESULT_CACHE_MAX_ENTRIES
+    if max_size is None:
+        max_size = settings.CHECK_RESULT_CACHE_MAX_SIZE
+
+    if not os.path.isdir(util.check_cache_path):
+        return []
+
+    entries = []
+    for fingerprint in os.listdir(util.check_cache_path):
+        entry_path = get_entry_path(fingerprint)
+        result_file_path = os.path.join(entry_path, RESULT_FILE_NAME)
+        if fingerprint.startswith(".tmp_") or not os.path.isfile(result_file_path):
+            continue
+        entries.append((os.path.getmtime(result_file_path), fingerprint, _get_dir_size(entry_path)))
+
+    # newest first
+    entries.sort(reverse=True)
+    max_bytes = max_size * 1024**2
+
+    removed = []
+    total_size = 0
+    for i, (mtime, fingerprint, size) in enumerate(entries):
+        total_size += size
+        if i >= max_entries or total_size > max_bytes:
+            shutil.rmtree(get_entry_path(fingerprint), ignore_errors=True)
+            removed.append(fingerprint)
+            total_size -= size
+
+    return removed
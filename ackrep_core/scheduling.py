@@ -0,0 +1,189 @@
+"""
+This module estimates the runtime of entity checks and uses these estimates to schedule bulk checks
+(see script.check_all_entities).
+
+The estimate of an entity is based on its runtimes in the most recent CI results (`<ci_results_path>/history/`).
+For entities without history, the free text field `estimated_runtime` (e.g. "10s", "2 min", "~1h") is parsed.
+"""
+
+import os
+import re
+import heapq
+import yaml
+
+# note: unittests overwrite core.ci_results_path
+from . import core
+
+# number of (most recent) CI result files which are taken into account
+HISTORY_LENGTH = 10
+
+# number of (most recent) runtimes of an entity which are averaged
+RUNTIMES_PER_ENTITY = 3
+
+# estimate (s) for entities without history and without (parsable) estimated_runtime
+DEFAULT_RUNTIME = 60
+
+# lower bounds of ranges like "5-10 min" are dropped (the upper bound is used)
+_range_pattern = re.compile(r"\d+(?:[.,]\d+)?\s*(?:-|to|\.\.)\s*(?=\d)", re.IGNORECASE)
+_runtime_pattern = re.compile(r"(\d+(?:[.,]\d+)?)\s*(h|hours?|m|mins?|minutes?|s|secs?|seconds?)?\b", re.IGNORECASE)
+_unit_factors = {"h": 3600, "m": 60, "s": 1}
+
+
+def parse_estimated_runtime(text):
+    """
+    Parse the free text of the field `estimated_runtime`.
+
+    :param text:    e.g. "10s", "2 min", "~1.5 minutes", "1h 30min", "5-10 min", "< 5" (numbers without unit are
+                    seconds)
+
+    :return:        runtime in seconds (float) or None if the text could not be parsed
+    """
+    if not text:
+        return None
+
+    matches = _runtime_pattern.findall(_range_pattern.sub("", str(text)))
+    if not matches:
+        return None
+
+    runtime = 0
+    for number, unit in matches:
+        factor = _unit_factors[unit[0].lower()] if unit else 1
+        runtime += float(number.replace(",", ".")) * factor
+    return runtime
+
+
+def load_historical_runtimes(results_dir=None, history_length=HISTORY_LENGTH):
+    """
+    :param results_dir:     directory of the CI result files (default: <ci_results_path>/history)
+    :param history_length:  number of (most recent) result files to read
+
+    :return:                dict {key: [runtime, ...]} (most recent first)
+    """
+    if results_dir is None:
+        results_dir = os.path.join(core.ci_results_path, "history")
+    if not os.path.isdir(results_dir):
+        return {}
+
+    # the file names contain the date, i.e. sorting them means sorting them from oldest to newest
+    filename_list = sorted(filter(lambda item: "ci_results" in item, os.listdir(results_dir)), reverse=True)
+
+    runtimes = {}
+    for result_filename in filename_list[:history_length]:
+        with open(os.path.join(results_dir, result_filename)) as results_file:
+            results = yaml.load(results_file, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+        for key, value in (results or {}).items():
+            if len(key) == 5 and isinstance(value, dict) and value.get("runtime") is not None:
+                runtimes.setdefault(key, []).append(float(value["runtime"]))
+
+    return runtimes
+
+
+def estimate_runtimes(entity_list, historical_runtimes=None):
+    """
+    :param entity_list:             list of entities
+    :param historical_runtimes:     None or result of load_historical_runtimes (loaded if None)
+
+    :return:                        dict {key: estimated runtime (s)}
+    """
+    if historical_runtimes is None:
+        historical_runtimes = load_historical_runtimes()
+
+    estimates = {}
+    for entity in entity_list:
+        runtimes = historical_runtimes.get(entity.key, [])[:RUNTIMES_PER_ENTITY]
+        if runtimes:
+            estimates[entity.key] = sum(runtimes) / len(runtimes)
+        else:
+            estimate = parse_estimated_runtime(getattr(entity, "estimated_runtime", None))
+            estimates[entity.key] = DEFAULT_RUNTIME if estimate is None else estimate
+
+    return estimates
+
+
+def order_longest_first(entity_list, estimates):
+    """return a new list of the entities sorted by decreasing estimated runtime (stable for equal estimates)"""
+    return sorted(entity_list, key=lambda entity: -estimates[entity.key])
+
+
+def order_by_environment(entity_list, env_names):
+    """
+    Group the entities by their environment, i.e. all entities of an environment are checked one after another in
+    its (warm) container instead of switching between the containers of different environments.
+
+    :param entity_list: list of entities
+    :param env_names:   dict {key: environment name}
+
+    :return:            new list of the entities (the groups are sorted by their first entity, the entities keep
+                        their order)
+    """
+    groups = {}
+    for entity in entity_list:
+        groups.setdefault(env_names[entity.key], []).append(entity)
+
+    return [entity for group in groups.values() for entity in group]
+
+
+def schedule_checks(entity_list, env_names, estimates, jobs=1):
+    """
+    Order the checks of a bulk run.
+
+    A single worker checks the entities grouped by environment (see order_by_environment), the total runtime does
+    not depend on the order. Several workers start the longest checks first across all environments: sorting
+    only within environment groups would start a long check of a group with a small total runtime late, which
+    increases the total runtime. Switching environments is cheap in this case, because the containers of every
+    environment (replica) stay warm until they are idle (see core.retire_idle_containers). Entities with equal
+    estimates stay grouped by environment.
+
+    :param entity_list: list of entities
+    :param env_names:   dict {key: environment name}
+    :param estimates:   dict {key: estimated runtime}, see estimate_runtimes
+    :param jobs:        number of workers
+
+    :return:            new list of the entities
+    """
+    scheduled_entity_list = order_by_environment(entity_list, env_names)
+    if jobs > 1:
+        scheduled_entity_list = order_longest_first(scheduled_entity_list, estimates)
+    return scheduled_entity_list
+
+
+def predict_makespan(runtimes, jobs=1):
+    """
+    Predict the total runtime if the jobs are processed in the given order by `jobs` workers (each job is taken
+    by the worker which becomes available first).
+
+    :param runtimes:    sequence of runtimes (in the order of submission)
+    :param jobs:        number of workers
+
+    :return:            predicted total runtime
+    """
+    workers = [0.0] * max(int(jobs), 1)
+    for runtime in runtimes:
+        heapq.heappush(workers, heapq.heappop(workers) + runtime)
+    return max(workers)
+
+
+def partition_into_shards(entity_list, shard_count, estimates):
+    """
+    Partition the entities into `shard_count` shards with nearly equal estimated runtime (greedy: the longest
+    remaining entity is assigned to the shard with the smallest load). The result is deterministic, i.e. every
+    CI node computes the same partition (given the same entities and history).
+
+    :param entity_list:     list of entities
+    :param shard_count:     number of shards
+    :param estimates:       dict {key: estimated runtime}, see estimate_runtimes
+
+    :return:                list of `shard_count` lists of entities (each in the order of entity_list)
+    """
+    positions = {entity.key: i for i, entity in enumerate(entity_list)}
+    ordered = sorted(entity_list, key=lambda entity: (-estimates[entity.key], entity.key))
+
+    # heap of (load, shard index)
+    loads = [(0.0, i) for i in range(shard_count)]
+    shards = [[] for i in range(shard_count)]
+    for entity in ordered:
+        load, index = heapq.heappop(loads)
+        shards[index].append(entity)
+        heapq.heappush(loads, (load + estimates[entity.key], index))
+
+    return [sorted(shard, key=lambda entity: positions[entity.key]) for shard in shards]
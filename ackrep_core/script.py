@@ -10,8 +10,11 @@ from django.conf import settings
 import yaml
 from git import Repo
 import shutil
-import signal
 import subprocess
+import concurrent.futures
+import io
+import contextlib
+import traceback
 import numpy as np
 
 from ipydex import IPS, activate_ips_on_exception
@@ -19,6 +22,11 @@ from ipydex import IPS, activate_ips_on_exception
 from ackrep_core import system_model_management
 
 from ackrep_core import release
+from ackrep_core import result_cache
+from ackrep_core import scheduling
+from ackrep_core import notebook_execution
+from ackrep_core import docker_backend
+from ackrep_core import artifacts
 
 activate_ips_on_exception()
 
@@ -26,10 +34,6 @@ from . import core
 from . import models
 from .util import *
 
-# timeout setup for entity check timeout, see https://stackoverflow.com/a/494273
-if os.name != "nt":
-    signal.signal(signal.SIGALRM, timeout_handler)
-
 
 def main():
     argparser = argparse.ArgumentParser()
@@ -54,6 +58,52 @@ def main():
         help="check all entities (solutions and models) (may take some time)",
         action="store_true",
     )
+    argparser.add_argument(
+        "--check-affected",
+        nargs="?",
+        const="",
+        metavar="BASE_REF",
+        help="only check entities affected by the changes of the data repo between BASE_REF and HEAD "
+        + "(default: origin/<ACKREP_DATA_BRANCH>), the options of --check-all-entities apply",
+    )
+    argparser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        help="number of entity checks which run concurrently (used by --check-all-entities)",
+        type=int,
+        default=1,
+    )
+    argparser.add_argument(
+        "--shard",
+        metavar="I/N",
+        help="only check the I-th of N shards with nearly equal runtime (used by --check-all-entities), "
+        + "see also --merge-shard-results",
+    )
+    argparser.add_argument(
+        "--merge-shard-results",
+        nargs="+",
+        metavar="path",
+        help="merge the result files of all shards (or the directory containing them) into one ci_results file",
+    )
+    argparser.add_argument(
+        "--force",
+        help="ignore cached check results and rerun every check (used by --check-all-entities)",
+        action="store_true",
+    )
+    argparser.add_argument(
+        "--check-batch",
+        nargs="*",
+        metavar="key",
+        help="check several entities (keys are read from stdin if none are given) with this single process and print "
+        + "one result line per entity (used inside the environment containers by --check-all-entities)",
+    )
+    argparser.add_argument(
+        "--inprocess",
+        help="run the check (-c) in a forked child of this process instead of rendering and running the execscript "
+        + "with a new interpreter (faster startup, intended for local development)",
+        action="store_true",
+    )
     argparser.add_argument("-da", "--download-artifacts", help="download artifacts from CI", action="store_true")
     argparser.add_argument(
         "--update-parameter-tex",
@@ -112,6 +162,12 @@ def main():
         help="pull env images and print infos (mainly used in CI run)",
         action="store_true",
     )
+    argparser.add_argument(
+        "--refresh-images",
+        help="compare the env images with the registry (and pull outdated ones) regardless of when they were last "
+        + "verified; can be combined with the check commands",
+        action="store_true",
+    )
     argparser.add_argument("-n", "--new", help="interactively create new entity", action="store_true")
     argparser.add_argument("-l", "--load-repo-to-db", help="load repo to database", metavar="path")
     argparser.add_argument("-e", "--extend", help="extend database with repo", metavar="path")
@@ -158,6 +214,10 @@ def main():
         # default: use logger.debug
         core.send_debug_report(core.logger.debug)
 
+    if args.refresh_images:
+        # the following commands verify the images again (see core.refresh_image)
+        core.invalidate_image_freshness()
+
     # exclusive options
     if args.new:
         create_new_entity()
@@ -166,6 +226,8 @@ def main():
     elif args.load_repo_to_db:
         startdir = args.load_repo_to_db
         core.load_repo_to_db(startdir)
+        # inside environment containers: the database is ready to be used (see core.wait_for_container_ready)
+        core.signal_container_ready()
         print(bgreen("Done"))
     elif args.extend:
         startdir = args.extend
@@ -179,16 +241,31 @@ def main():
         return
     elif args.check:
         metadatapath = args.check
-        check(metadatapath)
+        check(metadatapath, inprocess=args.inprocess)
+    elif args.check_batch is not None:
+        check_batch(args.check_batch, inprocess=args.inprocess)
     elif args.check_with_docker:
         metadatapath = args.check_with_docker
         check_with_docker(metadatapath)
     elif args.check_all_entities:
-        check_all_entities(args.unittest, args.fast)
+        shard = None
+        if args.shard:
+            try:
+                shard = parse_shard_spec(args.shard)
+            except ValueError as e:
+                argparser.error(str(e))
+        check_all_entities(args.unittest, args.fast, args.jobs, args.force, shard)
+    elif args.check_affected is not None:
+        base_ref = args.check_affected or f"origin/{settings.ACKREP_DATA_BRANCH}"
+        check_affected_entities(base_ref, args.jobs, args.force)
+    elif args.merge_shard_results:
+        merge_shard_results(args.merge_shard_results)
     elif args.download_artifacts:
         download_artifacts()
     elif args.pull_and_show_envs:
         pull_and_show_envs()
+    elif args.refresh_images:
+        refresh_images()
     elif args.get_metadata_abs_path_from_key:
         key = args.get_metadata_abs_path_from_key
         exitflag = not args.show_debug
@@ -267,17 +344,75 @@ def create_new_entity():
     core.convert_dict_to_yaml(field_values, target_path=path)
 
 
-def check_all_entities(unittest=False, fast=False):
+def check_all_entities(unittest=False, fast=False, jobs=1, force=False, shard=None, entity_list=None):
     """this function is called during CI.
-    All (checkable) entities are checked and the results stored in a yaml file."""
+    All (checkable) entities are checked and the results stored in a yaml file.
+    Unchanged entities are not checked again, their results are taken from the result cache (see result_cache.py).
+
+    :param unittest:    only check a small set of entities (used by the unittests)
+    :param fast:        only check a representative subset of entities (for faster CI testing)
+    :param jobs:        number of checks which run concurrently
+    :param force:       ignore cached results (fresh results are stored nevertheless)
+    :param shard:       None or 2-tuple (index, count): only check the index-th (1-based) of count shards;
+                        the results are written to a shard file, see merge_shard_results
+    :param entity_list: None or list of entities to check instead of all entities (see check_affected_entities)
+    """
     # setup ci_results folder
     date = datetime.datetime.now()
     date_string = date.strftime("%Y_%m_%d__%H_%M_%S")
-    file_name = "ci_results__" + date_string + ".yaml"
-    file_path = os.path.join(core.root_path, "artifacts", "ci_results", file_name)
-    os.makedirs(os.path.join(core.root_path, "artifacts", "ci_results"), exist_ok=True)
+
+    if entity_list is None:
+        entity_list = get_entity_list_for_ci(unittest, fast)
+
+    if shard is None:
+        file_name = "ci_results__" + date_string + ".yaml"
+        results_dir = os.path.join(core.root_path, "artifacts", "ci_results")
+        shard_info = None
+    else:
+        shard_index, shard_count = shard
+        file_name = f"results_shard_{shard_index}_of_{shard_count}__{date_string}.yaml"
+        # separate directory: shard files must not be mistaken for complete results
+        results_dir = os.path.join(core.root_path, "artifacts", "ci_result_shards")
+        shard_info = {"index": shard_index, "count": shard_count, "date": date_string}
+        entity_list = select_shard(entity_list, shard_index, shard_count)
+
+    file_path = os.path.join(results_dir, file_name)
+    os.makedirs(results_dir, exist_ok=True)
+
+    write_ci_results_header(file_path, shard_info)
+
+    returncodes = []
+    failed_entities = []
+    for key, res, content in run_ci_checks(entity_list, date, jobs=jobs, force=force):
+        with open(file_path, "a") as file:
+            yaml.dump(content, file)
+
+        returncodes.append(res.returncode)
+        if res.returncode != 0:
+            failed_entities.append(key)
+
+    if sum(returncodes) == 0:
+        print(bgreen(f"All {len(entity_list)} checks successfull."))
+    else:
+        print(bred(f"{len(failed_entities)}/{len(entity_list)} checks failed."))
+        print("Failed entities:", failed_entities)
+
+    removed = result_cache.prune()
+    if removed:
+        core.logger.info(f"Removed {len(removed)} entries from the result cache.")
+    removed_artifacts = artifacts.prune_store()
+    if removed_artifacts:
+        core.logger.info(f"Removed {removed_artifacts} unreferenced files from the artifact store.")
+
+    exit(sum(returncodes))
+
+
+def write_ci_results_header(file_path, shard_info=None):
+    """write the commit logs and ci logs (common to all checks of a ci run) to the results file"""
 
     content = {"commit_logs": {}}
+    if shard_info is not None:
+        content["shard"] = shard_info
     # save the commits of the current ci job
     current_data_repo = os.path.split(data_path)[-1]
     for repo_name in [current_data_repo, "ackrep_core"]:
@@ -302,8 +437,107 @@ def check_all_entities(unittest=False, fast=False):
     with open(file_path, "a") as file:
         yaml.dump(content, file)
 
-    returncodes = []
-    failed_entities = []
+
+def check_affected_entities(base_ref, jobs=1, force=False):
+    """check only the entities which are affected by the changes of the data repo since base_ref
+    (see core.get_affected_entities), e.g. in CI runs for pull requests
+
+    :param base_ref:    git reference of the data repo (e.g. origin/master)
+    :param jobs:        number of checks which run concurrently
+    :param force:       ignore cached results
+    """
+    changed_file_paths = core.get_changed_file_paths(base_ref)
+    entity_list = core.get_affected_entities(changed_file_paths)
+
+    print(f"{len(changed_file_paths)} changed file(s) since {base_ref}, {len(entity_list)} affected entities:")
+    for entity in entity_list:
+        print(f"  {entity}")
+
+    if not entity_list:
+        print(bgreen("Nothing to check."))
+        exit(0)
+
+    check_all_entities(jobs=jobs, force=force, entity_list=entity_list)
+
+
+def parse_shard_spec(spec):
+    """parse "I/N" (1 <= I <= N) and return (I, N)"""
+    try:
+        index, count = [int(part) for part in spec.split("/")]
+    except ValueError:
+        raise ValueError(f"invalid shard specification '{spec}', expected I/N (e.g. 2/4)")
+    if not 1 <= index <= count:
+        raise ValueError(f"invalid shard specification '{spec}', expected 1 <= I <= N")
+    return index, count
+
+
+def select_shard(entity_list, shard_index, shard_count):
+    """return the entities of the shard_index-th (1-based) of shard_count shards (see scheduling.py)"""
+    estimates = scheduling.estimate_runtimes(entity_list)
+    shards = scheduling.partition_into_shards(entity_list, shard_count, estimates)
+    for i, shard in enumerate(shards):
+        load = datetime.timedelta(seconds=round(sum(estimates[e.key] for e in shard)))
+        marker = "*" if i + 1 == shard_index else " "
+        print(f"{marker} shard {i + 1}/{shard_count}: {len(shard)} entities, predicted runtime: {load}")
+    return shards[shard_index - 1]
+
+
+def merge_shard_results(paths, target_dir=None):
+    """merge the result files of all shards of a CI run into one ci_results file
+
+    :param paths:       list of shard result files or directories containing them
+    :param target_dir:  directory of the merged file (default: artifacts/ci_results)
+
+    :return:        path of the merged file
+    """
+    file_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            file_paths.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path)) if name.startswith("results_shard_")
+            )
+        else:
+            file_paths.append(path)
+
+    shard_results = []
+    for file_path in file_paths:
+        with open(file_path) as file:
+            shard_results.append(yaml.load(file, Loader=yaml.FullLoader))
+    if not shard_results:
+        raise ValueError(f"No shard result files found in {paths}.")
+
+    shard_results.sort(key=lambda results: results["shard"]["index"])
+    shard_count = shard_results[0]["shard"]["count"]
+    indices = [results["shard"]["index"] for results in shard_results]
+    if indices != list(range(1, shard_count + 1)) or any(r["shard"]["count"] != shard_count for r in shard_results):
+        raise ValueError(f"Expected the results of shards 1..{shard_count}, got shards {indices}.")
+
+    for results in shard_results[1:]:
+        if results["commit_logs"] != shard_results[0]["commit_logs"]:
+            core.logger.warning(f"Shard {results['shard']['index']} checked different commits than shard 1.")
+
+    # the earliest shard determines the date of the merged run
+    date_string = min(results["shard"]["date"] for results in shard_results)
+    merged = {"commit_logs": shard_results[0]["commit_logs"], "ci_logs": shard_results[0]["ci_logs"]}
+    for results in shard_results:
+        for key, value in results.items():
+            if key not in ("commit_logs", "ci_logs", "shard"):
+                merged[key] = value
+
+    if target_dir is None:
+        target_dir = os.path.join(core.root_path, "artifacts", "ci_results")
+    os.makedirs(target_dir, exist_ok=True)
+    target_path = os.path.join(target_dir, f"ci_results__{date_string}.yaml")
+    with open(target_path, "w") as file:
+        # keep the order of the checks
+        yaml.dump(merged, file, sort_keys=False)
+
+    print(bgreen(f"Merged results of {shard_count} shards ({len(merged) - 2} entities) into {target_path}."))
+    return target_path
+
+
+def get_entity_list_for_ci(unittest=False, fast=False):
+    """return the list of all checkable entities (or a subset, see check_all_entities)"""
     if unittest:
         entity_list = [core.get_entity("UXMFA"), core.get_entity("LRHZX"), core.get_entity("7WIQH")]
     else:
@@ -323,76 +557,245 @@ def check_all_entities(unittest=False, fast=False):
                 core.get_entity("CZKWU"),  # ps nonlinear_trajectory_electrical_resistance
                 core.get_entity("IG3GA"),  # sm linear transport (pde -> qt)
             ]
+    return entity_list
+
+
+def run_ci_checks(entity_list, date, jobs=1, force=False, batch=None):
+    """check all entities of entity_list using a pool of `jobs` worker threads.
+
+    The checks themselves run in (docker) subprocesses, thus threads are sufficient for concurrency.
+    First, the environment images are pulled concurrently (their digests are part of the result fingerprints).
+    Entities with a cached result (see result_cache.py) are not checked. A single job checks the remaining entities
+    grouped by environment, i.e. every environment container is started once and stays warm for all checks of its
+    environment. Several jobs start the longest checks (estimated from historical CI results) first across all
+    environments, which minimizes the total runtime (see scheduling.schedule_checks).
+    The artifacts of all checks are collected with one transfer after the last check (also if the run is aborted),
+    their results are cached afterwards (see artifacts.py).
+
+    :param entity_list: list of entities
+    :param date:        datetime of the ci run
+    :param jobs:        maximum number of concurrent checks
+    :param force:       ignore cached results
+    :param batch:       check the entities of a worker with one `ackrep --check-batch` process per environment
+                        (see core.check_batch); default: settings.CHECK_BATCH
+
+    :return:            generator of (key, res, content) in the order of entity_list
+    """
+    jobs = max(int(jobs), 1)
+    if batch is None:
+        batch = settings.CHECK_BATCH
+
+    # the images are refreshed first: the fingerprints of the results contain their digests
+    env_names = {entity.key: core.get_environment_name_of_entity(entity) for entity in entity_list}
+    core.prefetch_environment_images(env_names.values())
+    image_digests = {env_name: core.get_environment_image_digest(env_name) for env_name in set(env_names.values())}
+
+    # the cached results are available immediately, the others are set by the workers
+    futures = {entity.key: concurrent.futures.Future() for entity in entity_list}
+    fingerprints = {}
     for entity in entity_list:
-        key = entity.key
+        fingerprint, cached = lookup_ci_result(entity, force, image_digests[env_names[entity.key]])
+        if cached is None:
+            fingerprints[entity.key] = fingerprint
+        else:
+            futures[entity.key].set_result(collect_ci_result(entity, date, cached.res, cached.runtime, cached=cached))
+    pending = [entity for entity in entity_list if entity.key in fingerprints]
+
+    estimates = scheduling.estimate_runtimes(pending)
+    scheduled_entity_list = scheduling.schedule_checks(pending, env_names, estimates, jobs)
+    predicted_runtime = scheduling.predict_makespan([estimates[e.key] for e in scheduled_entity_list], jobs)
+    print(
+        f"Checking {len(pending)} entities ({len(entity_list) - len(pending)} cached) of "
+        f"{len(set(env_names[e.key] for e in pending))} environment(s) with {jobs} parallel job(s). "
+        f"Predicted total runtime: {datetime.timedelta(seconds=round(predicted_runtime))}"
+    )
 
-        start_time = time.time()
-        res = check_with_docker(key, exitflag=False)
-        runtime = round(time.time() - start_time, 1)
+    collector = artifacts.ArtifactCollector()
 
-        result = res.returncode
-        # collect the created data files (plots, htmls, ...) and place them in the artifact folder for later download
-        if res.returncode == 0:
-            issues = ""
-
-            # copy plot or notebook to collection directory
-            dest_dir_plots = os.path.join(core.root_path, "artifacts", "ackrep_plots")
-            dest_dir_notebooks = os.path.join(core.root_path, "artifacts", "ackrep_notebooks")
-
-            if isinstance(entity, models.ProblemSolution) or isinstance(entity, models.SystemModel):
-                # copy entire folder since there could be multiple images with arbitrary names
-                src = f"dummy:/code/{entity.base_path}/_data/."
-                dest_folder = os.path.join(dest_dir_plots, key)
-                dest = dest_folder
-            elif isinstance(entity, models.Notebook):
-                html_file_name = entity.notebook_file.replace(".ipynb", ".html")
-                src = f"dummy:/code/{entity.base_path}/{html_file_name}"
-                dest_folder = os.path.join(dest_dir_notebooks, key)
-                dest = os.path.join(dest_folder, html_file_name)
+    def check_entities(entities):
+        try:
+            if batch:
+                results = _check_ci_batch(entities, date, fingerprints, collector)
             else:
-                raise TypeError(f"{key} is not of a checkable type")
+                results = ((e.key, check_entity_for_ci(e, date, fingerprints[e.key], collector)) for e in entities)
+            for key, result in results:
+                futures[key].set_result(result)
+        except BaseException as e:
+            for entity in entities:
+                if not futures[entity.key].done():
+                    futures[entity.key].set_exception(e)
+            raise
+
+    if batch:
+        # one shard per worker (balanced by estimated runtime), each in the order of scheduled_entity_list
+        tasks = [shard for shard in scheduling.partition_into_shards(scheduled_entity_list, jobs, estimates) if shard]
+    else:
+        # the pool processes the checks in submission order
+        tasks = [[entity] for entity in scheduled_entity_list]
 
-            os.makedirs(dest_folder, exist_ok=True)
-            # docker cp has to be used, see https://circleci.com/docs/2.0/building-docker-images#mounting-folders
-            run_command(["docker", "cp", src, dest], logger=core.logger)
+    # yield in the order of entity_list to keep the results file deterministic
+    try:
+        if jobs == 1:
+            # no worker threads: process the tasks until the next result is available
+            tasks = iter(tasks)
+            for entity in entity_list:
+                while not futures[entity.key].done():
+                    check_entities(next(tasks))
+                yield futures[entity.key].result()
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(min(jobs, len(tasks)), 1)) as executor:
+                for task in tasks:
+                    executor.submit(check_entities, task)
+                for entity in entity_list:
+                    yield futures[entity.key].result()
+    finally:
+        # one transfer for all checks (also if the run was aborted), the results are cached afterwards
+        collector.fetch()
 
-            # remove tex and pdf files to prevent them being copied
-            for file in os.listdir(dest_folder):
-                if not (".png" in file or ".html" in file):
-                    os.remove(os.path.join(dest_folder, file))
 
-        else:
-            issues = res.stdout
-        date_string = date.strftime("%Y-%m-%d %H:%M:%S")
+def _check_ci_batch(entity_list, date, fingerprints, collector=None):
+    """see run_ci_checks: check the (uncached) entities with core.check_batch
 
-        content = {key: {"result": result, "issues": issues, "runtime": runtime, "date": date_string}}
+    :return:    generator of (key, result tuple of collect_ci_result)
+    """
+    entities = {entity.key: entity for entity in entity_list}
+    for key, res in core.check_batch(list(entities)):
+        entity = entities[key]
+        print(f'Checked {bright(str(entity))} "({entity.name}, {entity.estimated_runtime})"')
+        if res.returncode == 0:
+            print(res.stdout)
+        print_check_result(res)
+        runtime = getattr(res, "runtime", None)
+        if runtime is None and getattr(res, "resources", None):
+            # checked separately (see core.check_batch)
+            runtime = round(res.resources["wall_time"], 1)
+        yield key, collect_ci_result(entity, date, res, runtime, fingerprints[key], collector=collector)
 
-        if "Calculated with " in res.stdout:
-            version = res.stdout.split("Calculated with ")[-1].split("\n\n")[0]
-            content[key]["env_version"] = version
 
-        with open(file_path, "a") as file:
-            yaml.dump(content, file)
+def lookup_ci_result(entity, force=False, image_digest=None):
+    """
+    :param image_digest:    digest of the environment image (see core.get_environment_image_digest)
 
-        returncodes.append(res.returncode)
-        if res.returncode != 0:
-            failed_entities.append(key)
-        print("---")
+    :return:    2-tuple: fingerprint (see result_cache.compute_fingerprint), cached result or None
+    """
+    fingerprint = result_cache.compute_fingerprint(entity, get_environment_version(entity), image_digest)
+    cached = None if force else result_cache.lookup(fingerprint)
+    if cached is not None:
+        print(f"Using cached result for {bright(str(entity))} (fingerprint {fingerprint[:12]}).")
+    return fingerprint, cached
 
-    if sum(returncodes) == 0:
-        print(bgreen(f"All {len(entity_list)} checks successfull."))
+
+def check_entity_for_ci(entity, date, fingerprint=None, collector=None):
+    """check one entity (with docker), collect its artifacts and build the result dict
+
+    :param entity:      entity to check (without cached result, see lookup_ci_result)
+    :param date:        datetime of the ci run
+    :param fingerprint: None or fingerprint of the entity, the result is stored in the result cache under it
+    :param collector:   None or artifacts.ArtifactCollector (see collect_ci_result)
+
+    :return:    3-tuple: key, result of check_with_docker, content dict for the results yaml
+    """
+    start_time = time.time()
+    res = check_with_docker(entity.key, exitflag=False)
+    runtime = round(time.time() - start_time, 1)
+    return collect_ci_result(entity, date, res, runtime, fingerprint, collector=collector)
+
+
+def collect_ci_result(entity, date, res, runtime, fingerprint=None, cached=None, collector=None):
+    """collect the artifacts of a check, store the result in the result cache and build the result dict
+
+    :param entity:      checked entity
+    :param date:        datetime of the ci run
+    :param res:         result of the check
+    :param runtime:     runtime of the check (s)
+    :param fingerprint: fingerprint of the entity (the result is stored in the result cache)
+    :param cached:      None or cached result (see result_cache.lookup), its artifacts are restored
+    :param collector:   None or artifacts.ArtifactCollector: the artifacts are collected (and the result is stored in
+                        the result cache if the transfer succeeded) when collector.fetch() is called.
+                        If None, they are collected immediately.
+
+    :return:    3-tuple: key, res, content dict for the results yaml
+    """
+    key = entity.key
+    src_path, dest_folder = get_ci_artifact_paths(entity)
+
+    if cached is not None:
+        if res.returncode == 0:
+            result_cache.restore_artifacts(cached, dest_folder)
+    elif res.returncode == 0:
+        # collect the created data files (plots, htmls, ...) and place them in the artifact folder for later download
+        # (from the dummy container, see https://circleci.com/docs/2.0/building-docker-images#mounting-folders)
+        def store_result(transferred):
+            # a result without its artifacts must not be restored from the cache later
+            if transferred:
+                result_cache.store(fingerprint, key, res, runtime, dest_folder)
+
+        fetch_now = collector is None
+        if fetch_now:
+            collector = artifacts.ArtifactCollector()
+        collector.add(src_path, dest_folder, store_result)
+        if fetch_now:
+            collector.fetch()
     else:
-        print(bred(f"{len(failed_entities)}/{len(entity_list)} checks failed."))
-        print("Failed entities:", failed_entities)
+        result_cache.store(fingerprint, key, res, runtime)
 
-    exit(sum(returncodes))
+    result = res.returncode
+    if res.returncode == 0:
+        issues = ""
+    else:
+        issues = res.stdout
+    date_string = date.strftime("%Y-%m-%d %H:%M:%S")
+
+    content = {key: {"result": result, "issues": issues, "runtime": runtime, "date": date_string}}
+    if cached is not None:
+        content[key]["cached"] = True
+
+    resources = parse_resource_usage(res.stdout)
+    container_stats = getattr(res, "container_stats", None)
+    if resources is not None or container_stats is not None:
+        content[key]["resources"] = resources or {}
+        if container_stats is not None:
+            content[key]["resources"]["container"] = container_stats
+
+    if "Calculated with " in res.stdout:
+        version = res.stdout.split("Calculated with ")[-1].split("\n\n")[0]
+        content[key]["env_version"] = version
+
+    print("---")
+
+    return key, res, content
+
+
+def get_ci_artifact_paths(entity):
+    """
+    :return:    2-tuple: source path (file or directory inside the dummy container), destination folder
+    """
+    key = entity.key
+    # copy plot or notebook to collection directory
+    dest_dir_plots = os.path.join(core.root_path, "artifacts", "ackrep_plots")
+    dest_dir_notebooks = os.path.join(core.root_path, "artifacts", "ackrep_notebooks")
+
+    if isinstance(entity, models.ProblemSolution) or isinstance(entity, models.SystemModel):
+        # entire folder since there could be multiple images with arbitrary names
+        src_path = f"/code/{entity.base_path}/_data"
+        dest_folder = os.path.join(dest_dir_plots, key)
+    elif isinstance(entity, models.Notebook):
+        html_file_name = entity.notebook_file.replace(".ipynb", ".html")
+        src_path = f"/code/{entity.base_path}/{html_file_name}"
+        dest_folder = os.path.join(dest_dir_notebooks, key)
+    else:
+        raise TypeError(f"{key} is not of a checkable type")
 
+    return src_path, dest_folder
 
-def check(arg0: str, exitflag: bool = True):
+
+def check(arg0: str, exitflag: bool = True, inprocess: bool = False):
     """
 
     :param arg0:        either an entity key or the path to the respective metadata.yml
     :param exitflag:    determine whether the program should exit at the end of this function
+    :param inprocess:   run solutions and system models in a forked child of this process
+                        (see core.run_check_inprocess)
 
     :return:            container of subprocess.run (if exitflag == False)
     """
@@ -405,59 +808,116 @@ def check(arg0: str, exitflag: bool = True):
 
     print(f'Checking {bright(str(entity))} "({entity.name}, {entity.estimated_runtime})"')
 
-    # set timeout
-    if not os.name == "nt":
-        signal.alarm(settings.ENTITY_TIMEOUT)
-    try:
-        if isinstance(entity, (models.ProblemSolution, models.SystemModel)):
-            cmd = [f"core.check_generic(key={key}"]
-            res = core.check_generic(key=key)
-        elif isinstance(entity, models.Notebook):
-            path = os.path.join(core.root_path, entity.base_path, entity.notebook_file)
-            cmd = ["jupyter", "nbconvert", "--execute", "--to", "html", path]
-            res = run_command(cmd, logger=core.logger, capture_output=False)
+    # the timeout is enforced by the executor (which also kills the subprocesses of the check)
+    if isinstance(entity, (models.ProblemSolution, models.SystemModel)):
+        res = core.check_generic(key=key, timeout=settings.ENTITY_TIMEOUT, inprocess=inprocess)
+    elif isinstance(entity, models.Notebook):
+        path = os.path.join(core.root_path, entity.base_path, entity.notebook_file)
+        if notebook_execution.is_available():
+            # reuses the (already started) kernels of this process
+            res = notebook_execution.run_notebook(
+                path,
+                timeout=settings.ENTITY_TIMEOUT,
+                logger=core.logger,
+                log_file_path=core.get_check_log_file_path(key),
+            )
         else:
-            raise NotImplementedError
-    except TimeoutError as exc:
-        msg = f"Entity calculation reached timeout ({settings.ENTITY_TIMEOUT}s)."
-        core.logger.error(msg)
-        res = subprocess.CompletedProcess(cmd, returncode=1, stdout="", stderr=f"Entity check timed out.\n{exc}")
+            cmd = ["jupyter", "nbconvert", "--execute", "--to", "html", path]
+            res = run_command(cmd, logger=core.logger, capture_output=False, timeout=settings.ENTITY_TIMEOUT)
+    else:
+        raise NotImplementedError
 
-    # cancel timeout
-    if not os.name == "nt":
-        signal.alarm(0)
+    if getattr(res, "timed_out", False):
+        core.logger.error(f"Entity calculation reached timeout ({settings.ENTITY_TIMEOUT}s).")
 
     env_version = get_environment_version(entity)
     if env_version != "Unknown":
         print(f"\nCalculated with {env_version}\n")
 
+    # this line is parsed by collect_ci_result (the check might run inside a container)
+    resources = getattr(res, "resources", None)
+    if resources is not None:
+        print(format_resource_usage(resources), "\n")
+
+    print_check_result(res)
+
+    if exitflag:
+        exit(res.returncode)
+    else:
+        return res
+
+
+def check_batch(keys, inprocess: bool = False):
+    """check several entities (locally) and print one structured result line per entity (see
+    util.format_batch_result), i.e. the startup of ackrep is only paid once (see core.check_batch).
+
+    :param keys:        list of entity keys (if empty: read from stdin, one key per line)
+    :param inprocess:   see check
+    """
+    if not keys:
+        keys = [line.strip() for line in sys.stdin if line.strip()]
+
+    all_passed = True
+    for key in keys:
+        start_time = time.time()
+        output = io.StringIO()
+        res = None
+        with contextlib.redirect_stdout(output):
+            try:
+                res = check(key, exitflag=False, inprocess=inprocess)
+                returncode = res.returncode
+            except (Exception, SystemExit):
+                # the remaining entities are checked anyway
+                traceback.print_exc(file=sys.stdout)
+                returncode = 1
+
+        stdout = BoundedTextBuffer(settings.COMMAND_OUTPUT_MAX_SIZE)
+        stdout.write(output.getvalue())
+        result = {
+            "key": key,
+            "returncode": returncode,
+            "runtime": round(time.time() - start_time, 1),
+            "stdout": stdout.getvalue(),
+            "timed_out": getattr(res, "timed_out", False),
+            "resources": getattr(res, "resources", None),
+        }
+        print(format_batch_result(result), flush=True)
+        all_passed = all_passed and returncode == 0
+
+    exit(0 if all_passed else 1)
+
+
+def print_check_result(res):
     if res.returncode == 0:
         print(bgreen("Success."))
     elif res.returncode == 2:
         print(yellow("Inaccurate."))
+    elif res.returncode == TIMEOUT_RETURNCODE:
+        print(bred("Timeout."))
     else:
         print(bred("Fail."))
 
-    if exitflag:
-        exit(res.returncode)
-    else:
-        return res
-
 
 def get_environment_version(entity: models.GenericEntity):
+    """return the version of the compatible environment of the entity (from the label of its image, see
+    core.get_environment_description; the dockerfile is only read if the image is not available)"""
     try:
         env_key = entity.compatible_environment
         if env_key == "" or env_key is None:
             env_key = settings.DEFAULT_ENVIRONMENT_KEY
         env_name = core.get_entity(env_key).name
-        dockerfile_name = "Dockerfile_" + env_name
-        path = os.path.join(core.root_path, dockerfile_name)
-        with open(path, "r") as docker_file:
-            lines = docker_file.readlines()
-        if "LABEL" in lines[-1]:
-            version = lines[-1].split('org.opencontainers.image.description "')[-1].split(". |")[0]
-        else:
-            version = "Unknown"
+        try:
+            description = core.get_environment_description(env_name)
+        except (DockerError, OSError):
+            description = None
+        if description is None:
+            dockerfile_name = "Dockerfile_" + env_name
+            path = os.path.join(core.root_path, dockerfile_name)
+            with open(path, "r") as docker_file:
+                lines = docker_file.readlines()
+            if "LABEL" in lines[-1]:
+                description = lines[-1].split(f'{core.IMAGE_DESCRIPTION_LABEL} "')[-1]
+        version = "Unknown" if description is None else description.split(". |")[0]
     except:
         version = "Unknown"
 
@@ -484,11 +944,7 @@ def check_with_docker(arg0: str, exitflag: bool = True):
 
     if res.returncode == 0:
         print(res.stdout)
-        print(bgreen("Success."))
-    elif res.returncode == 2:
-        print(yellow("Inaccurate."))
-    else:
-        print(bred("Fail."))
+    print_check_result(res)
 
     if exitflag:
         exit(res.returncode)
@@ -736,7 +1192,7 @@ def run_interactive_environment(args):
     assert isinstance(entity, models.EnvironmentSpecification), msg
     print("\nRunning Interactive Docker Container. To Exit, press Ctrl+D.\n")
 
-    container_id = core.start_idle_container(entity.name, try_to_use_local_image=False)
+    container_id = core.start_idle_container(entity.name, try_to_use_local_image=False, pooled=False)
 
     core.logger.info(f"Ackrep command running in Container: {container_id}")
     host_uid = core.get_host_uid()
@@ -752,7 +1208,7 @@ def run_interactive_environment(args):
     res = run_command(cmd, capture_output=False)
 
     print("Shutting down container...")
-    run_command(["docker", "stop", container_id], logger=core.logger, capture_output=True)
+    core.stop_container(container_id, timeout=10)
 
     return res.returncode
 
@@ -766,20 +1222,17 @@ def run_jupyter(key):
     msg = f"{key} is not an EnvironmentSpecification key."
     assert isinstance(entity, models.EnvironmentSpecification), msg
 
-    # run_command([f"docker stop $(docker ps --filter name={entity.name} -q)"], shell=True)
-    find_cmd = ["docker", "ps", "--filter", f"name={entity.name}", "-q"]
-    res = run_command(find_cmd, capture_output=True)
-    if len(res.stdout) > 0:
-        ids = res.stdout.split("\n")[:-1]
-        for i in ids:
-            stop_cmd = ["docker", "stop", i]
-            run_command(stop_cmd, capture_output=True)
+    # stop running containers of the environment (like `docker stop $(docker ps --filter name=<env> -q)`)
+    for container in docker_backend.get_backend().list_containers(name=entity.name):
+        core.stop_container(container["id"])
 
     print("\nRunning Jupyter Server in Docker Container. To Stop the Server, press Ctrl+C twice.")
     print("To access the Notebook, click one of the provided links below.\n")
 
     port_dict = {8888: 8888}
-    container_id = core.start_idle_container(entity.name, try_to_use_local_image=True, port_dict=port_dict)
+    container_id = core.start_idle_container(
+        entity.name, try_to_use_local_image=True, port_dict=port_dict, pooled=False
+    )
 
     core.logger.info(f"Ackrep command running in Container: {container_id}")
     host_uid = core.get_host_uid()
@@ -801,7 +1254,7 @@ def run_jupyter(key):
     res = run_command(cmd, capture_output=False)
 
     print("Shutting down container...")
-    run_command(["docker", "stop", container_id], logger=core.logger, capture_output=True)
+    core.stop_container(container_id, timeout=10)
 
     return res.returncode
 
@@ -815,33 +1268,15 @@ def pull_and_show_envs():
     """this function pulls the most recent environment version and prints out information about this version
     it is primarily used inside the docker container to ensure image validity"""
     entities = list(models.EnvironmentSpecification.objects.all())
+    # pull the images concurrently (at most settings.IMAGE_PULL_JOBS)
+    core.prefetch_environment_images([entity.name for entity in entities], try_to_use_local_image=False, force=True)
     print("\nEnvironment Infos:\n")
     for entity in entities:
-        env_key = entity.key
-        env_name = entity.name
-
-        dockerfile_name = "Dockerfile_" + env_name
-        # pull most recent image
-        cmd = ["docker", "pull", f"ghcr.io/ackrep-org/{env_name}:latest"]
-        pull = run_command(cmd, core.logger, capture_output=True)
-        # get version info of image
-        if os.environ.get("CI") == "true":
-            dockerfile_path = f"../{dockerfile_name}"
-        else:
-            dockerfile_path = os.path.join(root_path, "ackrep_deployment/dockerfiles/ackrep_core", dockerfile_name)
-        cmd = [
-            "docker",
-            "run",
-            "--entrypoint",
-            "tail",
-            f"ghcr.io/ackrep-org/{env_name}:latest",
-            "-1",
-            dockerfile_path,
-        ]
-        res = run_command(cmd, core.logger, capture_output=True)
-        infos = res.stdout.split('org.opencontainers.image.description "')[-1].split("|")
+        # get version info from the label of the image (no container is started)
+        description = core.get_environment_description(entity.name)
+        infos = ["<not available>"] if description is None else description.split("|")
 
-        print(f"{env_name} ({env_key}):")
+        print(f"{entity.name} ({entity.key}):")
         row_template = "  {}"
         for info in infos:
             print(row_template.format(info))
@@ -851,6 +1286,17 @@ def pull_and_show_envs():
     print(f"Default environment is {default_name} ({default_key})\n")
 
 
+def refresh_images():
+    """compare the images of all environments with the registry and pull outdated ones"""
+    env_names = [entity.name for entity in models.EnvironmentSpecification.objects.all()]
+    results = core.prefetch_environment_images(env_names, try_to_use_local_image=False, force=True)
+    for image_name, changed in results.items():
+        if changed is None:
+            print(f"{image_name}: {bred('failed')}")
+        else:
+            print(f"{image_name}: {yellow('updated') if changed else bgreen('up to date')}")
+
+
 def get_entity_and_key(arg0):
     """return entity and key for a given key or metadata path
 
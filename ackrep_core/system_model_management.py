@@ -509,13 +509,9 @@ def update_parameter_tex(key):
     # Create string which contains the latex-code of the tabular
     tex = tab.tabulate(table, parameters.tabular_header, tablefmt="latex_raw", colalign=parameters.col_alignment)
 
-    # Change Directory to the Folder of the Model.
-    cwd = os.path.dirname(os.path.abspath(__file__))
-    parent2_cwd = os.path.dirname(os.path.dirname(cwd))
+    # Write tabular to Parameter File (in the _data folder of the model).
     path_base = os.path.join(root_path, parameters.base_path, "_data")
-    os.chdir(path_base)
-    # Write tabular to Parameter File.
-    file = open("parameters.tex", "w")
+    file = open(os.path.join(path_base, "parameters.tex"), "w")
     file.write(tex)
     file.close()
 
@@ -530,9 +526,9 @@ def create_pdf(key, output_path=None):
     system_model_entity = core.model_utils.get_entity(key)
     base_path = system_model_entity.base_path
     tex_path = os.path.join(root_path, base_path, "_data")
-    os.chdir(tex_path)
 
-    generate_notice_tex(key)
+    # Note: os.chdir is avoided (process wide state), all paths are absolute or passed as `cwd`
+    generate_notice_tex(key, target_dir=tex_path)
 
     assert type(system_model_entity) == models.SystemModel, f"{system_model_entity} is not of type model.SystemModel"
     try:
@@ -555,7 +551,9 @@ def create_pdf(key, output_path=None):
             tex_file.writelines(lines)
 
     if output_path is None:
-        res = run_command(["pdflatex", "-halt-on-error", "documentation.tex"], logger=core.logger, capture_output=False)
+        res = run_command(
+            ["pdflatex", "-halt-on-error", "documentation.tex"], logger=core.logger, capture_output=False, cwd=tex_path
+        )
     else:
         test_dir = os.path.join(tex_path, output_path)
         if not os.path.isdir(test_dir):
@@ -569,6 +567,7 @@ def create_pdf(key, output_path=None):
             ["pdflatex", "-halt-on-error", "-output-directory", output_path, "documentation.tex"],
             logger=core.logger,
             capture_output=True,
+            cwd=tex_path,
         )
         if res.returncode != 0:
             # ToDo: print useful errormessage here
@@ -596,23 +595,22 @@ def create_pdf(key, output_path=None):
     else:
         file_path = os.path.join(tex_path, output_path)
 
-    os.chdir(file_path)
-    files = os.listdir()
+    files = os.listdir(file_path)
     for file in files:
         if file.split(".")[-1] in delete_list:
-            os.remove(os.path.split(file)[1])
-    os.remove(os.path.join(file_path, "notice.tex"))
+            os.remove(os.path.join(file_path, file))
+    os.remove(os.path.join(tex_path, "notice.tex"))
 
     return res
 
 
-def generate_notice_tex(key):
+def generate_notice_tex(key, target_dir):
     note_text = r"""This document was automatically generated based on the \href{https://ackrep.org/}{ACKREP} project
                 \href{https://github.com/ackrep-org/ackrep_data/tree/main/system_models}{system model with --key--}. 
                 The Automatic Control Knowledge Repository, short ACKREP, aims to facilitate knowledge transfer of control theory and control engineering. """
 
     note_text = note_text.replace("--key--", key)
-    file_note = open("notice.tex", "w")
+    file_note = open(os.path.join(target_dir, "notice.tex"), "w")
     file_note.write(note_text)
     file_note.close()
 
@@ -742,14 +740,14 @@ def create_system_model_list_pdf():
     output_dir = os.path.join(core.root_path, "local_outputs")
     if not os.path.isdir(output_dir):
         os.mkdir(output_dir)
-    os.chdir(output_dir)
 
     tex_file_name = "system_model_list.tex"
+    tex_file_path = os.path.join(output_dir, tex_file_name)
     try:
-        os.unlink(tex_file_name)
+        os.unlink(tex_file_path)
     except FileNotFoundError:
         pass
-    tex_file = open(tex_file_name, "a")
+    tex_file = open(tex_file_path, "a")
 
     header = []
     body = []
@@ -836,7 +834,9 @@ def create_system_model_list_pdf():
     tex_file.write("\n\\end{document}")
     tex_file.close()
     core.logger.warning("This will get stuck if the pdf is already opened by Adobe.")
-    res = run_command(["pdflatex", "-halt-on-error", tex_file_name], logger=core.logger, capture_output=True)
+    res = run_command(
+        ["pdflatex", "-halt-on-error", tex_file_name], logger=core.logger, capture_output=True, cwd=output_dir
+    )
 
     return res
 
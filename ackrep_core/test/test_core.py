@@ -1,13 +1,28 @@
 import os
 import sys
 import yaml
+import time
+import shutil
+import tempfile
+import subprocess
+import multiprocessing
 
 from unittest import skipIf, skipUnless
 from django.test import TestCase as DjangoTestCase, SimpleTestCase
 from django.conf import settings
 from git import Repo, InvalidGitRepositoryError
 
-from ackrep_core import core, system_model_management
+from ackrep_core import (
+    core,
+    system_model_management,
+    result_cache,
+    util,
+    scheduling,
+    notebook_execution,
+    docker_backend,
+    artifacts,
+    warm_workers,
+)
 
 from ._test_utils import load_repo_to_db_for_ut, reset_repo
 from ackrep_core.util import run_command, utf8decode, strip_decode
@@ -115,6 +130,526 @@ class TestCases1(DjangoTestCase):
         self.assertIn("critical", lines[0])
         self.assertIn("warning", lines[-1])
 
+    def test_render_template_to_str(self):
+        tmpl_path = "templates/execscript_system_model.py.template"
+        context = {"system_model_path": "/some/path", "ackrep_core_path": core.core_pkg_path}
+        res = core.render_template_to_str(tmpl_path, context)
+        self.assertIn('sys.path.insert(0, r"/some/path")', res)
+
+        # the compiled template is reused
+        self.assertIs(core.get_template(tmpl_path), core.get_template(tmpl_path))
+
+    def test_run_command_bounded_output(self):
+        log_dir = tempfile.mkdtemp()
+        log_file_path = os.path.join(log_dir, "check.log")
+        cmd = [sys.executable, "-c", "print('start'); print('x' * 100000); print('end')"]
+        with self.settings(COMMAND_OUTPUT_MAX_SIZE=1000):
+            res = run_command(cmd, logger=core.logger, log_file_path=log_file_path)
+        self.assertEqual(res.returncode, 0)
+        self.assertTrue(res.output_truncated)
+        self.assertLess(len(res.stdout), 1100)
+        self.assertTrue(res.stdout.startswith("start\n"))
+        self.assertTrue(res.stdout.endswith("end\n"))
+
+        # the log file contains the complete output
+        with open(log_file_path) as f:
+            self.assertEqual(len(f.read()), 100011)
+        shutil.rmtree(log_dir)
+
+    def test_streaming_process_lines(self):
+        # lines with the prefix are collected completely even if they exceed the bounded output buffer
+        code = "print('x' * 100000); print('result: ' + 'y' * 100000); print('no result: '); print('result: end')"
+        proc = util.StreamingProcess([sys.executable, "-c", code], max_output_size=1000, line_prefix="result: ")
+        res = proc.wait()
+        self.assertTrue(res.output_truncated)
+        self.assertEqual(proc.read_lines(), ["result: " + "y" * 100000, "result: end"])
+        self.assertEqual(proc.read_lines(), [])
+
+    @skipIf(os.name == "nt", "fork is not available on windows")
+    def test_run_in_child_bounded_output(self):
+        log_dir = tempfile.mkdtemp()
+        log_file_path = os.path.join(log_dir, "check.log")
+        ctx = multiprocessing.get_context("fork")
+        with self.settings(COMMAND_OUTPUT_MAX_SIZE=1000):
+            res = warm_workers.run_in_child(
+                _print_large_output, (), ["test"], ctx, logger=core.logger, log_file_path=log_file_path
+            )
+        self.assertEqual(res.returncode, 0)
+        self.assertTrue(res.output_truncated)
+        self.assertLess(len(res.stdout), 1100)
+        self.assertTrue(res.stdout.startswith("start\n"))
+        self.assertTrue(res.stdout.endswith("end\n"))
+        # output of subprocesses is captured as well
+        self.assertEqual(res.stderr, "from subprocess\n")
+
+        # the log file contains the complete output (it was written while the child ran)
+        with open(log_file_path) as f:
+            self.assertEqual(len(f.read()), 100027)
+        shutil.rmtree(log_dir)
+
+    def test_run_command_resources(self):
+        # allocate ~100 MB and burn some cpu time
+        cmd = [sys.executable, "-c", "x = bytearray(100 * 1024**2); sum(range(10**7))"]
+        for capture_output in (True, False):
+            res = run_command(cmd, capture_output=capture_output)
+            self.assertEqual(res.returncode, 0)
+            self.assertGreater(res.resources["wall_time"], 0)
+            if os.name != "nt":
+                self.assertGreater(res.resources["user_time"], 0)
+                self.assertGreater(res.resources["max_rss"], 100)
+
+        resources = util.parse_resource_usage(f"some output\n{util.format_resource_usage(res.resources)}\n")
+        self.assertEqual(resources, res.resources)
+
+    @skipIf(os.name == "nt", "process groups are not available on windows")
+    def test_run_command_timeout(self):
+        # the subprocess of the command must also be killed
+        code = (
+            "import subprocess, sys, time; "
+            "p = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)']); "
+            "print(p.pid, flush=True); time.sleep(60)"
+        )
+        with self.settings(PROCESS_TERMINATION_GRACE_PERIOD=1):
+            res = run_command([sys.executable, "-c", code], timeout=2)
+        self.assertTrue(res.timed_out)
+        self.assertEqual(res.returncode, util.TIMEOUT_RETURNCODE)
+        self.assertLess(res.resources["wall_time"], 10)
+
+        grandchild_pid = int(res.stdout.strip())
+        state = None
+        for i in range(20):
+            try:
+                with open(f"/proc/{grandchild_pid}/stat") as f:
+                    state = f.read().split()[2]
+            except FileNotFoundError:
+                state = None
+            # zombie processes (not yet reaped by init) are also fine
+            if state in (None, "Z"):
+                break
+            time.sleep(0.1)
+        self.assertIn(state, (None, "Z"))
+
+        res = run_command([sys.executable, "-c", "print('done')"], timeout=10)
+        self.assertFalse(res.timed_out)
+        self.assertEqual(res.returncode, 0)
+
+    @skipUnless(notebook_execution.is_available(), "jupyter packages are not installed")
+    def test_notebook_kernel_pool(self):
+        import nbformat
+
+        notebook_dir = tempfile.mkdtemp()
+        sources = {
+            "first": ["x = 5\nprint(x)"],
+            "second": ["print('x' in dir())", "import os\nos.getcwd()"],
+            "failing": ["undefined_name"],
+            "slow": ["import time\ntime.sleep(60)"],
+        }
+        for name, cell_sources in sources.items():
+            nb = nbformat.v4.new_notebook()
+            nb.cells = [nbformat.v4.new_code_cell(source) for source in cell_sources]
+            nbformat.write(nb, os.path.join(notebook_dir, f"{name}.ipynb"))
+
+        pool = notebook_execution.KernelPool(size=1)
+        try:
+            res = notebook_execution.run_notebook(os.path.join(notebook_dir, "first.ipynb"), pool=pool)
+            self.assertEqual(res.returncode, 0, msg=res.stderr)
+            self.assertEqual(res.stdout.strip(), "5")
+            self.assertTrue(os.path.isfile(os.path.join(notebook_dir, "first.html")))
+
+            # same kernel, but reset namespace and working directory
+            res = notebook_execution.run_notebook(os.path.join(notebook_dir, "second.ipynb"), pool=pool)
+            self.assertEqual(res.returncode, 0, msg=res.stderr)
+            self.assertEqual(res.stdout.strip(), "False")
+            self.assertEqual(len(pool.kernel_managers), 1)
+            with open(os.path.join(notebook_dir, "second.html")) as f:
+                self.assertIn(notebook_dir, f.read())
+
+            res = notebook_execution.run_notebook(os.path.join(notebook_dir, "failing.ipynb"), pool=pool)
+            self.assertEqual(res.returncode, 1)
+            self.assertFalse(os.path.isfile(os.path.join(notebook_dir, "failing.html")))
+
+            res = notebook_execution.run_notebook(os.path.join(notebook_dir, "slow.ipynb"), pool=pool, cell_timeout=2)
+            self.assertEqual(res.returncode, util.TIMEOUT_RETURNCODE)
+            self.assertTrue(res.timed_out)
+
+            # the kernel was restarted and can be used again
+            res = notebook_execution.run_notebook(os.path.join(notebook_dir, "first.ipynb"), pool=pool)
+            self.assertEqual(res.returncode, 0, msg=res.stderr)
+        finally:
+            pool.shutdown()
+            shutil.rmtree(notebook_dir)
+
+    def test_image_freshness(self):
+        image_name = core.get_remote_image_name("some_environment")
+        original_path = util.image_freshness_path
+        util.image_freshness_path = os.path.join(tempfile.mkdtemp(), "image_freshness.json")
+        try:
+            core._save_image_freshness({image_name: {"verified": time.time(), "digest": "sha256:0123"}})
+
+            # recently verified -> neither registry nor docker are asked
+            self.assertFalse(core.refresh_image(image_name))
+
+            # invalidated images have to be verified again (see also `ackrep --refresh-images`)
+            core.invalidate_image_freshness(image_name)
+            self.assertEqual(core._load_image_freshness(), {})
+        finally:
+            shutil.rmtree(os.path.dirname(util.image_freshness_path))
+            util.image_freshness_path = original_path
+
+    def test_container_pool_identity(self):
+        original_data_path = core.data_path
+        core.data_path = tempfile.mkdtemp()
+        try:
+            entity_path = os.path.join(core.data_path, "system_models", "model1")
+            os.makedirs(entity_path)
+            with open(os.path.join(entity_path, "metadata.yml"), "w") as f:
+                f.write("key: ABCDE\n")
+
+            commit, db_hash = core.get_data_snapshot()
+            self.assertEqual(commit, "unknown")
+
+            # only the metadata files determine the database of the container
+            with open(os.path.join(entity_path, "system_model.py"), "w") as f:
+                f.write("x = 1\n")
+            core._data_snapshot_cache.clear()
+            self.assertEqual(core.get_data_snapshot(), (commit, db_hash))
+
+            with open(os.path.join(entity_path, "metadata.yml"), "w") as f:
+                f.write("key: FGHIJ\n")
+            core._data_snapshot_cache.clear()
+            self.assertNotEqual(core.get_data_snapshot()[1], db_hash)
+        finally:
+            shutil.rmtree(core.data_path)
+            core.data_path = original_data_path
+            core._data_snapshot_cache.clear()
+
+        self.assertTrue(core.is_container_healthy({"state": "running", "health": None}))
+        self.assertTrue(core.is_container_healthy({"state": "running", "health": "healthy"}))
+        self.assertFalse(core.is_container_healthy({"state": "running", "health": "unhealthy"}))
+        self.assertFalse(core.is_container_healthy({"state": "paused", "health": None}))
+
+    def test_docker_backend(self):
+        env_name = "some_environment"
+        image_name = core.get_remote_image_name(env_name)
+        backend = docker_backend.FakeBackend()
+        backend.add_remote_image(image_name, digest="sha256:0123")
+        backend.add_image(image_name, digest="sha256:0123")
+        previous_backend = docker_backend.set_backend(backend)
+
+        original_paths = util.image_freshness_path, util.container_pool_path, util.image_info_path
+        state_dir = tempfile.mkdtemp()
+        util.image_freshness_path = os.path.join(state_dir, "image_freshness.json")
+        util.container_pool_path = os.path.join(state_dir, "container_pool.json")
+        util.image_info_path = os.path.join(state_dir, "image_info.json")
+        try:
+            # recently verified -> no registry request
+            core._save_image_freshness({image_name: {"verified": time.time(), "digest": "sha256:0123"}})
+            container_id = core.start_idle_container(env_name, try_to_use_local_image=False)
+            container = backend.containers[container_id]
+            self.assertEqual(container["name"], f"{env_name}_0")
+            self.assertEqual(container["labels"][core.POOL_LABEL], "true")
+            self.assertEqual(container["run_kwargs"]["environment"]["HOST_UID"], core.get_host_uid())
+
+            # the labeled container is reused
+            self.assertEqual(core.look_for_running_container(env_name), container_id)
+
+            # idle containers are retired, but only those of the environment which is looked up
+            core._save_json_state(util.container_pool_path, {container_id: time.time() - 3600})
+            self.assertEqual(len(core.retire_idle_containers(env_name="other_environment")), 1)
+            with self.settings(CONTAINER_IDLE_TIMEOUT=0.4):
+                with core.container_in_use(container_id):
+                    core._save_json_state(util.container_pool_path, {container_id: time.time() - 3600})
+                    time.sleep(0.6)
+                    # busy although it was acquired long ago: the time of use is refreshed while the command runs
+                    self.assertEqual(len(core.retire_idle_containers(env_name=env_name)), 1)
+                time.sleep(0.6)
+                self.assertEqual(core.retire_idle_containers(env_name=env_name), [])
+            self.assertEqual(backend.containers, {})
+            container_id = core.start_idle_container(env_name, try_to_use_local_image=False)
+            container = backend.containers[container_id]
+
+            # digest of the image which runs the checks (part of the result fingerprints)
+            self.assertEqual(core.get_environment_image_digest(env_name), "sha256:0123")
+            backend.add_image(f"ackrep_deployment_{env_name}", image_id="sha256:local")
+            self.assertEqual(core.get_environment_image_digest(env_name), "sha256:local")
+            self.assertEqual(core.get_environment_image_digest(env_name, try_to_use_local_image=False), "sha256:0123")
+            del backend.images[f"ackrep_deployment_{env_name}"]
+
+            # prefetch before bulk checks: environments with a local image are skipped, duplicates are ignored
+            backend.add_image("ackrep_deployment_local_environment")
+            prefetched = core.prefetch_environment_images([env_name, "local_environment", env_name])
+            self.assertEqual(prefetched, {image_name: False})
+
+            # readiness: one exec which waits for the file that is created by the entrypoint (`ackrep -l`)
+            self.assertEqual(container["run_kwargs"]["environment"]["ACKREP_READY_FILE"], core.CONTAINER_READY_FILE)
+            commands = []
+            backend.exec_handler = lambda container, cmd, user: commands.append(cmd) or (
+                util.TIMEOUT_RETURNCODE,
+                "",
+                "",
+            )
+            with self.assertRaises(TimeoutError):
+                core.start_idle_container(env_name, try_to_use_local_image=False, replica=1)
+            self.assertEqual(len(commands), 1)
+            self.assertIn(core.CONTAINER_READY_FILE, commands[0][-1])
+            # the database of older images without the ready file is probed (independent of specific entities)
+            self.assertIn("metadata.yml", commands[0][-1])
+            self.assertNotIn("--show-entity-info", commands[0][-1])
+            # the container which did not become ready was stopped
+            self.assertEqual(list(backend.containers), [container_id])
+            backend.exec_handler = None
+
+            ready_file_path = os.path.join(state_dir, "ready")
+            os.environ["ACKREP_READY_FILE"] = ready_file_path
+            try:
+                core.signal_container_ready()
+            finally:
+                del os.environ["ACKREP_READY_FILE"]
+            self.assertTrue(os.path.isfile(ready_file_path))
+
+            # a new version of the image -> the container is outdated
+            backend.add_image(image_name, digest="sha256:4567")
+            self.assertIsNone(core.look_for_running_container(env_name))
+            self.assertEqual(backend.containers, {})
+
+            # unhealthy containers are not reused either
+            container_id = core.start_idle_container(env_name, try_to_use_local_image=False)
+            backend.containers[container_id]["health"] = "unhealthy"
+            self.assertIsNone(core.look_for_running_container(env_name))
+            self.assertEqual(backend.containers, {})
+
+            # replicas with resource limits: further replicas are only used if the others are busy
+            with self.settings(CONTAINER_REPLICAS=2, CONTAINER_CPU_LIMIT=1.5, CONTAINER_MEMORY_LIMIT=512):
+                scheduler = core.ReplicaScheduler()
+                with scheduler.replica(env_name) as replica0:
+                    with scheduler.replica(env_name) as replica1:
+                        with scheduler.replica(env_name) as replica2:
+                            self.assertEqual((replica0, replica1, replica2), (0, 1, 0))
+                self.assertEqual(scheduler.acquire(env_name), 0)
+
+                container_ids = [
+                    core.start_idle_container(env_name, try_to_use_local_image=False, replica=i) for i in (0, 1)
+                ]
+                container = backend.containers[container_ids[1]]
+                self.assertEqual(container["name"], f"{env_name}_1")
+                self.assertEqual(container["run_kwargs"]["cpus"], 1.5)
+                self.assertEqual(container["run_kwargs"]["memory"], 512 * 2**20)
+
+                # restarting a replica does not affect the other one
+                container_ids[0] = core.start_idle_container(env_name, try_to_use_local_image=False, replica=0)
+                self.assertEqual(len(backend.containers), 2)
+                self.assertEqual(core.look_for_running_container(env_name, replica=1), container_ids[1])
+                self.assertEqual(core.look_for_running_container(env_name, replica=0), container_ids[0])
+
+            # replicas beyond settings.CONTAINER_REPLICAS are stopped
+            self.assertEqual(core.look_for_running_container(env_name, replica=0), container_ids[0])
+            self.assertEqual(list(backend.containers), [container_ids[0]])
+
+            # version information from the image labels, cached per image digest (also across processes)
+            description = "1.2.3. | python 3.8"
+            backend.add_image(image_name, digest="sha256:89ab", labels={core.IMAGE_DESCRIPTION_LABEL: description})
+            core._save_image_freshness({image_name: {"verified": time.time(), "digest": "sha256:89ab"}})
+            backend.calls.clear()
+            self.assertEqual(core.get_environment_description(env_name), description)
+            self.assertEqual(core.get_environment_description(env_name), description)
+            core._image_labels_cache.clear()
+            self.assertEqual(core.get_environment_description(env_name), description)
+            self.assertEqual(backend.calls, [("image_inspect", image_name)])
+            self.assertIsNone(core.get_environment_description("missing_environment"))
+
+            self.assertEqual(docker_backend._split_image_name(image_name), (image_name[: -len(":latest")], "latest"))
+            self.assertEqual(docker_backend._split_image_name("localhost:5000/env"), ("localhost:5000/env", "latest"))
+            digest = "sha256:" + "0" * 64
+            for name in ("localhost:5000/env", "localhost:5000/env:1.0"):
+                self.assertEqual(docker_backend._split_image_name(f"{name}@{digest}"), ("localhost:5000/env", digest))
+            frames = b"\x01\x00\x00\x00\x00\x00\x00\x03out\x02\x00\x00\x00\x00\x00\x00\x03err"
+            self.assertEqual(docker_backend._demultiplex(frames), (b"out", b"err"))
+        finally:
+            docker_backend.set_backend(previous_backend)
+            util.image_freshness_path, util.container_pool_path, util.image_info_path = original_paths
+            core._image_labels_cache.clear()
+            shutil.rmtree(state_dir)
+
+    def test_artifact_collection(self):
+        backend = docker_backend.FakeBackend()
+        backend.files = {
+            "/code/data/model1/_data/plot.png": b"png",
+            "/code/data/model1/_data/report.pdf": b"large pdf",
+            "/code/data/model2/_data/plot.png": b"png",
+            "/code/data/notebook/notebook.html": b"html",
+            "/code/data/notebook/other.png": b"not requested",
+        }
+        previous_backend = docker_backend.set_backend(backend)
+        original_store_path = util.artifact_store_path
+        tmp_dir = tempfile.mkdtemp()
+        util.artifact_store_path = os.path.join(tmp_dir, "store")
+        try:
+            # a plot of an earlier run
+            os.makedirs(os.path.join(tmp_dir, "model2"))
+            with open(os.path.join(tmp_dir, "model2", "old_plot.png"), "w") as f:
+                f.write("old")
+
+            collected = []
+            collector = artifacts.ArtifactCollector()
+            for name, src_path in [
+                ("model1", "/code/data/model1/_data"),
+                ("model1_plot", "/code/data/model1/_data/plot.png"),
+                ("model2", "/code/data/model2/_data"),
+                ("notebook", "/code/data/notebook/notebook.html"),
+            ]:
+                collector.add(
+                    src_path, os.path.join(tmp_dir, name), lambda success, name=name: collected.append((name, success))
+                )
+            self.assertEqual(collector.fetch(), 3)
+
+            # one transfer, filtered by pattern, callbacks are called afterwards
+            self.assertEqual([call for call in backend.calls if call[0] == "get_archive"], [("get_archive", "dummy")])
+            self.assertEqual(
+                sorted(collected), [("model1", True), ("model1_plot", True), ("model2", True), ("notebook", True)]
+            )
+            self.assertEqual(os.listdir(os.path.join(tmp_dir, "model1")), ["plot.png"])
+            self.assertEqual(os.listdir(os.path.join(tmp_dir, "model1_plot")), ["plot.png"])
+            self.assertEqual(os.listdir(os.path.join(tmp_dir, "model2")), ["plot.png"])
+            self.assertEqual(os.listdir(os.path.join(tmp_dir, "notebook")), ["notebook.html"])
+
+            # identical files are stored once
+            plot_paths = [os.path.join(tmp_dir, name, "plot.png") for name in ("model1", "model1_plot", "model2")]
+            self.assertTrue(os.path.samefile(plot_paths[0], plot_paths[1]))
+            self.assertTrue(os.path.samefile(plot_paths[0], plot_paths[2]))
+
+            # missing sources only lead to a warning, the callback is informed about the failed transfer
+            collected.clear()
+            collector.add("/code/data/model3/_data", os.path.join(tmp_dir, "model3"), collected.append)
+            self.assertEqual(collector.fetch(), 0)
+            self.assertEqual(os.listdir(os.path.join(tmp_dir, "model3")), [])
+            self.assertEqual(collected, [False])
+
+            self.assertEqual(artifacts.prune_store(), 0)
+            for path in plot_paths:
+                os.remove(path)
+            self.assertEqual(artifacts.prune_store(), 1)
+        finally:
+            docker_backend.set_backend(previous_backend)
+            util.artifact_store_path = original_store_path
+            shutil.rmtree(tmp_dir)
+
+    def test_get_changed_file_paths(self):
+        repo_path = tempfile.mkdtemp()
+        repo = Repo.init(repo_path)
+        with repo.config_writer() as config:
+            config.set_value("user", "name", "unittest")
+            config.set_value("user", "email", "unittest@example.org")
+        for name in ("a.txt", "b.txt"):
+            with open(os.path.join(repo_path, name), "w") as f:
+                f.write("1")
+        repo.index.add(["a.txt", "b.txt"])
+        base_sha = repo.index.commit("first").hexsha
+        with open(os.path.join(repo_path, "b.txt"), "w") as f:
+            f.write("2")
+        repo.index.add(["b.txt"])
+        repo.index.commit("second")
+
+        changed = core.get_changed_file_paths(base_sha, repo_path=repo_path)
+        self.assertEqual(changed, [os.path.join(repo_path, "b.txt")])
+        repo.close()
+        shutil.rmtree(repo_path)
+
+    def test_runtime_scheduling(self):
+        self.assertEqual(scheduling.parse_estimated_runtime("10s"), 10)
+        self.assertEqual(scheduling.parse_estimated_runtime("~2 min"), 120)
+        self.assertEqual(scheduling.parse_estimated_runtime("1h 30min"), 5400)
+        self.assertEqual(scheduling.parse_estimated_runtime("5-10 min"), 600)
+        self.assertIsNone(scheduling.parse_estimated_runtime("unknown"))
+
+        results_dir = tempfile.mkdtemp()
+        for i, runtime in enumerate([30, 10, 20]):
+            with open(os.path.join(results_dir, f"ci_results__2022_08_0{i + 1}__03_00_00.yaml"), "w") as f:
+                yaml.dump({"AAAAA": {"result": 0, "runtime": runtime}, "ci_logs": {}}, f)
+        historical_runtimes = scheduling.load_historical_runtimes(results_dir)
+        shutil.rmtree(results_dir)
+        # most recent first
+        self.assertEqual(historical_runtimes, {"AAAAA": [20, 10, 30]})
+
+        entity_list = [
+            core.Container(key="AAAAA", estimated_runtime="1s"),
+            core.Container(key="BBBBB", estimated_runtime="5 min"),
+            core.Container(key="CCCCC", estimated_runtime=None),
+        ]
+        estimates = scheduling.estimate_runtimes(entity_list, historical_runtimes)
+        self.assertEqual(estimates, {"AAAAA": 20, "BBBBB": 300, "CCCCC": scheduling.DEFAULT_RUNTIME})
+
+        ordered_keys = [e.key for e in scheduling.order_longest_first(entity_list, estimates)]
+        self.assertEqual(ordered_keys, ["BBBBB", "CCCCC", "AAAAA"])
+
+        # grouped by environment (in the order of first appearance)
+        entity_list.append(core.Container(key="DDDDD", estimated_runtime="2 min"))
+        estimates["DDDDD"] = 120
+        env_names = {"AAAAA": "env1", "BBBBB": "env2", "CCCCC": "env1", "DDDDD": "env2"}
+        ordered_keys = [e.key for e in scheduling.order_by_environment(entity_list, env_names)]
+        self.assertEqual(ordered_keys, ["AAAAA", "CCCCC", "BBBBB", "DDDDD"])
+        ordered_keys = [e.key for e in scheduling.schedule_checks(entity_list, env_names, estimates, jobs=1)]
+        self.assertEqual(ordered_keys, ["AAAAA", "CCCCC", "BBBBB", "DDDDD"])
+
+        # several workers: longest job first across the environments, equal estimates stay grouped
+        estimates["AAAAA"] = 120
+        ordered_keys = [e.key for e in scheduling.schedule_checks(entity_list, env_names, estimates, jobs=2)]
+        self.assertEqual(ordered_keys, ["BBBBB", "AAAAA", "DDDDD", "CCCCC"])
+
+        # longest job first vs. unfavorable order
+        self.assertEqual(scheduling.predict_makespan([10, 5, 5, 5, 5], jobs=2), 15)
+        self.assertEqual(scheduling.predict_makespan([5, 5, 5, 5, 10], jobs=2), 20)
+
+        # a long check of an environment with a small total runtime must not be started last
+        entity_list = [core.Container(key=key) for key in ("EEEEE", "FFFFF", "GGGGG", "HHHHH", "IIIII")]
+        estimates = {"EEEEE": 5, "FFFFF": 5, "GGGGG": 5, "HHHHH": 4, "IIIII": 9}
+        env_names = {"EEEEE": "env1", "FFFFF": "env1", "GGGGG": "env1", "HHHHH": "env1", "IIIII": "env2"}
+        scheduled_entity_list = scheduling.schedule_checks(entity_list, env_names, estimates, jobs=2)
+        self.assertEqual(scheduling.predict_makespan([estimates[e.key] for e in scheduled_entity_list], jobs=2), 14)
+
+    def test_sharding(self):
+        from ackrep_core import script
+
+        self.assertEqual(script.parse_shard_spec("2/4"), (2, 4))
+        with self.assertRaises(ValueError):
+            script.parse_shard_spec("5/4")
+
+        runtimes = {"AAAAA": 100, "BBBBB": 60, "CCCCC": 50, "DDDDD": 40, "EEEEE": 10}
+        entity_list = [core.Container(key=key) for key in runtimes]
+        shards = scheduling.partition_into_shards(entity_list, 2, runtimes)
+        # greedy: longest remaining entity to the shard with the smallest load (loads: 140, 120)
+        self.assertEqual(
+            [[e.key for e in shard] for shard in shards], [["AAAAA", "DDDDD"], ["BBBBB", "CCCCC", "EEEEE"]]
+        )
+
+        shard_dir = tempfile.mkdtemp()
+        for i, shard in enumerate(shards):
+            content = {
+                "commit_logs": {"ackrep_core": {"sha": "abc"}},
+                "ci_logs": {},
+                "shard": {"index": i + 1, "count": 2, "date": f"2022_08_0{i + 1}__03_00_00"},
+            }
+            content.update({e.key: {"result": 0, "runtime": runtimes[e.key]} for e in shard})
+            with open(
+                os.path.join(shard_dir, f"results_shard_{i + 1}_of_2__{content['shard']['date']}.yaml"), "w"
+            ) as f:
+                yaml.dump(content, f)
+
+        target_dir = tempfile.mkdtemp()
+        target_path = script.merge_shard_results([shard_dir], target_dir=target_dir)
+        self.assertEqual(os.path.basename(target_path), "ci_results__2022_08_01__03_00_00.yaml")
+        with open(target_path) as f:
+            merged = yaml.load(f, Loader=yaml.FullLoader)
+        self.assertNotIn("shard", merged)
+        self.assertEqual(sorted(key for key in merged if len(key) == 5), sorted(runtimes))
+
+        # incomplete set of shards
+        os.remove(os.path.join(shard_dir, sorted(os.listdir(shard_dir))[0]))
+        with self.assertRaises(ValueError):
+            script.merge_shard_results([shard_dir], target_dir=target_dir)
+
+        shutil.rmtree(shard_dir)
+        shutil.rmtree(target_dir)
+
 
 class TestCases2(DjangoTestCase):
     """
@@ -186,6 +721,75 @@ class TestCases2(DjangoTestCase):
         self.assertTrue(len(ae) == 1)
         # IPS(print_tb=-1)
 
+    def test_incremental_ontology_update(self):
+        OM = core.AOM.OM
+        qsrc = f'PREFIX P: <{OM.iri}> SELECT ?x WHERE {{ ?x P:has_entity_key "4ZZ9J".}}'
+        self.assertEqual(len(OM.make_query(qsrc)), 1)
+        individual, _ = core.AOM.individuals[("4ZZ9J", None)]
+        # direct tags and the tags of all superclasses
+        tags_before = set(individual.has_ontology_based_tag)
+
+        core.AOM.remove_entities(["4ZZ9J"])
+        self.assertEqual(len(OM.make_query(qsrc)), 0)
+
+        entity = core.get_entity("4ZZ9J")
+        core.AOM.add_entities([entity])
+        self.assertEqual(len(OM.make_query(qsrc)), 1)
+        individual, _ = core.AOM.individuals[("4ZZ9J", None)]
+        self.assertEqual(set(individual.has_ontology_based_tag), tags_before)
+
+        # unchanged entities keep their individuals
+        core.AOM.sync_entities(core.model_utils.all_entities())
+        self.assertIs(core.AOM.individuals[("4ZZ9J", None)][0], individual)
+
+        # the copy of a merge request has its own individual
+        mr_entity = core.get_entity("4ZZ9J")
+        mr_entity.merge_request = "MRKEY"
+        core.AOM.add_entities([mr_entity])
+        self.assertEqual(len(OM.make_query(qsrc)), 2)
+        self.assertIs(core.AOM.individuals[("4ZZ9J", None)][0], individual)
+        core.AOM.remove_entities(["4ZZ9J"], merge_request="MRKEY")
+        self.assertEqual(len(OM.make_query(qsrc)), 1)
+
+        entity.name = "changed name"
+        core.AOM.sync_entities([entity])
+        self.assertEqual(len(core.AOM.individuals), 1)
+        self.assertIsNot(core.AOM.individuals[("4ZZ9J", None)][0], individual)
+
+        # restore the complete state for other tests
+        core.load_repo_to_db(ackrep_data_test_repo_path)
+
+    def test_bounded_sparql_query(self):
+        OM = core.AOM.OM
+        qsrc = f"""PREFIX P: <{OM.iri}>
+            SELECT ?entity
+            WHERE {{
+              ?entity P:has_ontology_based_tag P:iTransfer_Function.
+            }}
+        """
+        ae, oe = core.AOM.run_sparql_query_and_translate_result(qsrc)
+
+        # the worker builds its ontology in the background, the first query waits for it (within its time limit)
+        res = core.AOM.run_bounded_sparql_query(qsrc, limit=1, offset=0, timeout=120)
+        self.assertEqual(res.total, len(ae) + len(oe))
+        self.assertEqual(len(res.ackrep_entities) + len(res.onto_entities), 1)
+
+        # pages do not overlap
+        res2 = core.AOM.run_bounded_sparql_query(qsrc, limit=1, offset=1)
+        self.assertNotEqual(res.ackrep_entities, res2.ackrep_entities)
+
+        res3 = core.AOM.run_bounded_sparql_query(qsrc, limit=10, offset=res.total)
+        self.assertEqual(res3.ackrep_entities + res3.onto_entities, [])
+
+        # pathological query
+        qsrc = "SELECT ?a ?b ?c WHERE { ?a ?b ?c. ?d ?e ?f. ?g ?h ?i. }"
+        with self.assertRaises(core.util.QueryTimeoutError):
+            core.AOM.run_bounded_sparql_query(qsrc, timeout=0.1)
+
+        # the worker was killed and is restarted in the background, i.e. the next query does not block
+        with self.assertRaises(core.util.QueryBusyError):
+            core.AOM.run_bounded_sparql_query(qsrc, timeout=0.1)
+
     def test_import_repo(self):
 
         # ensure database is empty
@@ -249,6 +853,66 @@ class TestCases3(SimpleTestCase):
             self.assertTrue(isinstance(entity.oc.compatible_environment, core.models.EnvironmentSpecification))
             self.assertTrue(entity.oc.compatible_environment, default_env)
 
+    def test_make_method_build(self):
+        method_package = core.model_utils.get_entity("UENQQ")
+        source_path = os.path.join(core.root_path, method_package.base_path, "src")
+
+        build_path = core.make_method_build(method_package)
+        self.assertTrue(os.path.isdir(build_path))
+        self.assertEqual(os.path.dirname(build_path), os.path.join(core.root_path, method_package.base_path, "_build"))
+
+        # unchanged source -> the existing build is reused
+        self.assertEqual(core.make_method_build(method_package), build_path)
+        with self.assertRaises(ValueError):
+            core.make_method_build(method_package, accept_existing=False)
+
+        # changed source -> new build, the previous one is kept (concurrent checks might still use it)
+        tmp_file_path = os.path.join(source_path, "tmp_file_for_unittest.py")
+        with open(tmp_file_path, "w") as f:
+            f.write("x = 1\n")
+        try:
+            new_build_path = core.make_method_build(method_package)
+        finally:
+            os.remove(tmp_file_path)
+        self.assertNotEqual(new_build_path, build_path)
+        self.assertTrue(os.path.exists(build_path))
+        self.assertTrue(os.path.isfile(os.path.join(new_build_path, "tmp_file_for_unittest.py")))
+
+        # only the most recently used builds are kept
+        try:
+            for i in range(core.METHOD_BUILD_GENERATIONS):
+                with open(tmp_file_path, "w") as f:
+                    f.write(f"x = {i + 2}\n")
+                core.make_method_build(method_package)
+        finally:
+            os.remove(tmp_file_path)
+        build_root = os.path.dirname(build_path)
+        builds = [name for name in os.listdir(build_root) if not name.startswith(".")]
+        self.assertEqual(len(builds), core.METHOD_BUILD_GENERATIONS)
+        self.assertFalse(os.path.exists(build_path))
+
+        self.assertEqual(core.make_method_build(method_package), build_path)
+
+    def test_get_affected_entities(self):
+        def affected_keys(*entity_keys):
+            paths = [
+                os.path.join(core.root_path, core.get_entity(key).base_path, "some_file.py") for key in entity_keys
+            ]
+            return [e.key for e in core.get_affected_entities(paths)]
+
+        # changed problem or method package -> solution is affected
+        self.assertIn("UKJZI", affected_keys("4ZZ9J"))
+        self.assertIn("UKJZI", affected_keys("UENQQ"))
+        self.assertNotIn("UXMFA", affected_keys("4ZZ9J"))
+
+        self.assertEqual(affected_keys("UXMFA"), ["UXMFA"])
+        self.assertEqual(core.get_affected_entities([os.path.join(core.root_path, "README.md")]), [])
+
+        # changed environment -> all entities using it are affected
+        default_env_keys = affected_keys(settings.DEFAULT_ENVIRONMENT_KEY)
+        self.assertIn("UXMFA", default_env_keys)
+        self.assertIn("UKJZI", default_env_keys)
+
     @skipUnless(os.environ.get("DJANGO_TESTS_INCLUDE_SLOW") == "True", "skipping slow test. Run with --include-slow")
     def test_check_solution(self):
 
@@ -274,6 +938,25 @@ class TestCases3(SimpleTestCase):
             print(res.stdout)
         self.assertEqual(res.returncode, 0)
 
+        # the execscript is written to (and removed with) a separate working directory
+        entity, c = core.get_entity_context("UXMFA")
+        scriptpath = core.create_execscript_from_template(entity, c)
+        self.addCleanup(shutil.rmtree, os.path.dirname(scriptpath), ignore_errors=True)
+        self.assertNotEqual(os.path.dirname(scriptpath), ackrep_data_test_repo_path)
+        other_scriptpath = core.create_execscript_from_template(entity, c)
+        self.addCleanup(shutil.rmtree, os.path.dirname(other_scriptpath), ignore_errors=True)
+        self.assertNotEqual(scriptpath, other_scriptpath)
+
+        # run the same script in a child of the warm forkserver
+        res = core.run_execscript(scriptpath, use_warm_worker=True)
+        self.assertEqual(res.returncode, 0, msg=res.stdout)
+
+        # run without execscript in a forked child of this process
+        res = core.check_generic("UXMFA", inprocess=True)
+        self.assertEqual(res.returncode, 0, msg=res.stderr)
+        self.assertEqual(res.args[-1], "--inprocess")
+        self.assertNotIn("system_model", sys.modules)
+
         # second: run via commandline
         os.chdir(ackrep_data_test_repo_path)
 
@@ -285,6 +968,25 @@ class TestCases3(SimpleTestCase):
         # TODO: remove this if png is removed from repo
         reset_repo(ackrep_data_test_repo_path)
 
+    def test_check_batch(self):
+
+        os.chdir(ackrep_data_test_repo_path)
+
+        # this assumes the acrep script to be available in $PATH
+        res = run_command(["ackrep", "--check-batch", "UXMFA", "UKJZI"])
+        results = [util.parse_batch_result(line) for line in res.stdout.splitlines()]
+        results = [result for result in results if result is not None]
+
+        # one result line per entity (in the given order)
+        self.assertEqual([result["key"] for result in results], ["UXMFA", "UKJZI"])
+        self.assertEqual(results[0]["returncode"], 0, msg=results[0]["stdout"])
+        self.assertIn("Success.", results[0]["stdout"])
+        self.assertIsNotNone(util.parse_resource_usage(results[0]["stdout"]))
+        self.assertEqual(res.returncode, 0 if results[1]["returncode"] == 0 else 1)
+
+        # ensure repo is clean again
+        reset_repo(ackrep_data_test_repo_path)
+
     def test_check_notebook(self):
 
         # run via commandline
@@ -322,6 +1024,90 @@ class TestCases3(SimpleTestCase):
         self.assertEqual(len(plots), 1)
         self.assertEqual("plot.png", plots[0])
 
+    def test_check_all_entities_parallel(self):
+        res = run_command(["ackrep", "--check-all-entities", "-ut", "--jobs", "2"])
+        self.assertEqual(res.returncode, 1)
+
+        yaml_path = os.path.join(core.root_path, "artifacts", "ci_results")
+        newest_yaml = sorted(os.listdir(yaml_path))[-1]
+        with open(os.path.join(yaml_path, newest_yaml)) as file:
+            results = yaml.load(file, Loader=yaml.FullLoader)
+        self.assertEqual(results["UXMFA"]["result"], 0)
+        self.assertEqual(results["LRHZX"]["result"], 1)
+
+        # the order of the entries does not depend on the order of completion
+        keys = [key for key in results.keys() if len(key) == 5]
+        self.assertEqual(keys, ["UXMFA", "LRHZX", "7WIQH"])
+
+    def test_result_cache(self):
+        entity = core.get_entity("UKJZI")
+        fingerprint = result_cache.compute_fingerprint(entity, "0.1.0")
+        self.assertEqual(fingerprint, result_cache.compute_fingerprint(entity, "0.1.0"))
+        self.assertNotEqual(fingerprint, result_cache.compute_fingerprint(entity, "0.2.0"))
+        # rebuilt image with the same version string
+        self.assertNotEqual(fingerprint, result_cache.compute_fingerprint(entity, "0.1.0", "sha256:0123"))
+
+        # changes in referenced entities (here: the problem specification) lead to a new fingerprint
+        problem_spec = entity.oc.solved_problem_list[0]
+        tmp_file_path = os.path.join(core.root_path, problem_spec.base_path, "tmp_file_for_unittest.txt")
+        with open(tmp_file_path, "w") as f:
+            f.write("test")
+        try:
+            self.assertNotEqual(fingerprint, result_cache.compute_fingerprint(entity, "0.1.0"))
+        finally:
+            os.remove(tmp_file_path)
+
+        # generated data does not influence the fingerprint
+        data_path = os.path.join(core.root_path, entity.base_path, "_data")
+        data_path_existed = os.path.isdir(data_path)
+        os.makedirs(data_path, exist_ok=True)
+        with open(os.path.join(data_path, "tmp_plot_for_unittest.png"), "w") as f:
+            f.write("test")
+        try:
+            self.assertEqual(fingerprint, result_cache.compute_fingerprint(entity, "0.1.0"))
+        finally:
+            if data_path_existed:
+                os.remove(os.path.join(data_path, "tmp_plot_for_unittest.png"))
+            else:
+                shutil.rmtree(data_path)
+
+        original_cache_path = util.check_cache_path
+        util.check_cache_path = tempfile.mkdtemp()
+        artifact_path = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(artifact_path, "plot.png"), "w") as f:
+                f.write("test")
+
+            self.assertIsNone(result_cache.lookup(fingerprint))
+            res = subprocess.CompletedProcess(["ackrep", "-c", "UKJZI"], returncode=0, stdout="out", stderr="")
+            self.assertTrue(result_cache.store(fingerprint, "UKJZI", res, 3.5, artifact_path))
+
+            # failed checks are not cached
+            res_fail = subprocess.CompletedProcess(["ackrep", "-c", "UKJZI"], returncode=1, stdout="", stderr="")
+            self.assertFalse(result_cache.store("0" * 64, "UKJZI", res_fail, 1.0))
+
+            cached = result_cache.lookup(fingerprint)
+            self.assertEqual(cached.res.returncode, 0)
+            self.assertEqual(cached.res.stdout, "out")
+            self.assertEqual(cached.runtime, 3.5)
+
+            # stale files of a previous run are removed
+            dest_folder = os.path.join(util.check_cache_path, "restored")
+            os.makedirs(dest_folder)
+            with open(os.path.join(dest_folder, "stale_plot.png"), "w") as f:
+                f.write("stale")
+            result_cache.restore_artifacts(cached, dest_folder)
+            self.assertEqual(os.listdir(dest_folder), ["plot.png"])
+
+            self.assertTrue(result_cache.store("1" * 64, "UKJZI", res, 1.0))
+            removed = result_cache.prune(max_entries=1)
+            self.assertEqual(len(removed), 1)
+            self.assertEqual(len([r for r in [fingerprint, "1" * 64] if result_cache.lookup(r)]), 1)
+        finally:
+            shutil.rmtree(util.check_cache_path)
+            shutil.rmtree(artifact_path)
+            util.check_cache_path = original_cache_path
+
     def test_check_with_docker(self):
         # first: run directly
         # when testing locally, also test local image
@@ -632,6 +1418,14 @@ class TestCases4(DjangoTestCase):
         core.logger.setLevel(loglevel)
 
 
+def _print_large_output():
+    """executed in the child of test_run_in_child_bounded_output"""
+    print("start")
+    print("x" * 100000)
+    print("end", flush=True)
+    subprocess.run([sys.executable, "-c", "import sys; print('from subprocess', file=sys.stderr)"])
+
+
 def get_data_files_dict(path, endings=[]):
     """fetch all data filed from given path and put them in dict with the following keys:
     - "all"
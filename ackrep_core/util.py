@@ -1,6 +1,14 @@
 import logging
+import codecs
+import json
+import sys
+import time
+import signal
+import threading
+import collections
 from colorama import Style, Fore
 from django.utils import timezone
+from django.conf import settings
 import yaml
 import subprocess
 from git import Repo
@@ -34,6 +42,36 @@ if not (ci_results_path):
     # paths for (ackrep_data and its test-related clone)
     ci_results_path = os.path.join(root_path, "ackrep_ci_results")
 
+# this env-variable can be set e.g. to place the cache in a directory which is persisted between CI runs
+check_cache_path = os.environ.get("ACKREP_CHECK_CACHE_PATH")
+if not (check_cache_path):
+    check_cache_path = os.path.join(root_path, "ackrep_check_cache")
+
+# complete (unbounded) output of the most recent check of each entity (see core.get_check_log_file_path)
+check_log_path = os.environ.get("ACKREP_CHECK_LOG_PATH")
+if not (check_log_path):
+    check_log_path = os.path.join(root_path, "ackrep_check_logs")
+
+# digests and verification times of the environment images (see core.refresh_image)
+image_freshness_path = os.environ.get("ACKREP_IMAGE_FRESHNESS_PATH")
+if not (image_freshness_path):
+    image_freshness_path = os.path.join(root_path, "ackrep_image_freshness.json")
+
+# last use of the pool containers (see core.retire_idle_containers)
+container_pool_path = os.environ.get("ACKREP_CONTAINER_POOL_PATH")
+if not (container_pool_path):
+    container_pool_path = os.path.join(root_path, "ackrep_container_pool.json")
+
+# labels of the environment images, cached per image digest (see core.get_image_labels)
+image_info_path = os.environ.get("ACKREP_IMAGE_INFO_PATH")
+if not (image_info_path):
+    image_info_path = os.path.join(root_path, "ackrep_image_info.json")
+
+# content-addressed store of the collected artifacts (see artifacts.py)
+artifact_store_path = os.environ.get("ACKREP_ARTIFACT_STORE_PATH")
+if not (artifact_store_path):
+    artifact_store_path = os.path.join(root_path, "ackrep_artifact_store")
+
 
 class ResultContainer(Container):
     """
@@ -68,6 +106,18 @@ class QueryError(Exception):
     pass
 
 
+class QueryTimeoutError(QueryError):
+    """Raised when a (sparql) query exceeds its time limit."""
+
+    pass
+
+
+class QueryBusyError(QueryError):
+    """Raised when a (sparql) query can not be started in time (e.g. because the query worker is still starting)."""
+
+    pass
+
+
 class DockerError(Exception):
     pass
 
@@ -144,23 +194,478 @@ def strip_decode(obj) -> str:
 
     # get rid of some (ipython-related boilerplate bytes (ended by \x07))
     if hasattr(obj, "split"):
-        delim = b"\x07"
+        delim = "\x07" if isinstance(obj, str) else b"\x07"
         obj = obj.split(delim)[-1]
     return utf8decode(obj)
 
 
-def run_command(arglist, logger=None, capture_output=True, **kwargs):
+# returncode of commands which were killed because they exceeded their time limit (`res.timed_out` is True)
+# (0: success, 1: failure, 2: inaccurate result, see execscript templates)
+TIMEOUT_RETURNCODE = 3
+
+
+def run_command(arglist, logger=None, capture_output=True, log_file_path=None, timeout=None, **kwargs):
     """
     Unified handling of calling commands.
     Automatically prints an error message if necessary.
+
+    If `capture_output` is True, the output is streamed (see StreamingProcess): it is passed line by line to
+    `logger.debug` and to the optional file `log_file_path` while the command runs, and only its beginning and its
+    end are kept in memory (see settings.COMMAND_OUTPUT_MAX_SIZE).
+
+    If `timeout` (seconds) is given, the command runs in its own process group. If it exceeds the time limit, the
+    whole group is terminated (see terminate_process_group) and the result has `res.timed_out == True` and
+    `res.returncode == TIMEOUT_RETURNCODE`.
+    """
+    if timeout is not None and os.name != "nt":
+        # allows to also kill the subprocesses of the command
+        kwargs["start_new_session"] = True
+
+    if capture_output:
+        res = StreamingProcess(arglist, logger=logger, log_file_path=log_file_path, timeout=timeout, **kwargs).wait()
+    else:
+        start_time = time.monotonic()
+        proc = subprocess.Popen(arglist, **kwargs)
+        returncode, resources, timed_out = wait_for_process(proc, start_time, timeout)
+        res = subprocess.CompletedProcess(arglist, returncode=returncode, stdout=None, stderr=None)
+        res.exited = res.returncode
+        res.resources = resources
+        res.timed_out = timed_out
+    log_command_error(arglist, res, logger)
+
+    return res
+
+
+def wait_for_process(proc, start_time, timeout=None):
+    """
+    Wait for the process to exit and measure the resources it used (including its waited-for children).
+    If the process exceeds `timeout`, its process group is terminated.
+
+    :param proc:        subprocess.Popen object
+    :param start_time:  value of time.monotonic() when the process was started
+    :param timeout:     None or time limit in seconds (measured from start_time)
+
+    :return:            3-tuple: returncode, resources dict (see get_resource_dict), timed_out (bool)
+    """
+    deadline = None if timeout is None else start_time + timeout
+    exited, rusage = _reap_process(proc, deadline)
+
+    timed_out = not exited
+    if timed_out:
+
+        def wait_func(grace_period):
+            nonlocal rusage
+            exited, rusage = _reap_process(proc, time.monotonic() + grace_period)
+            return exited
+
+        terminate_process_group(proc.pid, wait_func)
+        if proc.returncode is None:
+            _, rusage = _reap_process(proc)
+        proc.returncode = TIMEOUT_RETURNCODE
+
+    return proc.returncode, get_resource_dict(time.monotonic() - start_time, rusage), timed_out
+
+
+def _reap_process(proc, deadline=None):
+    """
+    Wait (until `deadline`, see time.monotonic) for the process to exit.
+
+    :return:    2-tuple: exited (bool), rusage (None if not available)
+    """
+    if proc.returncode is not None:
+        return True, None
+
+    if not hasattr(os, "wait4"):
+        try:
+            proc.wait(None if deadline is None else max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            return False, None
+        return True, None
+
+    # reap the process ourselves to get its resource usage (Popen.wait does not provide it)
+    delay = 0.001
+    while True:
+        try:
+            pid, status, rusage = os.wait4(proc.pid, 0 if deadline is None else os.WNOHANG)
+        except ChildProcessError:
+            # already reaped elsewhere (e.g. by Popen.poll)
+            proc.wait()
+            return True, None
+        if pid != 0:
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            return True, rusage
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False, None
+        time.sleep(min(delay, remaining))
+        delay = min(2 * delay, 0.05)
+
+
+def terminate_process_group(pgid, wait_func, grace_period=None):
+    """
+    Send SIGTERM to all processes of the group, give them `grace_period` seconds to exit and send SIGKILL to the
+    (remaining) processes of the group afterwards.
+
+    :param pgid:            id of the process group (the pid of its leader, see `start_new_session`)
+    :param wait_func:       callable(timeout) which waits for the leader and returns True if it exited
+    :param grace_period:    time in seconds between SIGTERM and SIGKILL
+                            (default: settings.PROCESS_TERMINATION_GRACE_PERIOD)
+    """
+    if grace_period is None:
+        grace_period = settings.PROCESS_TERMINATION_GRACE_PERIOD
+
+    if not hasattr(os, "killpg"):
+        # windows: no process groups
+        os.kill(pgid, signal.SIGTERM)
+        wait_func(grace_period)
+        return
+
+    _signal_process_group(pgid, signal.SIGTERM)
+    wait_func(grace_period)
+    # also kill processes which ignored SIGTERM or were left behind by the leader
+    _signal_process_group(pgid, signal.SIGKILL)
+
+
+def _signal_process_group(pgid, sig):
+    try:
+        os.killpg(pgid, sig)
+    except (ProcessLookupError, PermissionError):
+        # the group does not exist (anymore)
+        pass
+
+
+def get_resource_dict(wall_time, rusage=None):
+    """
+    :param wall_time:   elapsed time in seconds
+    :param rusage:      None or resource usage as returned by os.wait4 or resource.getrusage
+
+    :return:            dict with keys wall_time, user_time, system_time (s) and max_rss (MB)
+    """
+    resources = {"wall_time": round(wall_time, 2)}
+    if rusage is not None:
+        # ru_maxrss is measured in kB on linux, but in bytes on macOS
+        max_rss_unit = 1024**2 if sys.platform == "darwin" else 1024
+        resources["user_time"] = round(rusage.ru_utime, 2)
+        resources["system_time"] = round(rusage.ru_stime, 2)
+        resources["max_rss"] = round(rusage.ru_maxrss / max_rss_unit, 1)
+
+    return resources
+
+
+RESOURCE_USAGE_PREFIX = "Resource usage: "
+
+
+def format_resource_usage(resources: dict) -> str:
+    """return a single line which can be parsed from the output of a check (e.g. inside a container)"""
+    return RESOURCE_USAGE_PREFIX + json.dumps(resources, sort_keys=True)
+
+
+def parse_resource_usage(text: str):
+    """return the resources dict of the last line created by format_resource_usage (or None)"""
+    if not text:
+        return None
+    for line in reversed(text.splitlines()):
+        if line.startswith(RESOURCE_USAGE_PREFIX):
+            try:
+                return json.loads(line[len(RESOURCE_USAGE_PREFIX) :])
+            except ValueError:
+                return None
+    return None
+
+
+BATCH_RESULT_PREFIX = "ackrep-batch-result: "
+
+
+def format_batch_result(result: dict) -> str:
+    """return the single line which reports the result of one check of `ackrep --check-batch`"""
+    return BATCH_RESULT_PREFIX + json.dumps(result, ensure_ascii=False)
+
+
+def parse_batch_result(line: str):
+    """return the result dict of a line created by format_batch_result (or None for other lines)"""
+    if not line.startswith(BATCH_RESULT_PREFIX):
+        return None
+    try:
+        return json.loads(line[len(BATCH_RESULT_PREFIX) :])
+    except ValueError:
+        return None
+
+
+class BoundedTextBuffer:
+    """
+    Keep the head and the tail of a (potentially huge) text stream in memory, omit the middle part.
+    """
+
+    def __init__(self, max_size):
+        self.head_size = max_size // 2
+        self.tail_size = max_size - self.head_size
+        self.head = []
+        self.head_len = 0
+        self.tail = collections.deque()
+        self.tail_len = 0
+        self.omitted = 0
+
+    def write(self, text):
+        if self.head_len < self.head_size:
+            head_part = text[: self.head_size - self.head_len]
+            self.head.append(head_part)
+            self.head_len += len(head_part)
+            text = text[len(head_part) :]
+
+        if not text:
+            return
+
+        self.tail.append(text)
+        self.tail_len += len(text)
+        while self.tail_len > self.tail_size:
+            excess = self.tail_len - self.tail_size
+            first = self.tail[0]
+            if len(first) <= excess:
+                self.tail.popleft()
+                dropped = len(first)
+            else:
+                self.tail[0] = first[excess:]
+                dropped = excess
+            self.tail_len -= dropped
+            self.omitted += dropped
+
+    @property
+    def truncated(self):
+        return self.omitted > 0
+
+    def getvalue(self):
+        head = "".join(self.head)
+        tail = "".join(self.tail)
+        if self.omitted:
+            return f"{head}\n\n[... {self.omitted} characters omitted ...]\n\n{tail}"
+        return head + tail
+
+
+class PrefixLineCollector:
+    """
+    Split a text stream into lines and collect the complete lines which start with `prefix`. Other lines are
+    discarded as soon as their beginning does not match (i.e. only matching lines occupy memory).
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.head = ""
+        self.parts = []
+        self.discarding = False
+
+    def write(self, text):
+        """process the next part of the stream and return the list of completed matching lines"""
+        lines = []
+        for i, piece in enumerate(text.split("\n")):
+            if i > 0:
+                lines.extend(self.flush())
+            if self.discarding or not piece:
+                continue
+            if len(self.head) < len(self.prefix):
+                self.head += piece[: len(self.prefix) - len(self.head)]
+                if not self.prefix.startswith(self.head):
+                    self.discarding = True
+                    self.parts = []
+                    continue
+            self.parts.append(piece)
+        return lines
+
+    def flush(self):
+        """end the current line and return it (as list) if it matches"""
+        line = "".join(self.parts)
+        matches = not self.discarding and line.startswith(self.prefix)
+        self.head = ""
+        self.parts = []
+        self.discarding = False
+        return [line] if matches else []
+
+
+class StreamingProcess:
+    """
+    Run a command and consume its output while it runs (instead of buffering everything until it exits).
+
+    The output is
+        - passed line by line to `logger.debug` (if a logger is given),
+        - appended completely to the file `log_file_path` (if given),
+        - kept in memory only partially (beginning and end, see BoundedTextBuffer),
+        - available incrementally via `read_new()` (unread output beyond `max_output_size` is dropped),
+        - collected losslessly line by line via `read_lines()` for stdout lines starting with `line_prefix`.
+
+    `wait()` returns a CompletedProcess-like object, like `run_command`.
+    """
+
+    def __init__(
+        self, arglist, logger=None, log_file_path=None, max_output_size=None, timeout=None, line_prefix=None, **kwargs
+    ):
+        """
+        :param arglist:         command (passed to subprocess.Popen)
+        :param logger:          None or logger which receives the output (level DEBUG)
+        :param log_file_path:   None or path of a file which receives the complete output
+        :param max_output_size: number of characters per stream kept in memory
+                                (default: settings.COMMAND_OUTPUT_MAX_SIZE)
+        :param timeout:         None or time limit in seconds (see run_command and wait_for_process)
+        :param line_prefix:     None or str: complete stdout lines starting with it are kept (without size limit)
+                                until they are fetched with `read_lines()`
+        :param kwargs:          passed to subprocess.Popen (e.g. cwd, shell, env, start_new_session)
+        """
+        if max_output_size is None:
+            max_output_size = settings.COMMAND_OUTPUT_MAX_SIZE
+
+        self.arglist = arglist
+        self.logger = logger if type(logger) == logging.Logger else None
+        self.max_output_size = max_output_size
+        self.timeout = timeout
+        self.buffers = {"stdout": BoundedTextBuffer(max_output_size), "stderr": BoundedTextBuffer(max_output_size)}
+        self._unread = {"stdout": collections.deque(), "stderr": collections.deque()}
+        self._unread_len = {"stdout": 0, "stderr": 0}
+        self._line_collector = None if line_prefix is None else PrefixLineCollector(line_prefix)
+        self._lines = []
+        self._lock = threading.Lock()
+
+        self.log_file = None
+        if log_file_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(log_file_path)), exist_ok=True)
+            self.log_file = open(log_file_path, "w", encoding="utf8")
+
+        try:
+            self.start_time = time.monotonic()
+            pipes = self._start(arglist, **kwargs)
+        except Exception:
+            self._close_log_file()
+            raise
+
+        self._threads = []
+        for name, pipe in zip(("stdout", "stderr"), pipes):
+            thread = threading.Thread(target=self._pump, args=(name, pipe), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _start(self, arglist, **kwargs):
+        """
+        Start the process and return its stdout and stderr pipes (binary file objects). Subclasses can override this
+        to run something else than a command (see warm_workers.run_in_child).
+        """
+        self.proc = subprocess.Popen(arglist, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+        return self.proc.stdout, self.proc.stderr
+
+    def _pump(self, name, pipe):
+        """read one pipe until EOF (executed in a separate thread)"""
+        decoder = codecs.getincrementaldecoder("utf8")(errors="replace")
+        incomplete_line = ""
+        fd = pipe.fileno()
+        while True:
+            chunk = os.read(fd, 2**16)
+            text = decoder.decode(chunk, final=not chunk)
+            if text:
+                self._process_text(name, text)
+                if self.logger is not None and self.logger.isEnabledFor(logging.DEBUG):
+                    lines = (incomplete_line + text).split("\n")
+                    incomplete_line = lines.pop()
+                    if len(incomplete_line) > self.max_output_size:
+                        # output without newlines (e.g. progress bars using "\r") must not accumulate unbounded
+                        lines.append(incomplete_line)
+                        incomplete_line = ""
+                    for line in lines:
+                        self.logger.debug(f"[{name}] {line}")
+                else:
+                    incomplete_line = ""
+            if not chunk:
+                break
+        if incomplete_line:
+            self.logger.debug(f"[{name}] {incomplete_line}")
+        if name == "stdout" and self._line_collector is not None:
+            with self._lock:
+                self._lines.extend(self._line_collector.flush())
+        pipe.close()
+
+    def _process_text(self, name, text):
+        with self._lock:
+            self.buffers[name].write(text)
+            if name == "stdout" and self._line_collector is not None:
+                self._lines.extend(self._line_collector.write(text))
+
+            unread = self._unread[name]
+            unread.append(text)
+            self._unread_len[name] += len(text)
+            # do not accumulate unbounded output if nobody reads it
+            while self._unread_len[name] > self.max_output_size and len(unread) > 1:
+                self._unread_len[name] -= len(unread.popleft())
+
+            if self.log_file is not None:
+                # both streams are written to the same file (like in a terminal)
+                self.log_file.write(text)
+                self.log_file.flush()
+
+    def read_new(self, name="stdout") -> str:
+        """
+        Return the output of stream `name` ("stdout" or "stderr") which was received since the last call.
+        """
+        with self._lock:
+            text = "".join(self._unread[name])
+            self._unread[name].clear()
+            self._unread_len[name] = 0
+        return text
+
+    def read_lines(self) -> list:
+        """
+        Return the complete stdout lines starting with `line_prefix` which were received since the last call.
+        """
+        with self._lock:
+            lines = self._lines
+            self._lines = []
+        return lines
+
+    def poll(self):
+        return self.proc.poll()
+
+    def wait(self):
+        """
+        Wait for the process to exit and return a CompletedProcess-like object.
+        `res.stdout` and `res.stderr` contain the bounded output, `res.output_truncated` indicates omitted output,
+        `res.resources` contains the measured resource usage (see get_resource_dict), `res.timed_out` indicates
+        that the process was killed due to the timeout.
+        """
+        returncode, resources, timed_out = wait_for_process(self.proc, self.start_time, self.timeout)
+        return self._finish(returncode, resources, timed_out)
+
+    def _finish(self, returncode, resources, timed_out):
+        """
+        Wait until the output is read completely (the process has already exited) and return the result of `wait()`.
+        """
+        for thread in self._threads:
+            # after a timeout, processes outside of the killed group might still hold the pipes open
+            thread.join(5 if timed_out else None)
+        self._close_log_file()
+
+        stdout = strip_decode(self.buffers["stdout"].getvalue())
+        stderr = strip_decode(self.buffers["stderr"].getvalue())
+        res = subprocess.CompletedProcess(self.arglist, returncode=returncode, stdout=stdout, stderr=stderr)
+        res.exited = res.returncode
+        res.output_truncated = self.buffers["stdout"].truncated or self.buffers["stderr"].truncated
+        res.resources = resources
+        res.timed_out = timed_out
+
+        return res
+
+    def _close_log_file(self):
+        with self._lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+
+
+def log_command_error(arglist, res, logger=None):
+    """
+    Log an error message if the command (result `res`) exited with nonzero returncode.
     """
-    res = subprocess.run(arglist, capture_output=capture_output, **kwargs)
-    res.exited = res.returncode
-    res.stdout = strip_decode(res.stdout)
-    res.stderr = strip_decode(res.stderr)
     if res.returncode != 0:
+        if getattr(res, "timed_out", False):
+            reason = f"was killed after reaching its time limit (returncode {res.returncode})"
+        else:
+            reason = f"exited with returncode {res.returncode}"
         msg = f"""
-        The command `{' '.join(arglist)}` exited with returncode {res.returncode}.
+        The command `{' '.join(arglist)}` {reason}.
 
         stdout: {res.stdout}
 
@@ -169,8 +674,6 @@ def run_command(arglist, logger=None, capture_output=True, **kwargs):
         if type(logger) == logging.Logger:
             logger.error(msg)
 
-    return res
-
 
 def git_push(repo_path: str, files_to_add, message: str):
     repo = Repo(repo_path)
@@ -187,7 +690,3 @@ def find_nth(haystack, needle, n):
         start = haystack.find(needle, start + len(needle))
         n -= 1
     return start
-
-
-def timeout_handler(signum, frame):
-    raise TimeoutError(f"Process reached max time and was therefore canceled.")
@@ -0,0 +1,233 @@
+"""
+This module provides "warm" worker processes to run execscripts.
+
+Starting `python execscript.py` for every check means paying the interpreter startup and the import of numpy,
+scipy, sympy, matplotlib and ackrep_core (including `django.setup()`) before any real work happens.
+Instead, a forkserver process imports these modules once. Every check then runs in a freshly forked child of that
+server, i.e. it is still isolated from other checks (own `sys.modules`, own `sys.path`, own working directory)
+but starts with the heavy modules already loaded.
+
+The result mimics `util.run_command(["python", scriptpath])` (returncodes 0/1/2, decoded stdout and stderr).
+
+Note: the gain is only realized if several checks run from the same (long-living) process, e.g. bulk checks.
+As with every multiprocessing start method except "fork", the main module of the calling process must be
+import-safe (i.e. guarded by `if __name__ == "__main__":`), which is the case for the `ackrep` script and manage.py.
+"""
+
+import os
+import sys
+import json
+import time
+import runpy
+import resource
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from multiprocessing.connection import Connection
+
+from .util import (
+    log_command_error,
+    StreamingProcess,
+    get_resource_dict,
+    terminate_process_group,
+    TIMEOUT_RETURNCODE,
+)
+
+
+# modules which are imported once by the forkserver (import errors are silently ignored by multiprocessing)
+PRELOAD_MODULES = [
+    "numpy",
+    "scipy",
+    "scipy.integrate",
+    "sympy",
+    "matplotlib",
+    "matplotlib.pyplot",
+    "ackrep_core",
+    "ackrep_core.core",
+    "ackrep_core.system_model_management",
+]
+
+_context = None
+_context_lock = threading.Lock()
+
+
+def is_available() -> bool:
+    return "forkserver" in multiprocessing.get_all_start_methods()
+
+
+def get_context():
+    """
+    Return the multiprocessing context whose forkserver has preloaded the heavy modules. The server itself is
+    started lazily by multiprocessing (on the first check) and then reused.
+    """
+    global _context
+    with _context_lock:
+        if _context is None:
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload(PRELOAD_MODULES)
+            _context = ctx
+    return _context
+
+
+def run_script(scriptpath, logger=None, timeout=None, log_file_path=None):
+    """
+    Run the script in a child process forked from the warm forkserver.
+
+    :param scriptpath:      path to the execscript
+    :param logger:          logger for error messages (see util.run_command)
+    :param timeout:         None or time limit in seconds (the process group of the child is terminated if it is
+                            exceeded, see util.run_command)
+    :param log_file_path:   None or path of a file which receives the complete output
+
+    :return:            CompletedProcess-like object (attributes: args, returncode, exited, stdout, stderr,
+                        resources, timed_out)
+    """
+
+    arglist = ["python", scriptpath]
+    return run_in_child(_run_script, (scriptpath,), arglist, get_context(), logger, timeout, log_file_path)
+
+
+def run_in_child(func, args, arglist, ctx, logger=None, timeout=None, log_file_path=None):
+    """
+    Call `func(*args)` in a child process and collect its output like util.run_command.
+
+    :param func:            function which returns the returncode (raising SystemExit and other exceptions is
+                            handled like the interpreter does)
+    :param args:            tuple of arguments for func
+    :param arglist:         informative command line of the result (e.g. for log_command_error)
+    :param ctx:             multiprocessing context (e.g. get_context() or multiprocessing.get_context("fork"))
+    :param logger:          see run_script
+    :param timeout:         see run_script
+    :param log_file_path:   see run_script
+
+    :return:                see run_script
+    """
+
+    # the child is not a child of this process (but of the forkserver), thus it reports its resource usage itself
+    rusage_fd, rusage_path = tempfile.mkstemp(prefix="ackrep_rusage_")
+    os.close(rusage_fd)
+
+    # the output is streamed while the child runs (logger, log file and bounded buffers, see util.StreamingProcess)
+    child = _ChildProcess(func, args, ctx, rusage_path, arglist, logger=logger, log_file_path=log_file_path)
+    proc = child.proc
+    timed_out = False
+    try:
+        proc.join(timeout)
+        timed_out = proc.is_alive()
+    finally:
+        # also handles exceptions in the parent (e.g. KeyboardInterrupt)
+        if proc.is_alive():
+            # the child is the leader of its own process group (see _run_in_child)
+            terminate_process_group(proc.pid, lambda grace_period: proc.join(grace_period))
+            if proc.is_alive():
+                # the child was killed before it became a group leader
+                proc.kill()
+            proc.join()
+
+    returncode = TIMEOUT_RETURNCODE if timed_out else proc.exitcode
+    wall_time = time.monotonic() - child.start_time
+    try:
+        with open(rusage_path, "r") as f:
+            resources = json.load(f)
+        resources["wall_time"] = round(wall_time, 2)
+    except ValueError:
+        # the child was killed before it could report
+        resources = get_resource_dict(wall_time)
+    os.unlink(rusage_path)
+
+    res = child._finish(returncode, resources, timed_out)
+    log_command_error(arglist, res, logger)
+
+    return res
+
+
+class _ChildProcess(StreamingProcess):
+    """
+    StreamingProcess which calls `func(*args)` in a child process of the multiprocessing context instead of
+    running a command.
+    """
+
+    def __init__(self, func, args, ctx, rusage_path, arglist, **kwargs):
+        self.func = func
+        self.args = args
+        self.ctx = ctx
+        self.rusage_path = rusage_path
+        super().__init__(arglist, **kwargs)
+
+    def _start(self, arglist):
+        # pipes instead of the pipes of the multiprocessing Process: output is redirected on fd-level to also capture
+        # output of extension modules and subprocesses
+        pipes = [os.pipe() for _ in range(2)]
+        readers = [os.fdopen(read_fd, "rb", buffering=0) for read_fd, _ in pipes]
+        # Connection objects can be passed to the child (also via the forkserver)
+        writers = [Connection(write_fd, readable=False) for _, write_fd in pipes]
+        self.proc = self.ctx.Process(target=_run_in_child, args=(self.func, self.args, writers, self.rusage_path))
+        try:
+            # a child started by "fork" would otherwise inherit (and later also write) pending output of the parent
+            sys.stdout.flush()
+            sys.stderr.flush()
+            self.proc.start()
+        except BaseException:
+            for reader in readers:
+                reader.close()
+            raise
+        finally:
+            # only the child writes to the pipes (otherwise the readers would not receive EOF)
+            for writer in writers:
+                writer.close()
+        return readers
+
+
+def _run_in_child(func, args, writers, rusage_path):
+    """
+    Executed in the forked child: call func and exit with its returncode.
+    """
+
+    # allows the parent to also kill the subprocesses of the script on timeout
+    os.setpgid(0, 0)
+
+    for fd, writer in zip((1, 2), writers):
+        os.dup2(writer.fileno(), fd)
+        writer.close()
+
+    returncode = 0
+    try:
+        returncode = func(*args) or 0
+    except SystemExit as ex:
+        if ex.code is None:
+            returncode = 0
+        elif isinstance(ex.code, int):
+            returncode = ex.code
+        else:
+            print(ex.code, file=sys.stderr)
+            returncode = 1
+    except BaseException:
+        traceback.print_exc()
+        returncode = 1
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    # resources of this process and of the subprocesses it has waited for (wall_time is measured by the parent)
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    resources = get_resource_dict(0, own)
+    resources["user_time"] = round(own.ru_utime + children.ru_utime, 2)
+    resources["system_time"] = round(own.ru_stime + children.ru_stime, 2)
+    resources["max_rss"] = max(resources["max_rss"], get_resource_dict(0, children)["max_rss"])
+    with open(rusage_path, "w") as f:
+        json.dump(resources, f)
+
+    # skip the cleanup of the (inherited) interpreter state
+    os._exit(returncode)
+
+
+def _run_script(scriptpath):
+    """
+    Executed in the forked child: behave like `python scriptpath`.
+    """
+    script_dir = os.path.dirname(os.path.abspath(scriptpath))
+    os.chdir(script_dir)
+    sys.path.insert(0, script_dir)
+    sys.argv = [scriptpath]
+    runpy.run_path(scriptpath, run_name="__main__")
@@ -210,6 +210,23 @@ DEFAULT_ENVIRONMENT_KEY = "CDAMA"  # "YJBOX"
 
 ENTITY_TIMEOUT = 3 * 60  # s
 
+# time between SIGTERM and SIGKILL when the process group of a command which exceeded its time limit is terminated
+PROCESS_TERMINATION_GRACE_PERIOD = config("PROCESS_TERMINATION_GRACE_PERIOD", default=5, cast=float)  # s
+
+# number of characters of stdout (and stderr) of a command which are kept in memory (head and tail, see util.py)
+COMMAND_OUTPUT_MAX_SIZE = config("COMMAND_OUTPUT_MAX_SIZE", default=1000000, cast=int)
+
+# run execscripts in children of a forkserver with preloaded heavy modules (see ackrep_core/warm_workers.py)
+EXECSCRIPT_WARM_WORKERS = config("EXECSCRIPT_WARM_WORKERS", default=False, cast=bool)
+
+# limits for user-provided sparql queries (see ackrep_web.views.SearchSparqlView)
+SPARQL_QUERY_TIMEOUT = config("SPARQL_QUERY_TIMEOUT", default=10, cast=float)  # s
+SPARQL_RESULTS_PER_PAGE = config("SPARQL_RESULTS_PER_PAGE", default=50, cast=int)
+
+# limits for the cache of check results (see ackrep_core/result_cache.py); least recently used entries are evicted
+CHECK_RESULT_CACHE_MAX_ENTRIES = config("CHECK_RESULT_CACHE_MAX_ENTRIES", default=2000, cast=int)
+CHECK_RESULT_CACHE_MAX_SIZE = config("CHECK_RESULT_CACHE_MAX_SIZE", default=500, cast=float)  # MB
+
 try:
     with open(os.path.join(BASE_DIR, "deployment_date.txt")) as txtfile:
         LAST_DEPLOYMENT = txtfile.read().strip()
@@ -217,3 +234,32 @@ except FileNotFoundError:
     LAST_DEPLOYMENT = "<not available>"
 
 BASE_URL_FOR_PDF = "https://testing2.ackrep.org/"
+
+# time after which the environment image is compared with the registry again (see core.refresh_image)
+IMAGE_FRESHNESS_TTL = config("IMAGE_FRESHNESS_TTL", default=600, cast=float)  # s
+# number of environment images which are pulled concurrently (see core.prefetch_environment_images)
+IMAGE_PULL_JOBS = config("IMAGE_PULL_JOBS", default=4, cast=int)
+
+# bulk checks run several entities with one `ackrep --check-batch` process per container (see core.check_batch)
+# (images which do not support this option yet are detected and checked entity by entity)
+CHECK_BATCH = config("CHECK_BATCH", default=True, cast=bool)
+
+# pool containers which were not used for this time are stopped (see core.retire_idle_containers)
+CONTAINER_IDLE_TIMEOUT = config("CONTAINER_IDLE_TIMEOUT", default=1800, cast=float)  # s
+
+# execution of notebooks with pre-started jupyter kernels (see ackrep_core/notebook_execution.py)
+NOTEBOOK_KERNEL_POOL_SIZE = config("NOTEBOOK_KERNEL_POOL_SIZE", default=1, cast=int)
+NOTEBOOK_CELL_TIMEOUT = config("NOTEBOOK_CELL_TIMEOUT", default=600, cast=float)  # s
+
+# how containers are managed: "api" (docker engine api via unix socket), "cli" (docker command) or "auto" (api if the
+# socket is available, see ackrep_core/docker_backend.py)
+DOCKER_BACKEND = config("DOCKER_BACKEND", default="auto")
+
+# number of containers per environment which run checks concurrently (see core.ReplicaScheduler)
+CONTAINER_REPLICAS = config("CONTAINER_REPLICAS", default=1, cast=int)
+# resource limits of every environment container (0: no limit), e.g. the number of cpus divided by CONTAINER_REPLICAS
+CONTAINER_CPU_LIMIT = config("CONTAINER_CPU_LIMIT", default=0, cast=float)  # cpus
+CONTAINER_MEMORY_LIMIT = config("CONTAINER_MEMORY_LIMIT", default=0, cast=float)  # MB
+
+# time limit for loading the database when an environment container is started (see core.wait_for_container_ready)
+CONTAINER_READY_TIMEOUT = config("CONTAINER_READY_TIMEOUT", default=60, cast=float)  # s
@@ -193,6 +193,9 @@ class EntityDetailView(View):
             if c.result == "pending":
                 core.logger.warning(f"Entity {key} not found in any CI result files.")
                 c.result = -1
+            else:
+                # wall time, cpu time and peak memory of the check (only available for newer CI results)
+                c.resources = c.ci_result_entity.get("resources")
 
             ## system_model and solution specifics:
             if isinstance(c.entity, (models.ProblemSolution, models.SystemModel)):
@@ -235,6 +238,13 @@ class EntityDetailView(View):
                 c.test_date = c.ci_result_entity["date"]
                 c.issues = c.ci_result_entity["issues"]
                 c.diff_time_str = c.ci_result_entity["runtime"]
+            # check was killed because it exceeded settings.ENTITY_TIMEOUT
+            elif c.result == util.TIMEOUT_RETURNCODE:
+                c.result_css_class = "fail"
+                c.verbal_result = "Timeout. (Check exceeded the time limit.)"
+                c.test_date = c.ci_result_entity["date"]
+                c.issues = c.ci_result_entity["issues"]
+                c.diff_time_str = c.ci_result_entity["runtime"]
             # entity did not show in any result file
             elif c.result == -1:
                 c.result_css_class = "unknown"
@@ -421,14 +431,38 @@ class SearchSparqlView(View):
         qsrc = context["query"] = request.GET.get("query", example_query)
 
         try:
-            ackrep_entities, onto_entities = core.AOM.run_sparql_query_and_translate_result(qsrc)
+            page = max(int(request.GET.get("page", 1)), 1)
+        except ValueError:
+            page = 1
+        per_page = settings.SPARQL_RESULTS_PER_PAGE
+
+        c = util.Container()  # this could be used for further options
+        c.page = page
+        c.total = 0
+        try:
+            res = core.AOM.run_bounded_sparql_query(qsrc, limit=per_page, offset=(page - 1) * per_page)
+        except util.QueryTimeoutError as e:
+            context["err"] = f"The query was canceled: {str(e)} Consider making it more specific."
+            ackrep_entities, onto_entities = [], []
+        except util.QueryBusyError as e:
+            context["err"] = str(e)
+            ackrep_entities, onto_entities = [], []
         except Exception as e:
             context["err"] = f"The following error occurred: {str(e)}"
             ackrep_entities, onto_entities = [], []
+        else:
+            ackrep_entities, onto_entities = res.ackrep_entities, res.onto_entities
+            c.total = res.total
+
+        c.num_pages = max((c.total + per_page - 1) // per_page, 1)
+        c.first_index = min((page - 1) * per_page + 1, c.total)
+        c.last_index = min(page * per_page, c.total)
+        c.previous_page = page - 1 if page > 1 else None
+        c.next_page = page + 1 if page < c.num_pages else None
 
         context["ackrep_entities"] = ackrep_entities
         context["onto_entities"] = onto_entities
-        context["c"] = util.Container()  # this could be used for further options
+        context["c"] = c
 
         return TemplateResponse(request, "ackrep_web/search_sparql.html", context)
 